@@ -0,0 +1,33 @@
+# Generated by Django 5.2.1 on 2026-10-18 19:46
+
+import apps.common.models
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserArchive',
+            fields=[
+                ('id', models.UUIDField(editable=False, primary_key=True, serialize=False)),
+                ('deleted_at', models.DateTimeField(null=True)),
+                ('archived_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('data', models.JSONField(encoder=apps.common.models.ArchiveEncoder)),
+            ],
+            options={
+                'db_table': 'accounts_user_archive',
+                'ordering': ['-archived_at'],
+                'abstract': False,
+            },
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(condition=models.Q(('is_deleted', True)), fields=['deleted_at'], name='user_deleted_at_idx'),
+        ),
+    ]
@@ -4,7 +4,7 @@ from django.db import models
 from django.contrib.auth.models import AbstractBaseUser
 
 from apps.accounts.managers import CustomUserManager
-from apps.common.models import IsDeletedModel
+from apps.common.models import ArchivedRow, IsDeletedModel
 
 # Create your models here.
 
@@ -46,6 +46,12 @@ class User(AbstractBaseUser, IsDeletedModel):
 
     objects = CustomUserManager()
 
+    class Meta:
+        indexes = [
+            # Soft-deleted users, scanned by the archive_deleted command
+            models.Index(fields=["deleted_at"], condition=models.Q(is_deleted=True), name="user_deleted_at_idx"),
+        ]
+
     @property
     def full_name(self):
         """
@@ -74,3 +80,10 @@ class User(AbstractBaseUser, IsDeletedModel):
     def is_superuser(self):
         return self.is_staff
 
+
+class UserArchive(ArchivedRow):
+    """Soft-deleted users moved out of ``accounts_user``."""
+    source_model = User
+
+    class Meta(ArchivedRow.Meta):
+        db_table = "accounts_user_archive"
@@ -0,0 +1,196 @@
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.apps import apps
+from django.core import serializers
+from django.db import transaction
+from django.db.models import DateTimeField, Exists, FileField, OuterRef
+from django.utils import timezone
+
+from apps.common.models import ArchivedRow
+from apps.common.slugs import ReservedAutoSlugField
+
+
+class ArchiveError(Exception):
+    """Raised when archived rows cannot be restored, e.g. because a row they point to is gone."""
+
+
+def archive_models():
+    """
+        Every concrete ``ArchivedRow`` model, those removing rows that point at
+        another one's source first (reviews and products before users), so a
+        single pass frees and archives both.
+    """
+    remaining = [model for model in apps.get_models() if issubclass(model, ArchivedRow)]
+    ordered = []
+    while remaining:
+        for model in remaining:
+            referenced = any(
+                field.related_model is model.source_model
+                for other in remaining if other is not model
+                for removed in [other.source_model] + [relation.related_model for relation in owned_relations(other)]
+                for field in removed._meta.concrete_fields if field.is_relation
+            )
+            if not referenced:
+                break
+        remaining.remove(model)
+        ordered.append(model)
+    return ordered
+
+
+def archive_model_for(label):
+    """The archive of the live model ``label`` (``app_label.ModelName``)."""
+    source = apps.get_model(label)
+    for model in archive_models():
+        if model.source_model is source:
+            return model
+    raise LookupError(f"{label} is not archived")
+
+
+def owned_relations(archive_model):
+    relations = {relation.get_accessor_name(): relation for relation in archive_model.source_model._meta.related_objects}
+    return [relations[accessor] for accessor in archive_model.owned]
+
+
+def archivable(archive_model, days):
+    """
+        Rows of ``archive_model.source_model`` soft-deleted more than ``days``
+        days ago that nothing outside ``owned`` points at any more. Rows still
+        referenced, e.g. products and users of orders, stay in the live table:
+        deleting them would cascade into rows that must be kept.
+    """
+    source = archive_model.source_model
+    rows = source._base_manager.filter(is_deleted=True, deleted_at__lt=timezone.now() - timedelta(days=days))
+    for relation in source._meta.related_objects:
+        if relation.get_accessor_name() in archive_model.owned:
+            continue
+        referencing = relation.related_model._base_manager.filter(**{relation.field.name: OuterRef("pk")})
+        rows = rows.filter(~Exists(referencing))
+    return rows.order_by("pk")
+
+
+def serialize(rows):
+    return serializers.serialize("python", rows)
+
+
+def archive(archive_model, days, batch_size=500):
+    """
+        Moves the ``archivable`` rows into ``archive_model``, ``batch_size`` at a
+        time. Each batch is one transaction: the rows and their ``owned`` rows
+        are serialized and inserted into the archive table, then deleted from
+        the live tables, so a batch is either archived as a whole or left live.
+
+        Returns:
+            int: The number of rows archived.
+    """
+    relations = owned_relations(archive_model)
+    candidates = archivable(archive_model, days)
+    total = 0
+    while True:
+        with transaction.atomic():
+            batch = list(candidates[:batch_size])
+            if not batch:
+                return total
+            owned = defaultdict(dict)
+            for relation in relations:
+                related = list(relation.related_model._base_manager.filter(**{f"{relation.field.name}__in": batch}))
+                for row, doc in zip(related, serialize(related)):
+                    owned[getattr(row, relation.field.attname)].setdefault(relation.get_accessor_name(), []).append(doc)
+            archive_model.objects.bulk_create([
+                archive_model(id=row.pk, deleted_at=row.deleted_at, data={"row": doc, "owned": owned[row.pk]})
+                for row, doc in zip(batch, serialize(batch))
+            ])
+            # Re-checked by the DELETE, so a row referenced since it was read stays
+            candidates.filter(pk__in=[row.pk for row in batch]).delete()
+        total += len(batch)
+
+
+def restore(archive_model, pks):
+    """
+        Puts the archived rows ``pks`` back into their live table, still
+        soft-deleted, with their ``owned`` rows, and removes them from the
+        archive in one transaction. Slugs are kept unless a live row took them
+        meanwhile, in which case a new one is allocated.
+
+        Raises:
+            ArchiveError: When a row points at a row that is not live any more
+                (e.g. a review whose product was archived since).
+
+        Returns:
+            int: The number of rows restored.
+    """
+    archived = list(archive_model.objects.filter(pk__in=pks))
+    if not archived:
+        return 0
+    with transaction.atomic():
+        insert(archive_model.source_model, [entry.data["row"] for entry in archived])
+        for relation in owned_relations(archive_model):
+            accessor = relation.get_accessor_name()
+            insert(relation.related_model, [doc for entry in archived for doc in entry.data["owned"].get(accessor, [])])
+        archive_model.objects.filter(pk__in=[entry.pk for entry in archived]).delete()
+    return len(archived)
+
+
+def insert(model, docs):
+    """Inserts serialized ``docs`` of ``model`` as they were, in bulk."""
+    if not docs:
+        return
+    rows = [deserialized.object for deserialized in serializers.deserialize("python", docs)]
+    check_targets(model, rows)
+    for field in model._meta.concrete_fields:
+        if isinstance(field, ReservedAutoSlugField):
+            values = [getattr(row, field.attname) for row in rows]
+            taken = set(
+                model._base_manager.filter(**{f"{field.attname}__in": values}).values_list(field.attname, flat=True)
+            )
+            for row, value in zip(rows, values):
+                if value in taken:
+                    setattr(row, field.attname, None)
+                else:
+                    row._reserved_slugs = {**getattr(row, "_reserved_slugs", {}), field.attname: value}
+    # auto_now / auto_now_add would stamp the rows with the time of the restore
+    stamped = [
+        field for field in model._meta.concrete_fields
+        if isinstance(field, DateTimeField) and (field.auto_now or field.auto_now_add)
+    ]
+    stamps = [[getattr(row, field.attname) for field in stamped] for row in rows]
+    model._base_manager.bulk_create(rows)
+    if stamped:
+        for row, values in zip(rows, stamps):
+            for field, value in zip(stamped, values):
+                setattr(row, field.attname, value)
+        model._base_manager.bulk_update(rows, [field.name for field in stamped])
+
+
+def check_targets(model, rows):
+    for field in model._meta.concrete_fields:
+        if not field.is_relation:
+            continue
+        wanted = {getattr(row, field.attname) for row in rows} - {None}
+        found = set(field.related_model._base_manager.filter(pk__in=wanted).values_list("pk", flat=True))
+        if wanted - found:
+            raise ArchiveError(
+                f"{len(wanted - found)} {field.related_model._meta.label} row(s) referenced by "
+                f"{model._meta.label}.{field.name} are not live"
+            )
+
+
+def archived_file_references():
+    """
+        Counts the files named by archived rows (and their ``owned`` rows), so
+        media garbage collection keeps what a restore would need.
+    """
+    references = Counter()
+    for archive_model in archive_models():
+        fields = {
+            model._meta.label_lower: [field.name for field in model._meta.concrete_fields if isinstance(field, FileField)]
+            for model in [archive_model.source_model] + [relation.related_model for relation in owned_relations(archive_model)]
+        }
+        if not any(fields.values()):
+            continue
+        for data in archive_model.objects.values_list("data", flat=True).iterator():
+            for doc in [data["row"]] + [doc for docs in data["owned"].values() for doc in docs]:
+                for name in fields[doc["model"]]:
+                    if doc["fields"].get(name):
+                        references[doc["fields"][name]] += 1
+    return references
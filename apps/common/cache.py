@@ -0,0 +1,153 @@
+import hashlib
+import threading
+import time
+from collections import Counter
+from functools import wraps
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.response import Response
+
+from apps.common.conditional import get_validators, not_modified_response, set_validators
+
+CACHE_PREFIX = "catalog"
+STATS_KEYS = {
+    "hits": f"{CACHE_PREFIX}:stats:hits",
+    "misses": f"{CACHE_PREFIX}:stats:misses",
+}
+
+
+def _version_key(scope):
+    return f"{CACHE_PREFIX}:version:{scope}"
+
+
+def get_versions(scopes):
+    """
+        Return the current version counter of each scope, e.g. ``"category:laptops"``.
+
+        A missing counter (never bumped, or evicted) starts at the current time in
+        nanoseconds rather than 1, so it can never line up with a version that
+        was used before the eviction.
+    """
+    keys = [_version_key(scope) for scope in scopes]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, time.time_ns(), None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def bump_versions(*scopes):
+    """Invalidate every cached response that depends on one of ``scopes``."""
+    for scope in set(scopes):
+        key = _version_key(scope)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, time.time_ns(), None)
+
+
+# Hits and misses counted by this process since its last flush to the shared cache
+_pending_stats = Counter()
+_stats_lock = threading.Lock()
+_stats_flushed_at = time.monotonic()
+
+
+def _count(name):
+    """
+        Count a hit or miss in process memory; the totals are added to the shared
+        cache at most every ``CACHE_STATS_FLUSH_INTERVAL`` seconds, so serving a
+        cached response does not also write to the cache.
+    """
+    global _stats_flushed_at
+    with _stats_lock:
+        _pending_stats[name] += 1
+        interval = getattr(settings, "CACHE_STATS_FLUSH_INTERVAL", 60)
+        if time.monotonic() - _stats_flushed_at < interval:
+            return
+        _stats_flushed_at = time.monotonic()
+    flush_cache_stats()
+
+
+def flush_cache_stats():
+    """Add the counters of this process to the shared totals and reset them."""
+    with _stats_lock:
+        pending = dict(_pending_stats)
+        _pending_stats.clear()
+    for name, delta in pending.items():
+        key = STATS_KEYS[name]
+        try:
+            cache.incr(key, delta)
+        except ValueError:
+            if not cache.add(key, delta, None):
+                cache.incr(key, delta)
+
+
+def get_cache_stats():
+    """
+        Hit and miss counters of the response cache, summed over every process.
+
+        Counts other processes have not flushed yet are not included.
+
+        Returns:
+            dict: ``hits``, ``misses`` and ``hit_ratio`` (0 when nothing was served yet).
+    """
+    flush_cache_stats()
+    values = cache.get_many(STATS_KEYS.values())
+    stats = {name: values.get(key, 0) for name, key in STATS_KEYS.items()}
+    total = stats["hits"] + stats["misses"]
+    stats["hit_ratio"] = round(stats["hits"] / total, 4) if total else 0
+    return stats
+
+
+def response_cache_key(request, versions):
+    query = urlencode(sorted(request.query_params.lists()), doseq=True)
+    raw = "|".join([request.get_host(), request.path, query, str(request.version)] + [str(v) for v in versions])
+    return f"{CACHE_PREFIX}:response:{hashlib.md5(raw.encode()).hexdigest()}"
+
+
+def cache_response(*scopes, timeout=None):
+    """
+        Cache successful responses of an APIView handler.
+
+        The key is built from the host, path, sorted query string, API version and
+        the version counters of ``scopes``. Scopes may contain URL kwargs, e.g.
+        ``"category:{slug}"``. A hit returns the stored data without running the
+        handler, so neither the ORM nor the serializer is touched; writes call
+        ``bump_versions`` with the same scopes to make old entries unreachable.
+        ETag / Last-Modified set by the handler are stored with the entry, so a
+        conditional GET that hits the cache can be answered with a 304 as well.
+
+        Args:
+            scopes (str): Names of the version counters the response depends on.
+            timeout (int | None): Seconds to keep an entry, defaults to
+                ``settings.CATALOG_CACHE_TIMEOUT``.
+    """
+    def decorator(handler):
+        @wraps(handler)
+        def wrapper(self, request, *args, **kwargs):
+            versions = get_versions([scope.format(**kwargs) for scope in scopes])
+            key = response_cache_key(request, versions)
+            cached = cache.get(key)
+            if cached is not None:
+                _count("hits")
+                data, status, (etag, last_modified) = cached
+                response = etag and not_modified_response(request, etag, last_modified)
+                if not response:
+                    response = Response(data=data, status=status)
+                    if etag:
+                        set_validators(response, etag, last_modified)
+                response["X-Cache"] = "HIT"
+                return response
+
+            _count("misses")
+            response = handler(self, request, *args, **kwargs)
+            if isinstance(response, Response) and response.status_code == 200:
+                cache_timeout = timeout if timeout is not None else getattr(settings, "CATALOG_CACHE_TIMEOUT", 300)
+                cache.set(key, (response.data, response.status_code, get_validators(response)), cache_timeout)
+            response["X-Cache"] = "MISS"
+            return response
+        return wrapper
+    return decorator
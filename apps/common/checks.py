@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.core.checks import Error, register
+
+# Backends whose entries only live in the process that wrote them
+PROCESS_LOCAL_CACHES = (
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+)
+
+
+@register()
+def check_shared_cache(app_configs, **kwargs):
+    """
+        The default cache must be shared by every worker: a version bump (see
+        apps.common.cache), a cart or a throttle written by one process has to
+        be seen by the others.
+    """
+    backend = settings.CACHES.get("default", {}).get("BACKEND")
+    if backend in PROCESS_LOCAL_CACHES:
+        return [Error(
+            f"The default cache ({backend}) is local to each process.",
+            hint="Use Redis (set REDIS_URL), Memcached or the database cache.",
+            id="common.E001",
+        )]
+    return []
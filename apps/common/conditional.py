@@ -0,0 +1,73 @@
+import hashlib
+
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+
+
+def _make_etag(request, *parts):
+    raw = "|".join([request.get_full_path(), str(request.version)] + [str(part) for part in parts])
+    return quote_etag(hashlib.sha1(raw.encode()).hexdigest())
+
+
+def object_validators(request, obj):
+    """
+        ETag and Last-Modified of a single model instance, from its pk and ``update_at``.
+
+        Returns:
+            tuple: ``(etag, last_modified)``, the latter a Unix timestamp.
+    """
+    return _make_etag(request, obj.pk, obj.update_at.isoformat()), int(obj.update_at.timestamp())
+
+
+def queryset_validators(request, queryset):
+    """
+        ETag and Last-Modified of a list, from ``MAX(update_at)`` and the row count of
+        ``queryset`` in one aggregate query, so nothing has to be serialized first.
+        The count catches rows that were removed without touching ``update_at``.
+
+        Returns:
+            tuple: ``(etag, last_modified)``, the latter None for an empty list.
+    """
+    stats = queryset.order_by().aggregate(last_modified=Max("update_at"), count=Count("pk"))
+    last_modified = stats["last_modified"]
+    etag = _make_etag(request, stats["count"], last_modified.isoformat() if last_modified else "")
+    return etag, int(last_modified.timestamp()) if last_modified else None
+
+
+def version_validators(request, versions):
+    """
+        ETag of a cached list, from the version counters of the scopes it depends
+        on (see apps.common.cache), so the check costs no query however many rows
+        match. There is no Last-Modified: the counters do not carry a time.
+
+        Returns:
+            tuple: ``(etag, None)``.
+    """
+    return _make_etag(request, *versions), None
+
+
+def not_modified_response(request, etag, last_modified):
+    """
+        Evaluate If-None-Match / If-Modified-Since against the validators.
+
+        Returns:
+            HttpResponse | None: A 304 (or 412) response carrying the validators, or
+            None if the full response has to be sent.
+    """
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        set_validators(response, etag, last_modified)
+    return response
+
+
+def set_validators(response, etag, last_modified):
+    response["ETag"] = etag
+    if last_modified is not None:
+        response["Last-Modified"] = http_date(last_modified)
+    return response
+
+
+def get_validators(response):
+    """Read back the validators set on a response, as ``(etag, last_modified)``."""
+    return response.get("ETag"), parse_http_date_safe(response.get("Last-Modified", ""))
@@ -0,0 +1,254 @@
+import hashlib
+import logging
+import posixpath
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models.signals import post_save
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from apps.common.cache import bump_versions
+
+logger = logging.getLogger(__name__)
+
+# name: (max width, max height, Pillow format, file extension)
+VARIANTS = {
+    "thumb": (320, 320, "JPEG", "jpg"),
+    "thumb_webp": (320, 320, "WEBP", "webp"),
+    "webp": (1600, 1600, "WEBP", "webp"),
+}
+VARIANTS_DIR = "variants"
+# Seconds a partial set of variants is trusted before storage is probed again;
+# a complete set is kept until collect_media_garbage deletes its files
+PARTIAL_VARIANTS_TIMEOUT = 300
+
+# Image fields with derivatives, filled by register_image_variants: {model: (field names)}
+IMAGE_VARIANT_FIELDS = {}
+# Response cache scopes rendering a model's images, filled by register_variant_scopes:
+# {model: callable(queryset) -> scopes}
+IMAGE_VARIANT_SCOPES = {}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def variant_name(name, variant):
+    """
+        Storage name of a derivative, e.g. ``product_images/air.jfif`` ->
+        ``variants/product_images/air.jfif.thumb.jpg`` (or ``air.jfif.webp`` for
+        the ``webp`` variant). It only depends on the original's name, so URLs
+        can be built without touching the database.
+    """
+    extension = VARIANTS[variant][3]
+    suffix = extension if variant == extension else f"{variant}.{extension}"
+    return posixpath.join(VARIANTS_DIR, f"{name}.{suffix}")
+
+
+def original_name(derived):
+    """The original ``derived`` was made from (see ``variant_name``), or None if it is not a variant."""
+    prefix = VARIANTS_DIR + "/"
+    if not derived.startswith(prefix):
+        return None
+    # Longest first: ".webp" also ends ".thumb_webp.webp"
+    for suffix in sorted((variant_name("", variant)[len(prefix):] for variant in VARIANTS), key=len, reverse=True):
+        if derived.endswith(suffix):
+            return derived[len(prefix):-len(suffix)]
+    return None
+
+
+def _generated_key(name):
+    return f"images:variants:{hashlib.md5(name.encode()).hexdigest()}"
+
+
+def _remember(name, present):
+    present = [variant for variant in VARIANTS if variant in present]
+    cache.set(_generated_key(name), present, None if len(present) == len(VARIANTS) else PARTIAL_VARIANTS_TIMEOUT)
+    return set(present)
+
+
+def record_variants(storage, name):
+    """Probes which variants of ``name`` exist and records them, see ``generated_variants``."""
+    return _remember(name, [variant for variant in VARIANTS if storage.exists(variant_name(name, variant))])
+
+
+def forget_variants(names):
+    """Drops the records of ``names``, e.g. once their variants were deleted."""
+    cache.delete_many([_generated_key(name) for name in names])
+
+
+def generated_variants(storage, names):
+    """
+        The variants already written for each of ``names``, in one cache read.
+
+        ``generate_variants`` records what it writes, so storage is only probed
+        for names never seen before (or whose partial record expired).
+
+        Returns:
+            dict: ``{name: set of variant names}``.
+    """
+    keys = {name: _generated_key(name) for name in set(names) if name}
+    recorded = cache.get_many(keys.values())
+    return {
+        name: set(recorded[key]) if key in recorded else record_variants(storage, name)
+        for name, key in keys.items()
+    }
+
+
+def variant_urls(storage, name, present=None):
+    """
+        URLs of every variant of ``name``.
+
+        A variant that has not been generated yet (the worker is still busy, or
+        the file predates the pipeline and was not backfilled) falls back to the
+        original's URL, so clients never get a broken link.
+
+        Args:
+            present (set | None): The variants of ``name`` that exist, as
+                returned by ``generated_variants``; looked up when omitted.
+
+        Returns:
+            dict | None: ``{variant: url}``, or None when there is no image.
+    """
+    if not name:
+        return None
+    if present is None:
+        present = generated_variants(storage, [name])[name]
+    return {variant: storage.url(variant_name(name, variant) if variant in present else name) for variant in VARIANTS}
+
+
+def _encode(image, width, height, image_format):
+    image = image.copy()
+    image.thumbnail((width, height), Image.LANCZOS)
+    if image_format == "JPEG" and image.mode != "RGB":
+        image = image.convert("RGB")
+    elif image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+    buffer = BytesIO()
+    options = {"quality": 80, "optimize": True} if image_format == "JPEG" else {"quality": 80, "method": 4}
+    image.save(buffer, image_format, **options)
+    return buffer.getvalue()
+
+
+def generate_variants(storage, name, force=False):
+    """
+        Writes every missing variant of ``name`` next to the other derivatives.
+
+        The original is decoded once (with its EXIF orientation applied) and
+        each variant is downscaled from it, never upscaled.
+
+        Args:
+            storage (Storage): Storage holding the original and the variants.
+            name (str): Storage name of the original image.
+            force (bool): Regenerate variants that already exist.
+
+        Returns:
+            list: Names of the variants written.
+    """
+    pending = [variant for variant in VARIANTS if force or not storage.exists(variant_name(name, variant))]
+    if not pending or not storage.exists(name):
+        return []
+    try:
+        with storage.open(name, "rb") as original:
+            image = ImageOps.exif_transpose(Image.open(original))
+            image.load()
+    except (UnidentifiedImageError, OSError):
+        logger.warning("Cannot read image %s, no variants generated", name)
+        return []
+    written = []
+    for variant in pending:
+        width, height, image_format, _ = VARIANTS[variant]
+        derived = variant_name(name, variant)
+        if storage.exists(derived):
+            storage.delete(derived)
+        storage.save(derived, ContentFile(_encode(image, width, height, image_format)))
+        written.append(derived)
+    _remember(name, VARIANTS)
+    return written
+
+
+def _run(storage, name, scopes):
+    try:
+        if generate_variants(storage, name):
+            # Cached responses link the original until they are rebuilt
+            bump_versions(*scopes)
+    except Exception:
+        logger.exception("Generating variants of %s failed", name)
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, "IMAGE_VARIANT_WORKERS", 2), thread_name_prefix="image-variants"
+            )
+    return _executor
+
+
+def variant_scopes(queryset):
+    """Response cache scopes rendering the images of the rows of ``queryset``, see ``register_variant_scopes``."""
+    image_scopes = IMAGE_VARIANT_SCOPES.get(queryset.model)
+    return image_scopes(queryset) if image_scopes else []
+
+
+def schedule_variants(instance, field_names):
+    """
+        Queues variant generation for the images of ``instance`` once the
+        current transaction commits, so the request thread never decodes an image.
+    """
+    files = [getattr(instance, field_name) for field_name in field_names]
+    model = type(instance)
+    schedule_files(
+        [(file.storage, file.name) for file in files if file],
+        lambda: variant_scopes(model._base_manager.filter(pk=instance.pk)),
+    )
+
+
+def schedule_files(files, scopes=None):
+    """
+        Queues variant generation for ``(storage, name)`` pairs on commit, for rows
+        written without ``post_save`` (``bulk_create`` / ``update``).
+
+        Args:
+            scopes (callable | None): Returns the response cache scopes to bump
+                once a variant is written; called on commit, outside the transaction.
+    """
+    if not files:
+        return
+
+    def submit():
+        bumped = scopes() if scopes else []
+        executor = get_executor()
+        for storage, name in files:
+            executor.submit(_run, storage, name, bumped)
+
+    transaction.on_commit(submit)
+
+
+def register_image_variants(model, *field_names):
+    """
+        Generates variants of ``field_names`` in the background whenever a
+        ``model`` instance is saved. Call it from ``AppConfig.ready``.
+    """
+    IMAGE_VARIANT_FIELDS[model] = field_names
+
+    def on_save(sender, instance, update_fields=None, raw=False, **kwargs):
+        if raw or (update_fields is not None and not set(field_names) & set(update_fields)):
+            return
+        schedule_variants(instance, field_names)
+
+    post_save.connect(on_save, sender=model, weak=False, dispatch_uid=f"image_variants:{model._meta.label}")
+
+
+def register_variant_scopes(model, image_scopes):
+    """
+        Registers ``image_scopes(queryset)``, returning the response cache scopes
+        that render the images of the ``model`` rows in ``queryset``; they are
+        bumped once new variants are written. Call it from ``AppConfig.ready``.
+    """
+    IMAGE_VARIANT_SCOPES[model] = image_scopes
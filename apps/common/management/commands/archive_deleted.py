@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.common.archive import archivable, archive, archive_model_for, archive_models
+
+
+class Command(BaseCommand):
+    help = (
+        "Move rows soft-deleted more than --days days ago into their *_archive tables, in batches. "
+        "Rows other live rows still point at (e.g. products and users of orders) are kept."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=90, help="Archive rows deleted more than this many days ago (default: 90).")
+        parser.add_argument("--batch-size", type=int, default=500, help="Rows moved per transaction (default: 500).")
+        parser.add_argument(
+            "--model", action="append", dest="models", metavar="APP_LABEL.MODEL",
+            help="Only archive this model (repeatable), e.g. shop.Review.",
+        )
+        parser.add_argument("--dry-run", action="store_true", help="Only count the rows that would be archived.")
+
+    def handle(self, *args, **options):
+        try:
+            models = [archive_model_for(label) for label in options["models"]] if options["models"] else archive_models()
+        except LookupError as exc:
+            raise CommandError(exc)
+        for archive_model in models:
+            label = archive_model.source_model._meta.label
+            if options["dry_run"]:
+                self.stdout.write(f"{label}: would archive {archivable(archive_model, options['days']).count()} rows.")
+                continue
+            archived = archive(archive_model, options["days"], batch_size=options["batch_size"])
+            self.stdout.write(self.style.SUCCESS(f"{label}: {archived} rows archived."))
@@ -0,0 +1,129 @@
+import os
+import time
+from collections import Counter
+
+from django.apps import apps
+from django.core.files import File
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, FileField
+
+from apps.common.archive import archived_file_references
+from apps.common.images import VARIANTS, VARIANTS_DIR, forget_variants, original_name, variant_name
+from apps.common.storage import CONTENT_ADDRESSED_RE, ContentAddressedStorage
+
+
+def file_fields(storage_class=ContentAddressedStorage):
+    """(model, field) pairs of every FileField / ImageField kept in a ``storage_class`` storage."""
+    for model in apps.get_models():
+        for field in model._meta.concrete_fields:
+            if isinstance(field, FileField) and isinstance(field.storage, storage_class):
+                yield model, field
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete media files no row refers to any more. Files are counted per reference "
+        "(several rows may share one content-addressed file) and only unreferenced ones go."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dry-run", action="store_true", help="Only report what would be deleted.")
+        parser.add_argument(
+            "--min-age", type=int, default=3600,
+            help="Keep files younger than this many seconds; their row may not be committed yet (default: 3600).",
+        )
+        parser.add_argument(
+            "--rehash", action="store_true",
+            help="Move files uploaded before content addressing to their SHA-256 name and repoint the rows "
+                 "(the old copies are then removed by --include-legacy).",
+        )
+        parser.add_argument(
+            "--include-legacy", action="store_true",
+            help="Also delete unreferenced files that are not named by their content.",
+        )
+
+    def handle(self, *args, **options):
+        fields = list(file_fields())
+        if not fields:
+            self.stdout.write("No field uses ContentAddressedStorage, nothing to do.")
+            return
+        storage = fields[0][1].storage
+
+        if options["rehash"] and not options["dry_run"]:
+            moved = self.rehash(storage, fields)
+            self.stdout.write(f"{moved} legacy files moved to content-addressed names.")
+
+        references = self.count_references(fields)
+        shared = sum(1 for count in references.values() if count > 1)
+        self.stdout.write(f"{len(references)} files referenced by {sum(references.values())} rows, {shared} shared.")
+
+        keep = set(references)
+        keep.update(variant_name(name, variant) for name in references for variant in VARIANTS)
+        cutoff = time.time() - options["min_age"]
+        orphans = [
+            name for name in self.walk(storage, cutoff)
+            if name not in keep and (
+                options["include_legacy"]
+                or name.startswith((VARIANTS_DIR + "/", storage.incoming_dir + "/"))
+                or CONTENT_ADDRESSED_RE.match(name)
+            )
+        ]
+        if not options["dry_run"]:
+            # A file reused by an upload since the walk had its mtime refreshed, see ContentAddressedStorage
+            orphans = [name for name in orphans if os.path.getmtime(storage.path(name)) < cutoff]
+        freed = sum(storage.size(name) for name in orphans)
+        if not options["dry_run"]:
+            for name in orphans:
+                storage.delete(name)
+            # A re-upload of the same content must not be served the deleted variants
+            forget_variants({original_name(name) or name for name in orphans})
+        verb = "Would delete" if options["dry_run"] else "Deleted"
+        self.stdout.write(self.style.SUCCESS(f"{verb} {len(orphans)} files ({freed / 1024 / 1024:.1f} MiB)."))
+
+    def count_references(self, fields):
+        references = Counter()
+        for model, field in fields:
+            if isinstance(field.default, str) and field.default:
+                references[field.default] += 0
+            rows = (
+                model._base_manager.exclude(**{field.attname: ""}).exclude(**{f"{field.attname}__isnull": True})
+                .order_by().values_list(field.attname).annotate(count=Count("pk"))
+            )
+            for name, count in rows.iterator():
+                references[name] += count
+        # Archived rows get their files back on restore
+        references.update(archived_file_references())
+        return references
+
+    def walk(self, storage, cutoff):
+        """Storage names of the files last modified before ``cutoff``."""
+        root = storage.location
+        for directory, _, filenames in os.walk(root):
+            for filename in filenames:
+                path = os.path.join(directory, filename)
+                if os.path.getmtime(path) < cutoff:
+                    yield os.path.relpath(path, root).replace(os.sep, "/")
+
+    def rehash(self, storage, fields):
+        """
+            Saves every referenced file that is not content-addressed yet under its
+            SHA-256 name (identical files collapse into one) and updates the rows,
+            one UPDATE per file and field.
+        """
+        defaults = {field.default for _, field in fields}
+        legacy = {
+            name for name in self.count_references(fields)
+            if name not in defaults and not CONTENT_ADDRESSED_RE.match(name)
+        }
+        moved = 0
+        for name in sorted(legacy):
+            if not storage.exists(name):
+                continue
+            with storage.open(name, "rb") as file:
+                new_name = storage.save(name, File(file, name=os.path.basename(name)))
+            with transaction.atomic():
+                for model, field in fields:
+                    model._base_manager.filter(**{field.attname: name}).update(**{field.attname: new_name})
+            moved += 1
+        return moved
@@ -0,0 +1,68 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import django
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from apps.common.cache import bump_versions
+from apps.common.images import IMAGE_VARIANT_FIELDS, generate_variants, variant_scopes
+
+
+def _generate(label, field_name, name, force):
+    storage = apps.get_model(label)._meta.get_field(field_name).storage
+    return generate_variants(storage, name, force=force)
+
+
+class Command(BaseCommand):
+    # Image names per query when looking up the rows showing them
+    batch_size = 500
+    help = "Generate the thumbnail / WebP variants of every stored product, category and avatar image."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Worker processes (default: CPU count).")
+        parser.add_argument("--force", action="store_true", help="Regenerate variants that already exist.")
+
+    def handle(self, *args, **options):
+        jobs = set()
+        for model, field_names in IMAGE_VARIANT_FIELDS.items():
+            for field_name in field_names:
+                names = model._base_manager.exclude(**{field_name: ""}).exclude(**{f"{field_name}__isnull": True})
+                for name in names.values_list(field_name, flat=True).distinct().iterator():
+                    jobs.add((model._meta.label, field_name, name))
+        # Decoding and encoding is CPU bound, so the work is spread over processes;
+        # they only touch the storage, never the database.
+        connections.close_all()
+        written = failed = 0
+        generated = set()
+        with ProcessPoolExecutor(max_workers=options["workers"], initializer=django.setup) as executor:
+            futures = {executor.submit(_generate, *job, options["force"]): job for job in sorted(jobs)}
+            for future in as_completed(futures):
+                try:
+                    variants = future.result()
+                except Exception as exc:
+                    failed += 1
+                    self.stderr.write(f"{futures[future][2]}: {exc}")
+                    continue
+                written += len(variants)
+                if variants:
+                    generated.add(futures[future])
+        self.bump_scopes(generated)
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(jobs)} images processed, {written} variants written, {failed} failed."
+        ))
+
+    def bump_scopes(self, generated):
+        """Invalidates the cached responses still linking the originals of the ``generated`` jobs."""
+        names = {}
+        for label, field_name, name in generated:
+            names.setdefault((label, field_name), []).append(name)
+        scopes = set()
+        for (label, field_name), field_names in names.items():
+            rows = apps.get_model(label)._base_manager
+            for start in range(0, len(field_names), self.batch_size):
+                batch = field_names[start:start + self.batch_size]
+                scopes.update(variant_scopes(rows.filter(**{f"{field_name}__in": batch})))
+        if scopes:
+            bump_versions(*scopes)
@@ -0,0 +1,22 @@
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.common.archive import ArchiveError, archive_model_for, restore
+
+
+class Command(BaseCommand):
+    help = "Move archived rows back into their live table, still soft-deleted."
+
+    def add_arguments(self, parser):
+        parser.add_argument("model", metavar="APP_LABEL.MODEL", help="Model of the rows, e.g. shop.Product.")
+        parser.add_argument("ids", nargs="+", help="Primary keys of the rows to restore.")
+
+    def handle(self, *args, **options):
+        try:
+            restored = restore(archive_model_for(options["model"]), options["ids"])
+        except (LookupError, ValidationError, ArchiveError) as exc:
+            raise CommandError(exc)
+        missing = len(set(options["ids"])) - restored
+        if missing:
+            self.stderr.write(f"{missing} ids were not in the archive.")
+        self.stdout.write(self.style.SUCCESS(f"{restored} rows restored."))
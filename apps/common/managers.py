@@ -26,14 +26,16 @@ class IsDeletedQuerySet(GetOrNoneQuerySet):
         if hard_delete:
             return super().delete()
         else:
-            return self.update(is_deleted=True, delete_at=timezone.now())
+            return self.update(is_deleted=True, deleted_at=timezone.now())
 
 class IsDeletedManager(GetOrNoneManager):
+    queryset_class = IsDeletedQuerySet
+
     def get_queryset(self):
-        return IsDeletedQuerySet(self.model).filter(is_deleted=False)
+        return self.queryset_class(self.model).filter(is_deleted=False)
 
     def unfiltered(self):
-        return IsDeletedQuerySet(self.model)
+        return self.queryset_class(self.model)
 
     def hard_delete(self):
         return self.unfiltered().delete(hard_delete=True)
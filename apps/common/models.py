@@ -1,6 +1,8 @@
-from datetime import timezone, datetime
+from datetime import datetime
 
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
+from django.utils import timezone
 import uuid
 # Create your models here.
 
@@ -37,11 +39,47 @@ class IsDeletedModel(BaseModel):
 
     def delete(self, *args, **kwargs):
         self.is_deleted = True
-        # self.deleted_at = timezone.now()  # - xatolik AttributeError: type object 'datetime.timezone' has no attribute 'now'
-        self.deleted_at = datetime.now()
+        self.deleted_at = timezone.now()
 
         self.save(update_fields=["is_deleted", "deleted_at"])
 
     def hard_delete(self, *args, **kwargs):
         super().delete(*args, **kwargs)
 
+
+class ArchiveEncoder(DjangoJSONEncoder):
+    """``DjangoJSONEncoder`` keeping the microseconds of datetimes, so restored rows sort as before."""
+
+    def default(self, o):
+        if isinstance(o, datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+class ArchivedRow(models.Model):
+    """
+        A soft-deleted row moved out of its live table by the ``archive_deleted``
+        command (see apps.common.archive), until ``restore_archived`` puts it back.
+
+        Subclasses name the live model in ``source_model`` and the reverse
+        relations whose rows belong to it (e.g. a product's price history) in
+        ``owned``; those rows are archived and restored with it.
+
+        Attributes:
+            id (UUIDField): Primary key of the row in its live table.
+            deleted_at (DateTimeField): When the row was soft-deleted.
+            archived_at (DateTimeField): When the row was archived.
+            data (dict): ``{"row": ..., "owned": {accessor: [...]}}`` in the
+                ``python`` serialization format.
+    """
+    source_model = None
+    owned = ()
+
+    id = models.UUIDField(primary_key=True, editable=False)
+    deleted_at = models.DateTimeField(null=True)
+    archived_at = models.DateTimeField(default=timezone.now)
+    data = models.JSONField(encoder=ArchiveEncoder)
+
+    class Meta:
+        abstract = True
+        ordering = ["-archived_at"]
@@ -1,6 +1,171 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import json
+from collections import OrderedDict
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
 
 class CustomPagination(PageNumberPagination):
     page_size_query_param = 'page_size'  # Параметр запроса для изменения размера страницы
     max_page_size = 100  # Максимально допустимый размер страницы
 
+
+class KeysetPagination(BasePagination):
+    """
+        Cursor pagination over a composite key, e.g. ``(create_at, id)``.
+
+        Every page is fetched with ``WHERE key > last_key ORDER BY key LIMIT n``,
+        so it costs the same no matter how deep the client goes and no
+        ``COUNT(*)`` is run. The cursor is an opaque base64 token holding the
+        key of the last (or first) row of the current page.
+
+        Attributes:
+            orderings (dict): Maps an ``ordering`` query value to the fields
+                of the key. The last field must be unique (usually ``id``).
+            default_ordering (str): The ordering used when none is requested.
+    """
+    cursor_query_param = 'cursor'
+    ordering_query_param = 'ordering'
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    orderings = {}
+    default_ordering = None
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(request)
+
+        cursor = self.decode_cursor(request)
+        self.reverse = bool(cursor and cursor.get('r'))
+        ordering = self.reverse_ordering(self.ordering) if self.reverse else self.ordering
+
+        queryset = queryset.order_by(*ordering)
+        try:
+            if cursor is not None:
+                queryset = queryset.filter(self.get_keyset_filter(ordering, cursor['v']))
+            results = list(queryset[:self.page_size + 1])
+        except (ValidationError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        if self.reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, cursor is not None
+        return self.page
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def get_ordering(self, request):
+        name = request.query_params.get(self.ordering_query_param, self.default_ordering)
+        return self.orderings.get(name, self.orderings[self.default_ordering])
+
+    @staticmethod
+    def reverse_ordering(ordering):
+        return tuple(field[1:] if field.startswith('-') else '-' + field for field in ordering)
+
+    @staticmethod
+    def get_keyset_filter(ordering, values):
+        """
+            Builds ``(a, b) > (x, y)`` as ``a >= x AND (a > x OR (a = x AND b > y))``,
+            with the comparisons flipped for descending fields. The redundant
+            leading ``a >= x`` lets the database seek the index instead of
+            scanning it from the start.
+        """
+        keyset_filter = Q()
+        equal = Q()
+        for field, value in zip(ordering, values):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            keyset_filter |= equal & Q(**{f'{name}__{lookup}': value})
+            equal &= Q(**{name: value})
+        first = ordering[0]
+        lookup = 'lte' if first.startswith('-') else 'gte'
+        return Q(**{f'{first.lstrip("-")}__{lookup}': values[0]}) & keyset_filter
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def encode_cursor(self, row, reverse):
+        values = []
+        for field in self.ordering:
+            name = field.lstrip('-')
+            value = row[name] if isinstance(row, dict) else getattr(row, name)
+            values.append(value.isoformat() if hasattr(value, 'isoformat') else str(value))
+        data = {'v': values}
+        if reverse:
+            data['r'] = 1
+        token = base64.urlsafe_b64encode(json.dumps(data, separators=(',', ':')).encode()).decode()
+        return replace_query_param(self.base_url, self.cursor_query_param, token)
+
+    def decode_cursor(self, request):
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return None
+        try:
+            data = json.loads(base64.urlsafe_b64decode(token.encode()))
+            values = data['v']
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return data
+
+
+class ProductCursorPagination(KeysetPagination):
+    orderings = {
+        'newest': ('-create_at', '-id'),
+        'price': ('price_current', 'id'),
+        '-price': ('-price_current', '-id'),
+        'rating': ('-rating_avg', '-id'),
+    }
+    default_ordering = 'newest'
+
+
+class OrderCursorPagination(KeysetPagination):
+    orderings = {
+        'newest': ('-create_at', '-id'),
+    }
+    default_ordering = 'newest'
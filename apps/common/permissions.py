@@ -1,5 +1,7 @@
 from rest_framework import permissions
 
+from apps.sellers.principal import get_principal
+
 
 class IsOwner(permissions.BasePermission):
     def has_permission(self, request, view):
@@ -13,11 +15,12 @@ class IsOwner(permissions.BasePermission):
 class IsSeller(permissions.BasePermission):
     def has_permission(self, request, view):
         if (request.user.is_authenticated and request.user.account_type == 'SELLER' and
-        request.user.seller.is_approved) or request.user.is_staff:
+        get_principal(request).approved_seller) or request.user.is_staff:
             return True
 
     def has_object_permission(self, request, view, obj):
-        return obj.seller == request.user.seller or request.user.is_staff
+        seller = get_principal(request).seller
+        return (seller is not None and obj.seller_id == seller.id) or request.user.is_staff
 
 class IsAuthenticatedOrReadOnly(permissions.BasePermission):
     def has_permission(self, request, view):
@@ -0,0 +1,164 @@
+import re
+import secrets
+import string
+
+from autoslug import AutoSlugField
+from autoslug.utils import crop_slug, get_prepopulated_value
+from django.db import IntegrityError, transaction
+
+SUFFIX_ALPHABET = string.ascii_lowercase + string.digits
+SUFFIX_LENGTH = 6
+
+
+def random_suffix(length=SUFFIX_LENGTH):
+    return "".join(secrets.choice(SUFFIX_ALPHABET) for _ in range(length))
+
+
+def allocate_slugs(model, field, bases, exclude_pk=None, suffix_length=SUFFIX_LENGTH):
+    """
+        Unique slugs for ``bases`` (already slugified and cropped) in two queries
+        for the whole list instead of one probe per candidate and row.
+
+        A base that is free (in the table and in the list) is used as is. Every
+        other one gets a short random suffix, e.g. ``macbook-air-k3x9qa``; the
+        suffixed candidates are checked in one more query and the rare clash is
+        drawn again. Soft-deleted rows are included, since they still hold their
+        slug in the unique index.
+
+        Args:
+            model (Model): Model owning the slug field.
+            field (AutoSlugField): The slug field.
+            bases (list): Slug each row would get if it were free.
+            exclude_pk: Primary key of a row being updated, whose own slug is not a clash.
+            suffix_length (int): Length of the random suffix.
+
+        Returns:
+            list: One slug per base, in the same order.
+    """
+    manager = model._base_manager
+    if exclude_pk is not None:
+        manager = manager.exclude(pk=exclude_pk)
+
+    taken = set(manager.filter(**{f"{field.attname}__in": set(bases)}).values_list(field.attname, flat=True))
+    slugs = []
+    used = set()
+    pending = []
+    for i, base in enumerate(bases):
+        if base in taken or base in used:
+            pending.append(i)
+            slugs.append(None)
+        else:
+            used.add(base)
+            slugs.append(base)
+
+    head_length = field.max_length - suffix_length - len(field.index_sep)
+    while pending:
+        candidates = {
+            i: f"{bases[i][:head_length].rstrip(field.index_sep)}{field.index_sep}{random_suffix(suffix_length)}"
+            for i in pending
+        }
+        taken = set(
+            manager.filter(**{f"{field.attname}__in": set(candidates.values())}).values_list(field.attname, flat=True)
+        )
+        pending = []
+        for i, candidate in candidates.items():
+            if candidate in taken or candidate in used:
+                pending.append(i)
+            else:
+                used.add(candidate)
+                slugs[i] = candidate
+    return slugs
+
+
+def reserve_slugs(model, values, field_name="slug"):
+    """
+        Unique slugs for a batch of new ``model`` rows made from ``values``
+        (e.g. names), see ``allocate_slugs``.
+    """
+    field = model._meta.get_field(field_name)
+    return allocate_slugs(model, field, [field.base_slug(model, value) for value in values])
+
+
+def assign_slugs(instances, field_name="slug"):
+    """
+        Reserves slugs for a batch of unsaved instances with ``reserve_slugs`` and
+        sets them, so ``ReservedAutoSlugField`` keeps them on save / ``bulk_create``
+        instead of probing once per row.
+    """
+    if not instances:
+        return
+    field = instances[0]._meta.get_field(field_name)
+    slugs = reserve_slugs(
+        type(instances[0]), [get_prepopulated_value(field, instance) for instance in instances], field_name
+    )
+    for instance, slug in zip(instances, slugs):
+        setattr(instance, field.attname, slug)
+        instance._reserved_slugs = {**getattr(instance, "_reserved_slugs", {}), field.attname: slug}
+
+
+class ReservedAutoSlugField(AutoSlugField):
+    """
+        ``AutoSlugField`` whose unique slugs cost at most two queries.
+
+        ``AutoSlugField`` tries ``slug``, ``slug-2``, ``slug-3``... with one query
+        each, so a popular name gets slower to save with every product that
+        shares it. This field takes the plain slug when it is free and a random
+        suffix otherwise (see ``allocate_slugs``); a slug reserved for a batch
+        by ``assign_slugs`` is kept without any query. On update, a slug that
+        still belongs to the populated value (itself, or it plus a suffix) is
+        kept as well. ``unique_with`` is not supported, such fields fall back to
+        ``AutoSlugField``.
+
+        A concurrent save may still take the same slug between the check and
+        the INSERT; models using the field mix in ``ReservedSlugMixin`` to retry.
+    """
+    def base_slug(self, model, value):
+        slug = self.slugify(value) if value else ""
+        return self.slugify(crop_slug(self, slug or model._meta.model_name))
+
+    def owns(self, slug, base):
+        if slug == base:
+            return True
+        prefix = base + self.index_sep
+        suffix = slug[len(prefix):]
+        return slug.startswith(prefix) and bool(re.fullmatch(r"[a-z0-9]{%d}|\d+" % SUFFIX_LENGTH, suffix))
+
+    def pre_save(self, instance, add):
+        value = self.value_from_object(instance)
+        if value and getattr(instance, "_reserved_slugs", {}).get(self.attname) == value:
+            return value
+        if not self.unique or self.unique_with:
+            return super().pre_save(instance, add)
+
+        source = get_prepopulated_value(self, instance) if self.always_update or not value else value
+        base = self.base_slug(type(instance), source)
+        if add or not value or not self.owns(value, base):
+            value = allocate_slugs(type(instance), self, [base], exclude_pk=None if add else instance.pk)[0]
+        setattr(instance, self.attname, value)
+        return value
+
+
+class ReservedSlugMixin:
+    """
+        Retries ``save`` with a fresh slug when a concurrent save took the one
+        ``ReservedAutoSlugField`` picked, which surfaces as an IntegrityError
+        on the slug's unique index.
+    """
+    slug_attempts = 3
+
+    def save(self, *args, **kwargs):
+        for attempt in range(self.slug_attempts):
+            try:
+                with transaction.atomic():
+                    return super().save(*args, **kwargs)
+            except IntegrityError as exc:
+                fields = [
+                    field for field in self._meta.concrete_fields
+                    if isinstance(field, ReservedAutoSlugField) and field.column in str(exc)
+                ]
+                if not fields or attempt == self.slug_attempts - 1:
+                    raise
+                for field in fields:
+                    # Let pre_save allocate again; the rival's slug is visible now
+                    setattr(self, field.attname, None)
+                    getattr(self, "_reserved_slugs", {}).pop(field.attname, None)
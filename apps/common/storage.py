@@ -0,0 +1,112 @@
+import hashlib
+import os
+import posixpath
+import re
+import tempfile
+
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+
+# <upload_to>/<first two hex digits>/<sha256>.<ext>
+CONTENT_ADDRESSED_RE = re.compile(r"^(?:.+/)?[0-9a-f]{2}/[0-9a-f]{64}(?:\.\w+)?$")
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+        File system storage that names every file by the SHA-256 of its content.
+
+        An upload to ``product_images/MackBookAir.jfif`` is stored as
+        ``product_images/3f/3f9c...e1.jfif``. The digest is computed in the same
+        pass that writes the upload to a temporary file, which is then renamed
+        into place, so identical uploads end up as one file and a half written
+        file is never visible under its final name. A file may be shared by
+        several rows, so nothing deletes it when a row goes away; the
+        ``collect_media_garbage`` command removes the files no row refers to.
+
+        Attributes:
+            verbatim_dirs (tuple): Top-level directories whose files keep the name
+                they are saved under, e.g. image variants, which are already named
+                after their (content-addressed) original.
+            incoming_dir (str): Directory for uploads that are still being hashed.
+    """
+    verbatim_dirs = ("variants",)
+    incoming_dir = ".incoming"
+    chunk_size = 64 * 1024
+
+    def get_available_name(self, name, max_length=None):
+        # The final name is only known once the content is hashed, see _save()
+        return name
+
+    def content_name(self, name, digest):
+        directory, filename = posixpath.split(name)
+        extension = posixpath.splitext(filename)[1].lower()
+        return posixpath.join(directory, digest[:2], digest + extension)
+
+    def is_verbatim(self, name):
+        return name.split("/", 1)[0] in self.verbatim_dirs
+
+    def _save(self, name, content):
+        verbatim = self.is_verbatim(name)
+        if hasattr(content, "temporary_file_path") and not verbatim:
+            # Large uploads are already spooled to disk: hash the file and move it
+            source = content.temporary_file_path()
+            digest = hashlib.sha256()
+            with open(source, "rb") as file:
+                for chunk in iter(lambda: file.read(self.chunk_size), b""):
+                    digest.update(chunk)
+            final_name = self.content_name(name, digest.hexdigest())
+            if not self._reuse(final_name):
+                self._make_parent(final_name)
+                file_move_safe(source, self.path(final_name), allow_overwrite=True)
+                self._set_permissions(final_name)
+            return final_name
+
+        incoming = self.path(self.incoming_dir)
+        os.makedirs(incoming, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=incoming)
+        try:
+            digest = hashlib.sha256()
+            with os.fdopen(fd, "wb") as file:
+                for chunk in content.chunks(self.chunk_size):
+                    if isinstance(chunk, str):
+                        chunk = chunk.encode()
+                    digest.update(chunk)
+                    file.write(chunk)
+            final_name = name if verbatim else self.content_name(name, digest.hexdigest())
+            if verbatim or not self._reuse(final_name):
+                self._make_parent(final_name)
+                # Atomic on one file system; a concurrent identical upload just wins the race
+                os.replace(temp_path, self.path(final_name))
+                self._set_permissions(final_name)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        return final_name
+
+    def _reuse(self, name):
+        """
+            Refreshes the mtime of an identical file already stored as ``name``,
+            so ``collect_media_garbage --min-age`` leaves it alone until the row
+            of this upload is committed. False when there is no such file.
+        """
+        try:
+            os.utime(self.path(name))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def _make_parent(self, name):
+        directory = os.path.dirname(self.path(name))
+        if self.directory_permissions_mode is not None:
+            old_umask = os.umask(0o777 & ~self.directory_permissions_mode)
+            try:
+                os.makedirs(directory, self.directory_permissions_mode, exist_ok=True)
+            finally:
+                os.umask(old_umask)
+        else:
+            os.makedirs(directory, exist_ok=True)
+
+    def _set_permissions(self, name):
+        # mkstemp creates files as 0600; give them the mode a normal upload gets
+        mode = self.file_permissions_mode if self.file_permissions_mode is not None else 0o644
+        os.chmod(self.path(name), mode)
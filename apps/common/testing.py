@@ -0,0 +1,21 @@
+from apps.sellers.models import Seller
+
+# Tests counting queries swap in a process-local cache: the default DatabaseCache
+# (see CACHES in core/settings.py) would add its own reads and writes to the count
+PROCESS_CACHE = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+
+def create_seller(user, business_name="Shop One", is_approved=True, **fields):
+    """
+        Creates an (approved by default) seller profile for ``user``, with
+        placeholder values for the business and bank details unless ``fields``
+        gives them.
+    """
+    details = {
+        "inn_identification_number": "1", "phone_number": "1", "business_description": "d",
+        "business_address": "a", "city": "c", "postal_code": "1", "bank_name": "b", "bank_bic_number": "1",
+        "bank_account_number": "1", "bank_routing_numbers": "1",
+    }
+    return Seller.objects.create(
+        user=user, business_name=business_name, is_approved=is_approved, **{**details, **fields}
+    )
@@ -1,3 +1,492 @@
-from django.test import TestCase
+import os
+import re
+import tempfile
+import time
+import zipfile
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+
+from django.core.cache import cache, caches
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile, TemporaryUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, URLResolver, get_resolver
+from django.utils import timezone
+from PIL import Image
+from rest_framework.test import APIClient
+
+from apps.accounts.models import User, UserArchive
+from apps.common.archive import archived_file_references
+from apps.common.cache import flush_cache_stats, get_cache_stats, get_versions
+from apps.common.checks import check_shared_cache
+from apps.common.slugs import assign_slugs
+from apps.profiles.models import Order, OrderItem, SellerOrder, ShippingAddress
+from apps.common.testing import create_seller
+from apps.shop.models import Category, PriceHistory, Product, ProductArchive, Review, ReviewArchive
 
 # Create your tests here.
+
+# Tables that grow with the business and must never be read in full
+WATCHED_TABLES = (
+    "shop_product", "shop_pricehistory", "profiles_order", "profiles_orderitem", "profiles_sellerorder",
+    "profiles_sellerdailytotals", "profiles_sellerdailysales",
+)
+PLANNED_STATEMENTS = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH")
+# Scans of watched tables that are fine, as {plan detail pattern: statement pattern}
+ACCEPTED_SCANS = {
+    # Sorted pages walk the index of their ordering and stop after LIMIT (+ OFFSET) rows
+    r"SCAN shop_product USING INDEX (sqlite_autoindex_shop_product_1|product_(create_at|price|rating)_id_idx)":
+        r"LIMIT \d+( OFFSET \d+)?$",
+    # Page-number pagination counts the matching rows; ?pagination=cursor does not
+    r"SCAN shop_product USING (COVERING )?INDEX \w+": r'^SELECT COUNT\(\*\) AS "__count" FROM "shop_product" ',
+}
+URL_PARAM_RE = re.compile(r"<(?:(?P<converter>\w+):)?(?P<name>\w+)>")
+
+
+def iter_app_urls(patterns=None, prefix=""):
+    """
+        Yields ``(route, view_class)`` for every URL declared in ``apps/*/urls.py``.
+    """
+    if patterns is None:
+        patterns = get_resolver().url_patterns
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            yield from iter_app_urls(pattern.url_patterns, prefix + str(pattern.pattern))
+        elif isinstance(pattern, URLPattern) and pattern.callback.__module__.startswith("apps."):
+            yield prefix + str(pattern.pattern), pattern.callback.view_class
+
+
+def table_aliases(sql):
+    """
+        Maps every name a watched table goes by in ``sql`` (the table itself and
+        aliases such as ``U0``) back to the table.
+    """
+    aliases = {table: table for table in WATCHED_TABLES}
+    for table, alias in re.findall(r'"(%s)" (?:AS )?"?(\w+)"?' % "|".join(WATCHED_TABLES), sql):
+        if alias.upper() not in ("ON", "WHERE", "INNER", "LEFT", "ORDER", "GROUP", "LIMIT", "SET"):
+            aliases[alias] = table
+    return aliases
+
+
+class QueryPlanTests(TestCase):
+    """
+        Requests every API endpoint against a seeded database and runs
+        ``EXPLAIN QUERY PLAN`` on each statement it executes. A ``SCAN`` of a
+        watched table, plain or ``USING (COVERING) INDEX``, fails the test
+        unless ``ACCEPTED_SCANS`` lists it.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            "Seller", "One", "seller@example.com", "password", account_type="SELLER", is_staff=True
+        )
+        cls.seller = create_seller(cls.user)
+        buyer = User.objects.create_user("Buyer", "One", "buyer@example.com", "password")
+        cls.category = Category.objects.create(name="Laptops", image="category_images/laptops.jpg")
+        other_category = Category.objects.create(name="Ultrabooks", image="category_images/ultrabooks.jpg", parent=cls.category)
+        products = [
+            Product.objects.create(
+                seller=cls.seller, name=f"Product {i}", desc=f"Laptop number {i}",
+                price_current=Decimal(100 + i), category=cls.category if i % 2 else other_category,
+                in_stock=i, image1="product_images/p.jpg",
+            )
+            for i in range(1, 31)
+        ]
+        cls.product = products[0]
+        products[-1].delete()
+        Review.objects.create(user=buyer, product=cls.product, rating=4, text="good")
+        Review.objects.create(user=cls.user, product=cls.product, rating=5, text="great")
+        cls.shipping = ShippingAddress.objects.create(
+            user=cls.user, full_name="Seller One", email="seller@example.com", phone="1", address="a",
+            city="c", country="n", zipcode="1",
+        )
+        cls.order = Order.objects.create(user=cls.user, full_name="Seller One", email="seller@example.com")
+        ordered = OrderItem.objects.create(
+            user=cls.user, order=cls.order, product=products[1], quantity=2,
+            unit_price=products[1].price_current, line_total=products[1].price_current * 2,
+        )
+        SellerOrder.record(cls.order, [ordered], [{}])
+        OrderItem.objects.create(user=cls.user, product=products[2], quantity=1)
+
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=media_root.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def url_kwargs(self, route):
+        """
+            Fills the ``<converter:name>`` parts of ``route`` with seeded objects.
+        """
+        def value(match):
+            name = match.group("name")
+            head = route[:match.start()]
+            if name == "slug" and head.endswith("categories/"):
+                return self.category.slug
+            if name == "slug" and head.endswith("sellers/"):
+                return self.seller.slug
+            if name == "slug":
+                return self.product.slug
+            if name == "id":
+                return str(self.shipping.id)
+            if name == "tx_ref":
+                return self.order.tx_ref
+            self.fail(f"No fixture for URL parameter <{name}> in {route}")
+        return "/" + URL_PARAM_RE.sub(value, route)
+
+    def image(self, name):
+        jpeg = BytesIO()
+        Image.new("RGB", (8, 8), "red").save(jpeg, "JPEG")
+        return SimpleUploadedFile(name, jpeg.getvalue(), "image/jpeg")
+
+    def write_bodies(self):
+        """
+            ``{(method, route): (data, format)}`` for every write endpoint, in the
+            order they are sent; the other deletes come last so they do not remove
+            what the other requests use.
+        """
+        archive = BytesIO()
+        with zipfile.ZipFile(archive, "w") as zip_file:
+            zip_file.writestr("new.jpg", self.image("new.jpg").read())
+        csv = f"name,desc,price_current,category_slug,in_stock,image1\nImported,d,100,{self.category.slug},1,new.jpg"
+        product = {
+            "name": self.product.name, "desc": "d", "price_current": "150.00", "category_slug": self.category.slug,
+            "in_stock": 5,
+        }
+        address = {
+            "full_name": "Seller One", "email": "seller@example.com", "phone": "1", "address": "a", "city": "c",
+            "country": "n", "zipcode": "1",
+        }
+        seller = {
+            "business_name": "Shop One", "inn_identification_number": "1", "phone_number": "1",
+            "business_description": "d", "business_address": "a", "city": "c", "postal_code": "1", "bank_name": "b",
+            "bank_bic_number": "1", "bank_account_number": "1", "bank_routing_numbers": "1",
+        }
+        return {
+            ("post", "auth/"): ({"email": "new@example.com", "password": "password"}, "json"),
+            ("post", "auth/token/"): ({"email": "seller@example.com", "password": "password"}, "json"),
+            ("put", "profiles/"): ({"first_name": "Seller", "last_name": "One", "avatar": self.image("a.jpg")}, "multipart"),
+            ("post", "profiles/shipping_addresses/"): (address, "json"),
+            ("put", "profiles/shipping_addresses/detail/<uuid:id>/"): (address, "json"),
+            ("post", "sellers/"): (seller, "json"),
+            ("post", "sellers/products/"): ({**product, "name": "Created", "image1": self.image("n.jpg")}, "multipart"),
+            ("put", "sellers/product/<slug:slug>/"): ({**product, "image1": self.image("p.jpg")}, "multipart"),
+            ("post", "sellers/products/import/"): ({
+                "file": SimpleUploadedFile("products.csv", csv.encode(), "text/csv"),
+                "images": SimpleUploadedFile("images.zip", archive.getvalue(), "application/zip"),
+            }, "multipart"),
+            ("post", "sellers/products/prices/"): ({
+                "prices": [{"slug": self.product.slug, "price_current": "120.00"}],
+                "rules": [{"category_slug": self.category.slug, "percent": "-10"}],
+            }, "json"),
+            ("post", "shop/categories/"): ({"name": "Tablets", "image": self.image("c.jpg")}, "multipart"),
+            # The seeded review is edited and deleted first, so the POST creates one
+            ("put", "shop/review/product/<slug:slug>/"): ({"rating": 4, "text": "better"}, "json"),
+            ("delete", "shop/review/product/<slug:slug>/"): ({}, None),
+            ("post", "shop/reviews/product/<slug:slug>/"): ({"rating": 3, "text": "ok"}, "json"),
+            ("post", "shop/cart/batch/"): ({"items": [{"slug": self.product.slug, "quantity": 1}]}, "json"),
+            ("post", "shop/cart/"): ({"slug": self.product.slug, "quantity": 1}, "json"),
+            ("post", "shop/checkout/"): ({"shipping_id": str(self.shipping.id)}, "json"),
+            ("delete", "profiles/shipping_addresses/detail/<uuid:id>/"): ({}, None),
+            ("delete", "sellers/product/<slug:slug>/"): ({}, None),
+            ("delete", "profiles/"): ({}, None),
+        }
+
+    def requests(self):
+        """Yields ``(method, url, data, format)``: every GET with its variants, then every write."""
+        writes = []
+        for route, view_class in iter_app_urls():
+            writes += [(method, route) for method in ("post", "put", "patch", "delete") if hasattr(view_class, method)]
+            if not hasattr(view_class, "get"):
+                continue
+            url = self.url_kwargs(route)
+            if route.endswith("products/search/"):
+                yield "get", url, {"q": "laptop", "min_price": 105}, None
+                continue
+            yield "get", url, {}, None
+            if route.endswith("products/") or "categories/<" in route or "sellers/<" in route:
+                yield "get", url, {"min_price": 105, "in_stock": 1, "facets": "category,price,in_stock"}, None
+                for ordering in ("newest", "price", "-price", "rating"):
+                    yield "get", url, {"pagination": "cursor", "ordering": ordering, "page_size": 5}, None
+        bodies = self.write_bodies()
+        self.assertEqual(set(writes) - set(bodies), set(), "Write endpoints without a body in write_bodies")
+        for (method, route), (data, format) in bodies.items():
+            yield method, self.url_kwargs(route), data, format
+
+    def explain(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute("EXPLAIN QUERY PLAN " + sql)
+            return [row[-1] for row in cursor.fetchall()]
+
+    def accepted(self, detail, sql):
+        return any(
+            re.fullmatch(plan, detail) and re.search(statement, sql.strip())
+            for plan, statement in ACCEPTED_SCANS.items()
+        )
+
+    def test_no_full_table_scans(self):
+        if connection.vendor != "sqlite":
+            self.skipTest("Plans are checked with SQLite's EXPLAIN QUERY PLAN")
+        failures = []
+        for method, url, data, format in self.requests():
+            with self.subTest(method=method.upper(), url=url, data=data):
+                cache.clear()
+                with CaptureQueriesContext(connection) as queries:
+                    response = getattr(self.client, method)(url, data, format=format)
+                self.assertLess(response.status_code, 400, f"{method.upper()} {url}: {response.status_code}")
+                for query in queries:
+                    sql = query["sql"]
+                    if not sql.lstrip().upper().startswith(PLANNED_STATEMENTS):
+                        continue
+                    aliases = table_aliases(sql)
+                    for detail in self.explain(sql):
+                        match = re.match(r"SCAN (\w+)", detail)
+                        if match and match.group(1) in aliases and not self.accepted(detail, sql):
+                            failures.append(f"{method.upper()} {url} {data}: {detail}\n    {sql}")
+        self.assertFalse(failures, "Full table scans:\n" + "\n".join(failures))
+
+
+class SlugAllocationTests(TestCase):
+    """
+        ``ReservedAutoSlugField`` costs a constant number of queries, however many
+        rows already share the name; 10k same-named products serve as benchmark.
+    """
+    total = 10_000
+    batch_size = 1000
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name="Laptops", image="category_images/laptops.jpg")
+
+    def new_product(self, **kwargs):
+        return Product(
+            name="MacBook Air", desc="d", price_current=Decimal("999"), category=self.category,
+            image1="product_images/air.jpg", **kwargs,
+        )
+
+    def count_create_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.new_product().save()
+        return len(queries)
+
+    def test_batches_of_same_named_products(self):
+        with CaptureQueriesContext(connection) as queries:
+            for _ in range(self.total // self.batch_size):
+                batch = [self.new_product() for _ in range(self.batch_size)]
+                assign_slugs(batch)
+                Product.objects.bulk_create(batch)
+        # Two slug lookups per batch (a random suffix clash would add one); the
+        # INSERTs are split by the backend's parameter limit and not counted
+        lookups = [query for query in queries if query["sql"].startswith("SELECT")]
+        self.assertLessEqual(len(lookups), 2 * (self.total // self.batch_size) + 1)
+        slugs = Product.objects.values_list("slug", flat=True)
+        self.assertEqual(len(set(slugs)), self.total)
+        self.assertIn("macbook-air", slugs)
+
+    def test_single_saves_do_not_grow_with_same_named_rows(self):
+        first = self.count_create_queries()
+        second = self.count_create_queries()
+        batch = [self.new_product() for _ in range(self.total)]
+        assign_slugs(batch)
+        Product.objects.bulk_create(batch, batch_size=self.batch_size)
+        self.assertEqual(self.count_create_queries(), second)
+        self.assertLessEqual(second, first + 1)
+
+    def test_updates_keep_the_slug(self):
+        self.new_product().save()
+        product = self.new_product()
+        product.save()
+        slug = product.slug
+        product.desc = "changed"
+        with CaptureQueriesContext(connection) as queries:
+            product.save()
+        self.assertEqual(product.slug, slug)
+        self.assertFalse([query for query in queries if query["sql"].startswith("SELECT")])
+        self.category.name = "Notebooks"
+        self.category.save()
+        self.assertEqual(self.category.slug, "notebooks")
+
+    def test_same_named_sellers_get_distinct_slugs(self):
+        slugs = set()
+        for i in range(3):
+            user = User.objects.create_user("Seller", str(i), f"seller{i}@example.com", "password")
+            seller = create_seller(user, is_approved=False)
+            slugs.add(seller.slug)
+        self.assertEqual(len(slugs), 3)
+        self.assertIn("shop-one", slugs)
+
+
+class ArchiveTests(TestCase):
+    """
+        ``archive_deleted`` moves old soft-deleted rows into the archive tables
+        and ``restore_archived`` puts them back as they were.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.buyer = User.objects.create_user("Buyer", "One", "buyer@example.com", "password")
+        cls.category = Category.objects.create(name="Laptops", image="category_images/laptops.jpg")
+        cls.gone, cls.ordered, cls.live = [
+            Product.objects.create(
+                name=name, desc="d", price_current=Decimal("100"), category=cls.category,
+                image1=f"product_images/{i}.jpg",
+            )
+            for i, name in enumerate(["Gone", "Ordered", "Live"])
+        ]
+        PriceHistory.record([cls.gone])
+        cls.review = Review.objects.create(user=cls.buyer, product=cls.gone, rating=4, text="good")
+        cls.old_review = Review.objects.create(user=cls.buyer, product=cls.live, rating=2, text="meh")
+        order = Order.objects.create(user=cls.buyer, full_name="Buyer One", email="buyer@example.com")
+        OrderItem.objects.create(user=cls.buyer, order=order, product=cls.ordered, quantity=1)
+        cls.leaver = User.objects.create_user("Leaver", "One", "leaver@example.com", "password")
+        cls.recent = User.objects.create_user("Recent", "One", "recent@example.com", "password")
+
+        for row in (cls.gone, cls.ordered, cls.old_review, cls.leaver, cls.recent):
+            row.delete()
+        long_ago = timezone.now() - timedelta(days=100)
+        Product.objects.unfiltered().filter(pk__in=[cls.gone.pk, cls.ordered.pk]).update(deleted_at=long_ago)
+        Review.objects.unfiltered().filter(pk=cls.old_review.pk).update(deleted_at=long_ago)
+        User.objects.filter(pk=cls.leaver.pk).update(deleted_at=long_ago)
+
+    def archive(self):
+        call_command("archive_deleted", days=30, batch_size=1, stdout=StringIO())
+
+    def test_bulk_soft_delete_updates_ratings(self):
+        Review.objects.filter(product=self.gone).delete()
+        self.review.refresh_from_db()
+        self.assertTrue(self.review.is_deleted)
+        self.assertIsNotNone(self.review.deleted_at)
+        self.gone.refresh_from_db()
+        self.assertEqual((self.gone.rating_count, self.gone.rating_avg), (0, 0))
+
+    def test_archives_unreferenced_rows(self):
+        self.archive()
+        self.assertEqual(set(ProductArchive.objects.values_list("pk", flat=True)), {self.gone.pk})
+        self.assertEqual(set(ReviewArchive.objects.values_list("pk", flat=True)), {self.old_review.pk})
+        self.assertEqual(set(UserArchive.objects.values_list("pk", flat=True)), {self.leaver.pk})
+        self.assertFalse(Product.objects.unfiltered().filter(pk=self.gone.pk).exists())
+        self.assertFalse(PriceHistory.objects.filter(product_id=self.gone.pk).exists())
+        self.assertFalse(Review.objects.unfiltered().filter(product_id=self.gone.pk).exists())
+        # Still referenced by an order / deleted too recently
+        self.assertTrue(Product.objects.unfiltered().filter(pk=self.ordered.pk).exists())
+        self.assertTrue(User.objects.filter(pk=self.recent.pk).exists())
+        self.assertEqual(archived_file_references()["product_images/0.jpg"], 1)
+
+    def test_restore_brings_rows_back_as_they_were(self):
+        product = Product.objects.unfiltered().get(pk=self.gone.pk)
+        self.archive()
+        call_command("restore_archived", "shop.Product", str(self.gone.pk), stdout=StringIO())
+        restored = Product.objects.unfiltered().get(pk=self.gone.pk)
+        for field in ("slug", "create_at", "update_at", "deleted_at", "is_deleted", "price_current", "rating_count", "image1"):
+            self.assertEqual(getattr(restored, field), getattr(product, field), field)
+        self.assertEqual(PriceHistory.objects.filter(product=restored).count(), 1)
+        self.assertTrue(Review.objects.filter(pk=self.review.pk).exists())
+        self.assertFalse(ProductArchive.objects.exists())
+
+    def test_restore_allocates_a_new_slug_when_taken(self):
+        self.archive()
+        taken = Product.objects.create(
+            name="Gone", desc="d", price_current=Decimal("1"), category=self.category, image1="product_images/p.jpg",
+        )
+        call_command("restore_archived", "shop.Product", str(self.gone.pk), stdout=StringIO())
+        restored = Product.objects.unfiltered().get(pk=self.gone.pk)
+        self.assertEqual(taken.slug, "gone")
+        self.assertTrue(restored.slug.startswith("gone-"))
+
+    def test_restore_needs_the_rows_pointed_at(self):
+        self.archive()
+        Product.objects.unfiltered().filter(pk=self.live.pk).delete(hard_delete=True)
+        with self.assertRaises(CommandError):
+            call_command("restore_archived", "shop.Review", str(self.old_review.pk), stdout=StringIO())
+        self.assertTrue(ReviewArchive.objects.filter(pk=self.old_review.pk).exists())
+
+
+class ResponseCacheTests(TestCase):
+    """Writes bump the version counters in the shared cache, so every worker's next GET misses."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("Seller", "One", "seller@example.com", "password", account_type="SELLER")
+        seller = create_seller(cls.user)
+        category = Category.objects.create(name="Laptops", image="category_images/laptops.jpg")
+        cls.product = Product.objects.create(
+            seller=seller, name="Laptop", desc="d", price_current=Decimal(100), category=category,
+            image1="product_images/p.jpg",
+        )
+
+    def setUp(self):
+        flush_cache_stats()
+        cache.clear()
+
+    def get(self):
+        response = self.client.get("/shop/products/")
+        return response["X-Cache"], [product["slug"] for product in response.data["results"]]
+
+    def test_write_makes_the_next_get_miss(self):
+        self.assertEqual(self.get(), ("MISS", ["laptop"]))
+        self.assertEqual(self.get(), ("HIT", ["laptop"]))
+        version = get_versions(["products"])[0]
+        client = APIClient()
+        client.force_authenticate(self.user)
+        self.assertEqual(client.delete(f"/sellers/product/{self.product.slug}/").status_code, 200)
+        # A fresh connection to the backend, as another worker has, sees the bump
+        other_worker = caches.create_connection("default")
+        self.assertGreater(other_worker.get("catalog:version:products"), version)
+        self.assertEqual(self.get(), ("MISS", []))
+
+    def test_hits_and_misses_are_counted_without_writing_per_request(self):
+        self.get()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.get()[0], "HIT")
+        self.assertFalse([q["sql"] for q in queries if ":stats:" in q["sql"]])
+        self.assertEqual(get_cache_stats(), {"hits": 1, "misses": 1, "hit_ratio": 0.5})
+
+    def test_process_local_cache_is_refused(self):
+        self.assertEqual(check_shared_cache(None), [])
+        with override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}):
+            self.assertEqual([error.id for error in check_shared_cache(None)], ["common.E001"])
+
+
+class ContentAddressedStorageTests(TestCase):
+    """An upload that reuses an old identical file must survive a garbage collection running meanwhile."""
+
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=media_root.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.name = default_storage.save("product_images/a.jpg", ContentFile(b"same bytes"))
+        # Stored two hours ago by a row that has since been deleted
+        self.stored_at = time.time() - 7200
+        os.utime(default_storage.path(self.name), (self.stored_at, self.stored_at))
+
+    def collect(self):
+        call_command("collect_media_garbage", "--min-age", "3600", stdout=StringIO())
+        return default_storage.exists(self.name)
+
+    def test_reused_file_is_kept_until_its_row_commits(self):
+        self.assertEqual(default_storage.save("product_images/b.jpg", ContentFile(b"same bytes")), self.name)
+        self.assertGreater(os.path.getmtime(default_storage.path(self.name)), self.stored_at)
+        self.assertTrue(self.collect())
+
+    def test_reused_spooled_upload_refreshes_the_file(self):
+        upload = TemporaryUploadedFile("b.jpg", "image/jpeg", 10, None)
+        self.addCleanup(upload.close)
+        upload.write(b"same bytes")
+        upload.seek(0)
+        self.assertEqual(default_storage.save("product_images/b.jpg", upload), self.name)
+        self.assertGreater(os.path.getmtime(default_storage.path(self.name)), self.stored_at)
+        self.assertTrue(self.collect())
+
+    def test_unreferenced_old_file_is_collected(self):
+        self.assertFalse(self.collect())
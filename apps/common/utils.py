@@ -1,27 +1,133 @@
+import json
 import secrets
-from enum import unique
+import time
 
-from apps.common.models import BaseModel
+from django.core.files.storage import FileSystemStorage
+from django.http import StreamingHttpResponse
+from django.utils.encoding import filepath_to_uri
+from rest_framework.utils.encoders import JSONEncoder
 
-def generate_unique_code(model:BaseModel, field: str) ->str:
+
+# Crockford's base32: no I, L, O or U, so references survive being read out or retyped
+REFERENCE_ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+REFERENCE_VALUES = {char: value for value, char in enumerate(REFERENCE_ALPHABET)}
+REFERENCE_TIME_LENGTH = 9  # milliseconds since the epoch, enough until the year 3085
+REFERENCE_RANDOM_LENGTH = 5
+REFERENCE_LENGTH = REFERENCE_TIME_LENGTH + REFERENCE_RANDOM_LENGTH + 1
+
+
+def _encode_base32(number, length):
+    chars = []
+    for _ in range(length):
+        number, digit = divmod(number, 32)
+        chars.append(REFERENCE_ALPHABET[digit])
+    return "".join(reversed(chars))
+
+
+def _check_char(payload):
+    # Luhn mod 32: catches every single character typo and most swaps
+    total = 0
+    factor = 2
+    for char in reversed(payload):
+        addend = factor * REFERENCE_VALUES[char]
+        total += addend // 32 + addend % 32
+        factor = 3 - factor
+    return REFERENCE_ALPHABET[-total % 32]
+
+
+def generate_references(count=1, now=None):
     """
-        Generate a unique code for a specified model and field.
+        References such as ``1K7VXQJ00H97X8N``, generated without any query.
+
+        A reference is the time in milliseconds, 25 random bits and a check
+        character. The time prefix keeps new rows at the end of the unique
+        index; two references only collide when they are drawn in the same
+        millisecond with the same random part, which the unique index turns
+        into an IntegrityError for the caller to retry. The references of one
+        batch share the time prefix and never repeat.
 
         Args:
-            model (BaseModel): The model class to check for uniqueness.
-            field (str): The field name to check for uniqueness.
+            count (int): How many references to generate.
+            now (float | None): Timestamp in seconds, defaults to the current time.
 
         Returns:
-            str: A unique code.
+            list: ``count`` distinct references, in ascending order.
     """
-    allowed_chars = "ABCDEFGHIJKLMNOPQRSTUVWXYZ123456789"
-    unique_code = "".join(secrets.choice(allowed_chars) for _ in range(12))
-    similar_object_exists = model.objects.filter(**{field: unique_code}).exists()
-    if not similar_object_exists:
-        return unique_code
-    return generate_unique_code(model, field)
+    prefix = _encode_base32(int((time.time() if now is None else now) * 1000), REFERENCE_TIME_LENGTH)
+    randoms = set()
+    while len(randoms) < count:
+        randoms.add(secrets.randbits(5 * REFERENCE_RANDOM_LENGTH))
+    references = []
+    for number in sorted(randoms):
+        payload = prefix + _encode_base32(number, REFERENCE_RANDOM_LENGTH)
+        references.append(payload + _check_char(payload))
+    return references
+
+
+def generate_reference():
+    return generate_references(1)[0]
+
+
+def is_valid_reference(code):
+    """Whether ``code`` is a well-formed reference from ``generate_references`` (checksum included)."""
+    code = code.upper()
+    if len(code) != REFERENCE_LENGTH or any(char not in REFERENCE_VALUES for char in code):
+        return False
+    return _check_char(code[:-1]) == code[-1]
+
 
 def set_dict_attr(obj, data):
     for attr, value in data.items():
         setattr(obj, attr, value) # Ili obj.attr = value dlya kajdogo atributa
-    return obj
\ No newline at end of file
+    return obj
+
+def stream_ndjson(queryset, serializer_class, chunk_size=500):
+    """
+        Stream a queryset as newline-delimited JSON, one serialized object per line.
+
+        Rows are read with ``queryset.iterator(chunk_size=...)`` and written out one
+        chunk at a time, so memory use stays flat however many rows there are.
+
+        Args:
+            queryset (QuerySet): The rows to stream.
+            serializer_class: The serializer used for each row.
+            chunk_size (int): Rows fetched from the database and yielded per chunk.
+
+        Returns:
+            StreamingHttpResponse: An ``application/x-ndjson`` response.
+    """
+    def lines():
+        chunk = []
+        for obj in queryset.iterator(chunk_size=chunk_size):
+            chunk.append(obj)
+            if len(chunk) >= chunk_size:
+                yield render(chunk)
+                chunk = []
+        if chunk:
+            yield render(chunk)
+
+    def render(chunk):
+        # Serialized as one list, so per-page lookups (e.g. image variants) run once per chunk
+        data = serializer_class(chunk, many=True).data
+        return "".join(json.dumps(item, cls=JSONEncoder, ensure_ascii=False) + "\n" for item in data)
+
+    return StreamingHttpResponse(lines(), content_type="application/x-ndjson")
+
+
+def storage_url_function(storage):
+    """
+        Return a function equivalent to ``storage.url`` for building many URLs quickly.
+
+        For a plain ``FileSystemStorage`` the URL is ``base_url`` plus the quoted name, so
+        ``urljoin`` is skipped unless the name has dot segments it would resolve.
+    """
+    if storage.__class__.url is not FileSystemStorage.url:
+        return storage.url
+
+    def url(name):
+        base_url = storage.base_url
+        if not base_url or not base_url.endswith("/") or "/." in "/" + name:
+            return storage.url(name)
+        return base_url + filepath_to_uri(name).lstrip("/")
+
+    return url
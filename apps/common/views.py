@@ -1,3 +1,30 @@
-from django.shortcuts import render
+from drf_spectacular.utils import extend_schema, inline_serializer
+from rest_framework import serializers
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from apps.common.cache import get_cache_stats
 
 # Create your views here.
+
+class CacheStatsView(APIView):
+    permission_classes = [IsAdminUser]
+
+    @extend_schema(
+        summary="Response Cache Stats",
+        description="""
+                This endpoint returns the hit and miss counters of the catalog response cache.
+            """,
+        tags=["Common"],
+        responses=inline_serializer(
+            name="CacheStats",
+            fields={
+                "hits": serializers.IntegerField(),
+                "misses": serializers.IntegerField(),
+                "hit_ratio": serializers.FloatField(),
+            },
+        ),
+    )
+    def get(self, request, *args, **kwargs):
+        return Response(data=get_cache_stats(), status=200)
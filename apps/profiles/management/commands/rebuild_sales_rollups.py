@@ -0,0 +1,25 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.profiles.models import SALES_ROLLUPS
+
+
+class Command(BaseCommand):
+    help = "Recompute the seller sales rollups from the paid orders, for all days or a date range."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--since", type=self.parse_day, help="First day to rebuild (YYYY-MM-DD).")
+        parser.add_argument("--until", type=self.parse_day, help="Last day to rebuild (YYYY-MM-DD).")
+
+    @staticmethod
+    def parse_day(value):
+        try:
+            return date.fromisoformat(value)
+        except ValueError:
+            raise CommandError(f"Invalid date: {value}")
+
+    def handle(self, *args, **options):
+        for rollup in SALES_ROLLUPS:
+            written = rollup.rebuild(since=options["since"], until=options["until"])
+            self.stdout.write(self.style.SUCCESS(f"{rollup._meta.verbose_name_plural}: {written} rows rebuilt."))
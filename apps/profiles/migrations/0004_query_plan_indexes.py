@@ -0,0 +1,24 @@
+# Generated by Django 5.2.1 on 2026-10-18 18:52
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('profiles', '0003_order_address_order_city_order_country_order_email_and_more'),
+        ('shop', '0005_product_rating_aggregates'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', 'create_at'], name='order_user_create_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='orderitem',
+            index=models.Index(condition=models.Q(('order__isnull', True)), fields=['user', 'product'], name='orderitem_cart_idx'),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.2.1 on 2026-10-18 19:21
+
+from django.db import migrations, models
+from django.db.models import DecimalField, F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def snapshot_totals(apps, schema_editor):
+    # Orders placed before the snapshot columns: use the current prices, the best there is
+    Order = apps.get_model('profiles', 'Order')
+    OrderItem = apps.get_model('profiles', 'OrderItem')
+    Product = apps.get_model('shop', 'Product')
+    price = Subquery(Product.objects.filter(pk=OuterRef('product_id')).values('price_current'))
+    OrderItem.objects.filter(order__isnull=False).update(unit_price=price)
+    OrderItem.objects.filter(order__isnull=False).update(line_total=F('unit_price') * F('quantity'))
+    line_totals = (
+        OrderItem.objects.filter(order=OuterRef('pk')).order_by().values('order')
+        .annotate(sum=Sum('line_total')).values('sum')
+    )
+    subtotal = Coalesce(Subquery(line_totals), 0, output_field=DecimalField(max_digits=12, decimal_places=2))
+    Order.objects.update(subtotal=subtotal, total=subtotal)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('profiles', '0004_query_plan_indexes'),
+        ('shop', '0010_category_reserved_slug'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='subtotal',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='line_total',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=12, null=True),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='unit_price',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True),
+        ),
+        migrations.RunPython(snapshot_totals, migrations.RunPython.noop),
+    ]
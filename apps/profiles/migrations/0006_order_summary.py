@@ -0,0 +1,74 @@
+# Generated by Django 5.2.1 on 2026-10-18 19:26
+
+from django.conf import settings
+from decimal import Decimal
+
+from django.db import migrations, models
+
+CENT = Decimal('0.01')
+
+
+def line_summary(item):
+    # Same document as OrderLineSerializer
+    product = item.product
+    seller = product.seller
+    return {
+        'product': {
+            'seller': {'name': seller.business_name, 'slug': seller.slug} if seller else None,
+            'name': product.name,
+            'slug': product.slug,
+            'image': product.image1.url if product.image1 else None,
+        },
+        'quantity': item.quantity,
+        'unit_price': str(item.unit_price.quantize(CENT)),
+        'total': str(item.line_total.quantize(CENT)),
+    }
+
+
+def fill_summaries(apps, schema_editor):
+    Order = apps.get_model('profiles', 'Order')
+    OrderItem = apps.get_model('profiles', 'OrderItem')
+    orders = Order.objects.select_related('user').order_by('pk')
+    last_pk = None
+    while True:
+        batch = list((orders.filter(pk__gt=last_pk) if last_pk else orders)[:500])
+        if not batch:
+            break
+        lines = {order.pk: [] for order in batch}
+        items = OrderItem.objects.filter(order__in=batch).select_related('product__seller').order_by('-create_at')
+        for item in items:
+            lines[item.order_id].append(line_summary(item))
+        for order in batch:
+            user = order.user
+            order.summary = {
+                'buyer': {'first_name': user.first_name, 'last_name': user.last_name, 'email': user.email},
+                'items': lines[order.pk],
+            }
+        Order.objects.bulk_update(batch, ['summary'])
+        last_pk = batch[-1].pk
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('profiles', '0005_order_totals'),
+        ('sellers', '0002_unique_slug'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='order',
+            name='order_user_create_at_idx',
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='summary',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.RunPython(fill_summaries, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', 'create_at', 'id'], name='order_user_create_at_idx'),
+        ),
+    ]
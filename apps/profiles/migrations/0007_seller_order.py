@@ -0,0 +1,88 @@
+# Generated by Django 5.2.1 on 2026-10-18 19:28
+
+import django.db.models.deletion
+import uuid
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+CENT = Decimal('0.01')
+
+
+def line_summary(item):
+    # Same document as OrderLineSerializer
+    product = item.product
+    seller = product.seller
+    return {
+        'product': {
+            'seller': {'name': seller.business_name, 'slug': seller.slug},
+            'name': product.name,
+            'slug': product.slug,
+            'image': product.image1.url if product.image1 else None,
+        },
+        'quantity': item.quantity,
+        'unit_price': str(item.unit_price.quantize(CENT)),
+        'total': str(item.line_total.quantize(CENT)),
+    }
+
+
+def fill_seller_orders(apps, schema_editor):
+    Order = apps.get_model('profiles', 'Order')
+    OrderItem = apps.get_model('profiles', 'OrderItem')
+    SellerOrder = apps.get_model('profiles', 'SellerOrder')
+    items = (
+        OrderItem.objects.filter(order__isnull=False, product__seller__isnull=False)
+        .select_related('product__seller').order_by('order_id', '-create_at')
+    )
+    batch = {}
+    last_order_id = None
+    for item in items.iterator(chunk_size=2000):
+        # Flush between orders only, so one order's rows are never split
+        if item.order_id != last_order_id and len(batch) >= 1000:
+            SellerOrder.objects.bulk_create(batch.values())
+            batch = {}
+        last_order_id = item.order_id
+        key = (item.order_id, item.product.seller_id)
+        seller_order = batch.get(key)
+        if seller_order is None:
+            seller_order = batch[key] = SellerOrder(
+                order_id=item.order_id, seller_id=item.product.seller_id, item_count=0, subtotal=0, items=[]
+            )
+        seller_order.item_count += 1
+        seller_order.subtotal += item.line_total
+        seller_order.items.append(line_summary(item))
+    SellerOrder.objects.bulk_create(batch.values())
+    # Sort the feed by when the orders were placed, not by this migration
+    SellerOrder.objects.update(
+        create_at=Subquery(Order.objects.filter(pk=OuterRef('order_id')).values('create_at'))
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('profiles', '0006_order_summary'),
+        ('sellers', '0002_unique_slug'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SellerOrder',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('create_at', models.DateTimeField(auto_now_add=True)),
+                ('update_at', models.DateTimeField(auto_now=True)),
+                ('item_count', models.PositiveIntegerField(default=0)),
+                ('subtotal', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('items', models.JSONField(blank=True, default=list)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='seller_orders', to='profiles.order')),
+                ('seller', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='orders', to='sellers.seller')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['seller', 'create_at', 'id'], name='sellerorder_seller_idx')],
+                'constraints': [models.UniqueConstraint(fields=('seller', 'order'), name='sellerorder_seller_order_uniq')],
+            },
+        ),
+        migrations.RunPython(fill_seller_orders, migrations.RunPython.noop),
+    ]
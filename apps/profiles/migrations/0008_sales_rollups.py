@@ -0,0 +1,79 @@
+# Generated by Django 5.2.1 on 2026-10-18 19:32
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+
+
+def fill_rollups(apps, schema_editor):
+    # Same rows as SalesRollup.rebuild()
+    OrderItem = apps.get_model('profiles', 'OrderItem')
+    items = (
+        OrderItem.objects.filter(order__payment_status='SUCCESSFUL', product__seller__isnull=False)
+        .annotate(seller_id=F('product__seller_id'), day=TruncDate('order__create_at'))
+    )
+    for model_name, key_fields in (
+        ('SellerDailyTotals', ('seller_id', 'day')),
+        ('SellerDailySales', ('seller_id', 'day', 'product_id')),
+    ):
+        model = apps.get_model('profiles', model_name)
+        lines = (
+            items.values(*key_fields)
+            .annotate(order_count=Count('order_id', distinct=True), unit_count=Sum('quantity'), total=Sum('line_total'))
+            .order_by()
+        )
+        model.objects.bulk_create(
+            [
+                model(
+                    **{field: line[field] for field in key_fields},
+                    orders=line['order_count'], units=line['unit_count'], revenue=line['total'],
+                )
+                for line in lines.iterator(chunk_size=1000)
+            ],
+            batch_size=1000,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('profiles', '0007_seller_order'),
+        ('sellers', '0002_unique_slug'),
+        ('shop', '0010_category_reserved_slug'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SellerDailySales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('orders', models.IntegerField(default=0)),
+                ('units', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_sales', to='shop.product')),
+                ('seller', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='daily_sales', to='sellers.seller')),
+            ],
+            options={
+                'verbose_name_plural': 'Seller daily sales',
+                'constraints': [models.UniqueConstraint(fields=('seller', 'day', 'product'), name='sellerdailysales_key')],
+            },
+        ),
+        migrations.CreateModel(
+            name='SellerDailyTotals',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('orders', models.IntegerField(default=0)),
+                ('units', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('seller', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='daily_totals', to='sellers.seller')),
+            ],
+            options={
+                'verbose_name_plural': 'Seller daily totals',
+                'constraints': [models.UniqueConstraint(fields=('seller', 'day'), name='sellerdailytotals_key')],
+            },
+        ),
+        migrations.RunPython(fill_rollups, migrations.RunPython.noop),
+    ]
@@ -1,9 +1,16 @@
-from django.db import models
+from datetime import datetime, time, timedelta
+
+from django.db import IntegrityError, models, transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
 
 from apps.accounts.models import User
 from apps.common.models import BaseModel
-from apps.common.utils import generate_unique_code
+from apps.common.utils import generate_reference, generate_references
+from apps.sellers.models import Seller
 from apps.shop.models import Product
+from apps.shop.stock import release_stock
 
 # Create your models here.
 
@@ -25,6 +32,16 @@ PAYMENT_STATUS_CHOICES = (
     ("FAILED", "FAILED"),
 )
 
+# Payment statuses in which an order no longer holds its items' stock
+RELEASED_PAYMENT_STATUSES = ("CANCELLED", "FAILED")
+
+# Payment status from which an order counts in the sales figures
+PAID_PAYMENT_STATUS = "SUCCESSFUL"
+
+
+def start_of_day(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
 
 class Order(BaseModel):
     """
@@ -35,13 +52,32 @@ class Order(BaseModel):
             tx_ref (str): The unique transaction reference.
             delivery_status (str): The delivery status of the order.
             payment_status (str): The payment status of the order.
+            subtotal (Decimal): Sum of the items' line totals, fixed at checkout.
+            total (Decimal): Amount to pay, fixed at checkout.
+            summary (dict): Read model of the order history: the ``buyer`` (names and
+                email, set on creation) and the ordered ``items`` (set at checkout).
 
         Methods:
             __str__():
                 Returns a string representation of the transaction reference.
             save(*args, **kwargs):
                 Overrides the save method to generate a unique transaction reference when a new order is created.
+            assign_references(orders):
+                Gives a batch of new orders their references before ``bulk_create``.
+            buyer_summary(user):
+                The ``buyer`` part of ``summary`` for ``user``.
+            change_payment_status():
+                Applies the stock and sales side effects of a payment status change once.
+
+        An order holds the stock of its items, reserved at checkout, until it is
+        saved with a payment status in ``RELEASED_PAYMENT_STATUSES``; the units
+        are then put back exactly once, even if several processes cancel the
+        same order. Likewise, its items are added to ``SALES_ROLLUPS`` once
+        when it is saved as ``PAID_PAYMENT_STATUS`` and taken out if it leaves
+        that status. ``QuerySet.update()`` bypasses both.
     """
+    reference_attempts = 3
+
     user = models.ForeignKey(
         User, on_delete=models.CASCADE, related_name="orders"
     )
@@ -57,6 +93,14 @@ class Order(BaseModel):
 
     date_delivered = models.DateTimeField(null=True, blank=True)
 
+    # Computed from the items' price snapshots at checkout, see CheckoutView
+    subtotal = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    total = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    # Denormalized so the order history is read from this row alone; the
+    # statuses already live here, so changing them keeps it up to date
+    summary = models.JSONField(default=dict, blank=True, editable=False)
+
     # Shipping address details
     full_name = models.CharField(max_length=100, null=True)
     email = models.EmailField(null=True)
@@ -66,24 +110,76 @@ class Order(BaseModel):
     country = models.CharField(max_length=100, null=True)
     zipcode = models.CharField(max_length=6, null=True)
 
+    class Meta:
+        indexes = [
+            # Order history of a user, newest first, paginated by (create_at, id)
+            models.Index(fields=["user", "create_at", "id"], name="order_user_create_at_idx"),
+        ]
+
     def __str__(self):
         return f"{self.user.full_name}'s order"
 
+    # Payment status when the order was loaded/last saved
+    _saved_payment_status = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._saved_payment_status = instance.__dict__.get("payment_status")
+        return instance
+
     def save(self, *args, **kwargs) -> None:
-        if not self.create_at:
-            self.tx_ref = generate_unique_code(Order, "tx_ref")
-        super().save(*args, **kwargs)
+        if not self._state.adding:
+            with transaction.atomic():
+                if self.payment_status != self._saved_payment_status:
+                    self.change_payment_status()
+                super().save(*args, **kwargs)
+            self._saved_payment_status = self.payment_status
+            return
+        if "buyer" not in self.summary:
+            self.summary = {**self.summary, "buyer": self.buyer_summary(self.user)}
+        if self.tx_ref:
+            return super().save(*args, **kwargs)
+        # No existence check: the unique index reports the (very rare) clash
+        for attempt in range(self.reference_attempts):
+            self.tx_ref = generate_reference()
+            try:
+                with transaction.atomic():
+                    return super().save(*args, **kwargs)
+            except IntegrityError as exc:
+                if "tx_ref" not in str(exc) or attempt == self.reference_attempts - 1:
+                    raise
+
+    def change_payment_status(self):
+        # Swap the stored status for ours with a conditional UPDATE, so of several
+        # processes making the same change only one applies its side effects
+        previous = self._saved_payment_status
+        while not Order.objects.filter(pk=self.pk, payment_status=previous).update(payment_status=self.payment_status):
+            previous = Order.objects.filter(pk=self.pk).values_list("payment_status", flat=True).first()
+            if previous is None or previous == self.payment_status:
+                return
+        if self.payment_status in RELEASED_PAYMENT_STATUSES and previous not in RELEASED_PAYMENT_STATUSES:
+            release_stock(self.orderitems.values_list("product_id", "quantity"))
+        if (self.payment_status == PAID_PAYMENT_STATUS) != (previous == PAID_PAYMENT_STATUS):
+            for rollup in SALES_ROLLUPS:
+                rollup.record(self, 1 if self.payment_status == PAID_PAYMENT_STATUS else -1)
+
+    @staticmethod
+    def buyer_summary(user):
+        return {"first_name": user.first_name, "last_name": user.last_name, "email": user.email}
+
+    @staticmethod
+    def assign_references(orders):
+        for order, reference in zip(orders, generate_references(len(orders))):
+            order.tx_ref = reference
 
     @property
     def get_cart_subtotal(self):
-        orderitems = self.orderitems.all()
-        total = sum(item.get_total for item in orderitems)
-        return total
+        return self.subtotal
 
     @property
     def get_cart_total(self):
-        total = self.get_cart_subtotal
-        return total
+        return self.total
 
 
 class ShippingAddress(BaseModel):
@@ -118,11 +214,6 @@ class ShippingAddress(BaseModel):
     def __str__(self):
         return f"{self.full_name}'s shipping details"
 
-    def save(self, *args, **kwargs) -> None:
-        if not self.create_at:
-            self.tx_ref = generate_unique_code(Order, "tx_ref")
-        super().save(*args, **kwargs)
-
 
 class OrderItem(BaseModel):
     """
@@ -132,6 +223,11 @@ class OrderItem(BaseModel):
            order (ForeignKey): The order to which this item belongs.
            product (ForeignKey): The product associated with this order item.
            quantity (int): The quantity of the product ordered.
+           unit_price (Decimal): The product's price at checkout, None while in the cart.
+           line_total (Decimal): ``unit_price * quantity``, None while in the cart.
+
+       Later price changes do not affect ordered items: their totals come from
+       the snapshot, a cart item's from the current price.
 
 
     """
@@ -146,14 +242,229 @@ class OrderItem(BaseModel):
     )
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(default=1)
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    line_total = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True)
 
     @property
     def get_total(self):
+        if self.line_total is not None:
+            return self.line_total
         return self.product.price_current * self.quantity
 
     class Meta:
         ordering = ["-create_at"]
+        indexes = [
+            # Cart lookups: OrderItem(user=..., order=None)
+            models.Index(
+                fields=["user", "product"], condition=models.Q(order__isnull=True), name="orderitem_cart_idx"
+            ),
+        ]
 
     def __str__(self):
         return self.product.name
 
+
+
+class SellerOrder(BaseModel):
+    """
+        The part of an order that one seller has to fulfil, written at checkout.
+
+        Attributes:
+            seller (ForeignKey): The seller of the items.
+            order (ForeignKey): The order they belong to.
+            item_count (int): Number of the seller's lines in the order.
+            subtotal (Decimal): Sum of those lines' totals.
+            items (list): Those lines, as in ``Order.summary["items"]``.
+
+        Methods:
+            record(order, items, lines):
+                Creates the rows of a checked-out order.
+
+        A seller's order feed is a range of the ``(seller, create_at, id)``
+        index joined to the order by primary key for its statuses, instead of
+        a join through every ordered item and product.
+    """
+    seller = models.ForeignKey(Seller, on_delete=models.CASCADE, related_name="orders", db_index=False)
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name="seller_orders")
+    item_count = models.PositiveIntegerField(default=0)
+    subtotal = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    items = models.JSONField(default=list, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["seller", "order"], name="sellerorder_seller_order_uniq"),
+        ]
+        indexes = [
+            # Order feed of a seller, newest first, paginated by (create_at, id)
+            models.Index(fields=["seller", "create_at", "id"], name="sellerorder_seller_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.order.tx_ref} for {self.seller.business_name}"
+
+    @classmethod
+    def record(cls, order, items, lines):
+        """
+            Splits a checked-out order by seller with one INSERT.
+
+            Args:
+                order (Order): The order.
+                items (list): Its ``OrderItem`` rows, with ``product`` loaded.
+                lines (list): The same items as stored in the order summary.
+        """
+        per_seller = {}
+        for item, line in zip(items, lines):
+            seller_id = item.product.seller_id
+            if seller_id is None:
+                continue
+            seller_order = per_seller.setdefault(seller_id, cls(seller_id=seller_id, order=order))
+            seller_order.item_count += 1
+            seller_order.subtotal += item.line_total
+            seller_order.items.append(line)
+        return cls.objects.bulk_create(per_seller.values())
+
+
+
+class SalesRollup(models.Model):
+    """
+        Paid sales summed per ``key_fields``, kept up to date by ``Order`` as
+        orders reach or leave ``PAID_PAYMENT_STATUS`` (see ``record``) and
+        recomputable from the order history with ``rebuild``. A sale counts
+        on the day its order was placed (in the current time zone), so both
+        give the same rows.
+
+        Attributes:
+            day (date): Day the orders were placed.
+            orders (int): Number of paid orders.
+            units (int): Units sold.
+            revenue (Decimal): Sum of the line totals.
+
+        Methods:
+            record(order, sign=1):
+                Adds (or, with ``sign=-1``, takes out) the items of an order.
+            rebuild(since=None, until=None):
+                Recomputes the rows of a date range from the order history.
+    """
+    key_fields = ()
+
+    day = models.DateField()
+    orders = models.IntegerField(default=0)
+    units = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def paid_lines(cls, orders):
+        """The items of ``orders`` grouped by ``key_fields``, with their totals."""
+        return (
+            OrderItem.objects.filter(order__in=orders, product__seller__isnull=False)
+            .annotate(seller_id=F("product__seller_id"), day=TruncDate("order__create_at"))
+            .values(*cls.key_fields)
+            .annotate(order_count=Count("order_id", distinct=True), unit_count=Sum("quantity"), total=Sum("line_total"))
+            .order_by()
+        )
+
+    @classmethod
+    def record(cls, order, sign=1):
+        for line in cls.paid_lines([order.pk]):
+            key = {field: line[field] for field in cls.key_fields}
+            delta = {
+                "orders": F("orders") + sign * line["order_count"],
+                "units": F("units") + sign * line["unit_count"],
+                "revenue": F("revenue") + sign * line["total"],
+            }
+            if cls.objects.filter(**key).update(**delta):
+                continue
+            try:
+                with transaction.atomic():
+                    cls.objects.create(
+                        **key, orders=sign * line["order_count"], units=sign * line["unit_count"],
+                        revenue=sign * line["total"],
+                    )
+            except IntegrityError:
+                # A concurrent order created the row first
+                cls.objects.filter(**key).update(**delta)
+
+    @classmethod
+    def rebuild(cls, since=None, until=None, batch_size=1000):
+        """
+            Replaces the rows of days ``since``..``until`` (inclusive, open ended
+            when None) with totals computed from the paid orders of those days.
+
+            Returns:
+                int: The number of rows written.
+        """
+        days = Q()
+        orders = Order.objects.filter(payment_status=PAID_PAYMENT_STATUS)
+        if since:
+            days &= Q(day__gte=since)
+            orders = orders.filter(create_at__gte=start_of_day(since))
+        if until:
+            days &= Q(day__lte=until)
+            orders = orders.filter(create_at__lt=start_of_day(until + timedelta(days=1)))
+        written = 0
+        with transaction.atomic():
+            cls.objects.filter(days).delete()
+            batch = []
+            for line in cls.paid_lines(orders).iterator(chunk_size=batch_size):
+                batch.append(cls(
+                    **{field: line[field] for field in cls.key_fields},
+                    orders=line["order_count"], units=line["unit_count"], revenue=line["total"],
+                ))
+                if len(batch) == batch_size:
+                    written += len(cls.objects.bulk_create(batch))
+                    batch = []
+            written += len(cls.objects.bulk_create(batch))
+        return written
+
+
+class SellerDailyTotals(SalesRollup):
+    """
+        A seller's paid sales per day, see ``SalesRollup``. Seller analytics read
+        their totals and time series from a range of the ``(seller, day)`` key.
+
+        Attributes:
+            seller (ForeignKey): The seller.
+    """
+    key_fields = ("seller_id", "day")
+
+    seller = models.ForeignKey(Seller, on_delete=models.CASCADE, related_name="daily_totals", db_index=False)
+
+    class Meta:
+        verbose_name_plural = "Seller daily totals"
+        constraints = [
+            models.UniqueConstraint(fields=["seller", "day"], name="sellerdailytotals_key"),
+        ]
+
+    def __str__(self):
+        return f"{self.seller_id} {self.day}: {self.revenue}"
+
+
+class SellerDailySales(SalesRollup):
+    """
+        A seller's paid sales per product and day, see ``SalesRollup``. Seller
+        analytics rank products from a range of the ``(seller, day, product)`` key.
+
+        Attributes:
+            seller (ForeignKey): The seller of the product.
+            product (ForeignKey): The product sold.
+    """
+    key_fields = ("seller_id", "day", "product_id")
+
+    seller = models.ForeignKey(Seller, on_delete=models.CASCADE, related_name="daily_sales", db_index=False)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="daily_sales")
+
+    class Meta:
+        verbose_name_plural = "Seller daily sales"
+        constraints = [
+            models.UniqueConstraint(fields=["seller", "day", "product"], name="sellerdailysales_key"),
+        ]
+
+    def __str__(self):
+        return f"{self.seller_id} {self.product_id} {self.day}: {self.units} units"
+
+
+# Rollups updated with every paid order
+SALES_ROLLUPS = (SellerDailyTotals, SellerDailySales)
@@ -1,3 +1,289 @@
-from django.test import TestCase
+import time
+from io import StringIO
+from decimal import Decimal
+from unittest import mock
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from apps.accounts.models import User
+from apps.common.testing import PROCESS_CACHE, create_seller
+from apps.common.utils import generate_references, is_valid_reference
+from apps.profiles.models import Order, OrderItem, SellerDailySales, SellerDailyTotals, SellerOrder, ShippingAddress
+from apps.shop.models import Category, Product
+from apps.shop.stock import reserve_stock
 
 # Create your tests here.
+
+
+class OrderReferenceTests(TestCase):
+    """References need no existence check; the benchmark creates orders one by one and in bulk."""
+    total = 2000
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("Buyer", "One", "buyer@example.com", "password")
+
+    def test_save_runs_no_select(self):
+        with CaptureQueriesContext(connection) as queries:
+            order = Order.objects.create(user=self.user)
+        self.assertTrue(is_valid_reference(order.tx_ref))
+        self.assertFalse([query for query in queries if query["sql"].startswith("SELECT")])
+
+    def test_clash_is_retried(self):
+        taken = Order.objects.create(user=self.user).tx_ref
+        fresh = generate_references(1)[0]
+        with mock.patch("apps.profiles.models.generate_reference", side_effect=[taken, fresh]):
+            order = Order.objects.create(user=self.user)
+        self.assertEqual(order.tx_ref, fresh)
+
+    def test_references_are_time_ordered_and_checked(self):
+        earlier = generate_references(1, now=1_700_000_000)[0]
+        batch = generate_references(1000, now=1_700_000_001)
+        self.assertEqual(len(set(batch)), 1000)
+        self.assertEqual(batch, sorted(batch))
+        self.assertLess(earlier, batch[0])
+        self.assertTrue(all(is_valid_reference(reference) for reference in batch))
+        reference = batch[0]
+        typo = reference[:3] + ("1" if reference[3] != "1" else "2") + reference[4:]
+        self.assertFalse(is_valid_reference(typo))
+        self.assertFalse(is_valid_reference(reference[:-1]))
+
+    def test_orders_per_second(self):
+        started = time.perf_counter()
+        for _ in range(self.total):
+            Order.objects.create(user=self.user)
+        single_rate = self.total / (time.perf_counter() - started)
+
+        started = time.perf_counter()
+        orders = [Order(user=self.user) for _ in range(self.total)]
+        Order.assign_references(orders)
+        Order.objects.bulk_create(orders)
+        bulk_rate = self.total / (time.perf_counter() - started)
+
+        self.assertEqual(Order.objects.values("tx_ref").distinct().count(), 2 * self.total)
+        self.assertGreater(bulk_rate, single_rate)
+
+
+class OrderStockReleaseTests(TestCase):
+    def test_cancelling_releases_the_stock_once(self):
+        user = User.objects.create_user("Buyer", "One", "buyer@example.com", "password")
+        category = Category.objects.create(name="Laptops", image="category_images/laptops.jpg")
+        product = Product.objects.create(
+            name="MacBook Air", desc="d", price_current=Decimal("999"), category=category, in_stock=5,
+            image1="product_images/air.jpg",
+        )
+        reserve_stock([(product.id, 3)])
+        order = Order.objects.create(user=user)
+        OrderItem.objects.create(user=user, order=order, product=product, quantity=3)
+        stale = Order.objects.get(pk=order.pk)
+
+        order.payment_status = "CANCELLED"
+        order.save()
+        # A second process cancelling from its stale copy must not put the units back again
+        stale.payment_status = "FAILED"
+        stale.save()
+        order.save()
+
+        product.refresh_from_db()
+        self.assertEqual(product.in_stock, 5)
+
+
+@override_settings(CACHES=PROCESS_CACHE)
+class OrderHistoryTests(TestCase):
+    """Order history pages and order items are read from the orders' summaries alone."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("Buyer", "One", "buyer@example.com", "password")
+        category = Category.objects.create(name="Laptops", image="category_images/laptops.jpg")
+        products = [
+            Product.objects.create(
+                name=f"Laptop {i}", desc="d", price_current=Decimal(100 + i), category=category, in_stock=50,
+                image1="product_images/p.jpg",
+            )
+            for i in range(4)
+        ]
+        shipping = ShippingAddress.objects.create(
+            user=cls.user, full_name="Buyer One", email="buyer@example.com", phone="1", address="a",
+            city="c", country="n", zipcode="1",
+        )
+        client = APIClient()
+        client.force_authenticate(cls.user)
+        for i in range(5):
+            for product in products[:i % 4 + 1]:
+                OrderItem.objects.create(user=cls.user, product=product, quantity=2)
+            client.post("/shop/checkout/", {"shipping_id": str(shipping.id)})
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_pages_take_one_query(self):
+        seen = []
+        url = "/profiles/orders/?page_size=2"
+        while url:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(len(queries), 1)
+            seen += [order["tx_ref"] for order in response.data["results"]]
+            url = response.data["next"]
+        expected = list(Order.objects.order_by("-create_at", "-id").values_list("tx_ref", flat=True))
+        self.assertEqual(seen, expected)
+        self.assertEqual(response.data["results"][-1]["first_name"], "Buyer")
+
+    def test_items_are_the_checkout_snapshot(self):
+        order = Order.objects.order_by("-create_at").first()
+        Product.objects.update(price_current=Decimal("1"), name="Renamed")
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f"/profiles/orders/{order.tx_ref}/")
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(len(response.data), 1)
+        self.assertEqual(response.data[0]["product"]["name"], "Laptop 0")
+        self.assertEqual(response.data[0]["total"], "200.00")
+
+    def test_other_users_orders_are_hidden(self):
+        other = User.objects.create_user("Buyer", "Two", "buyer2@example.com", "password")
+        self.client.force_authenticate(other)
+        order = Order.objects.first()
+        self.assertEqual(self.client.get(f"/profiles/orders/{order.tx_ref}/").status_code, 404)
+        self.assertEqual(self.client.get("/profiles/orders/").data["results"], [])
+
+
+class SellerOrderFeedTests(TestCase):
+    """Each seller sees an order once, with only their lines, one query per page."""
+
+    @classmethod
+    def setUpTestData(cls):
+        buyer = User.objects.create_user("Buyer", "One", "buyer@example.com", "password")
+        category = Category.objects.create(name="Laptops", image="category_images/laptops.jpg")
+        cls.sellers = []
+        for i in range(2):
+            user = User.objects.create_user("Seller", str(i), f"seller{i}@example.com", "password", account_type="SELLER")
+            cls.sellers.append(create_seller(user, f"Shop {i}"))
+        # Two products of the first seller and one of the second
+        products = [
+            Product.objects.create(
+                seller=cls.sellers[i // 2], name=f"Laptop {i}", desc="d", price_current=Decimal(100 + i),
+                category=category, in_stock=50, image1="product_images/p.jpg",
+            )
+            for i in range(3)
+        ]
+        shipping = ShippingAddress.objects.create(
+            user=buyer, full_name="Buyer One", email="buyer@example.com", phone="1", address="a",
+            city="c", country="n", zipcode="1",
+        )
+        client = APIClient()
+        client.force_authenticate(buyer)
+        for _ in range(3):
+            for product in products:
+                OrderItem.objects.create(user=buyer, product=product, quantity=1)
+            client.post("/shop/checkout/", {"shipping_id": str(shipping.id)})
+
+    def feed(self, seller):
+        client = APIClient()
+        client.force_authenticate(seller.user)
+        orders, url = [], "/sellers/orders/?page_size=2"
+        while url:
+            with CaptureQueriesContext(connection) as queries:
+                response = client.get(url)
+            # The seller and its user are loaded by the permission check
+            self.assertEqual(len([q for q in queries if "profiles_" in q["sql"]]), 1)
+            orders += response.data["results"]
+            url = response.data["next"]
+        return client, orders
+
+    def test_feed_has_each_order_once_with_the_sellers_lines(self):
+        _, orders = self.feed(self.sellers[0])
+        self.assertEqual(len(orders), 3)
+        self.assertEqual(len({order["tx_ref"] for order in orders}), 3)
+        self.assertEqual({order["subtotal"] for order in orders}, {"201.00"})
+        self.assertEqual(
+            {line["product"]["slug"] for order in orders for line in order["items"]}, {"laptop-0", "laptop-1"}
+        )
+        client, orders = self.feed(self.sellers[1])
+        self.assertEqual([order["item_count"] for order in orders], [1, 1, 1])
+        response = client.get(f"/sellers/orders/{orders[0]['tx_ref']}/")
+        self.assertEqual([line["product"]["slug"] for line in response.data], ["laptop-2"])
+
+    def test_totals_add_up_to_the_order(self):
+        for order in Order.objects.all():
+            self.assertEqual(sum(order.seller_orders.values_list("subtotal", flat=True)), order.total)
+        self.assertEqual(SellerOrder.objects.count(), 6)
+
+
+class SalesRollupTests(TestCase):
+    """Paid orders are rolled up once; the rebuild gives the same rows; analytics read only the rollups."""
+
+    @classmethod
+    def setUpTestData(cls):
+        buyer = User.objects.create_user("Buyer", "One", "buyer@example.com", "password")
+        user = User.objects.create_user("Seller", "One", "seller@example.com", "password", account_type="SELLER")
+        cls.seller = create_seller(user)
+        category = Category.objects.create(name="Laptops", image="category_images/laptops.jpg")
+        cls.products = [
+            Product.objects.create(
+                seller=cls.seller, name=f"Laptop {i}", desc="d", price_current=Decimal(100 * (i + 1)),
+                category=category, in_stock=50, image1="product_images/p.jpg",
+            )
+            for i in range(2)
+        ]
+        shipping = ShippingAddress.objects.create(
+            user=buyer, full_name="Buyer One", email="buyer@example.com", phone="1", address="a",
+            city="c", country="n", zipcode="1",
+        )
+        client = APIClient()
+        client.force_authenticate(buyer)
+        for count in (1, 2, 2):
+            for product in cls.products[:count]:
+                OrderItem.objects.create(user=buyer, product=product, quantity=3)
+            client.post("/shop/checkout/", {"shipping_id": str(shipping.id)})
+
+    def rows(self):
+        return (
+            sorted(SellerDailyTotals.objects.values_list("seller", "day", "orders", "units", "revenue")),
+            sorted(SellerDailySales.objects.values_list("product", "day", "orders", "units", "revenue")),
+        )
+
+    def pay_all(self):
+        for order in Order.objects.all():
+            order.payment_status = "SUCCESSFUL"
+            order.save()
+
+    def test_paid_orders_are_counted_once(self):
+        self.pay_all()
+        stale = Order.objects.first()
+        stale.payment_status = "SUCCESSFUL"
+        stale._saved_payment_status = "PENDING"
+        stale.save()
+        (totals,), sales = self.rows()
+        self.assertEqual(totals[2:], (3, 15, Decimal("2100")))
+        self.assertEqual(sorted(row[2:] for row in sales), [(2, 6, Decimal("1200")), (3, 9, Decimal("900"))])
+
+    def test_cancelled_orders_are_taken_out_and_rebuild_agrees(self):
+        self.pay_all()
+        order = Order.objects.filter(total=Decimal("900")).first()
+        order.payment_status = "CANCELLED"
+        order.save()
+        incremental = self.rows()
+        self.assertEqual(incremental[0][0][2:], (2, 9, Decimal("1200")))
+        SellerDailySales.objects.all().delete()
+        call_command("rebuild_sales_rollups", stdout=StringIO())
+        self.assertEqual(self.rows(), incremental)
+
+    def test_analytics_read_the_rollups_only(self):
+        self.pay_all()
+        client = APIClient()
+        client.force_authenticate(self.seller.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get("/sellers/analytics/", {"granularity": "week"})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse([q for q in queries if "profiles_order" in q["sql"]])
+        self.assertEqual((response.data["orders"], response.data["units"]), (3, 15))
+        self.assertEqual(response.data["revenue"], "2100.00")
+        self.assertEqual(len(response.data["series"]), 1)
+        self.assertEqual([row["slug"] for row in response.data["top_products"]], ["laptop-1", "laptop-0"])
+        self.assertEqual(client.get("/sellers/analytics/", {"from": "2026-02-01", "to": "2026-01-01"}).status_code, 400)
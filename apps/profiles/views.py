@@ -1,20 +1,36 @@
 from django.shortcuts import render
 from django.template.context_processors import request
-from drf_spectacular.utils import extend_schema
+from drf_spectacular.utils import OpenApiParameter, OpenApiTypes, extend_schema
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from yaml import serialize
 
+from apps.common.paginations import OrderCursorPagination
 from apps.common.utils import set_dict_attr
 from apps.profiles.serializers import ProfileSerializer
 from apps.profiles.models import ShippingAddress, Order, OrderItem
 from apps.profiles.serializers import ShippingAddressSerializer
-from apps.shop.serializers import OrderSerializer, CheckItemOrderSerializer
+from apps.shop.serializers import OrderLineSerializer, OrderSerializer
 
 from apps.common.permissions import IsOwner
 
 tags = ["Profiles"]
 
+ORDER_PARAM_EXAMPLE = [
+    OpenApiParameter(
+        name="page_size",
+        description="The amount of orders per page",
+        required=False,
+        type=OpenApiTypes.INT,
+    ),
+    OpenApiParameter(
+        name="cursor",
+        description="Opaque cursor taken from the next/previous link of the previous response",
+        required=False,
+        type=OpenApiTypes.STR,
+    ),
+]
+
 class ProfileView(APIView):
     permission_classes = [IsOwner]
     serializer_class = ProfileSerializer
@@ -161,41 +177,43 @@ class ShippingAddressViewID(APIView):
 class OrdersView(APIView):
     permission_classes = [IsOwner]
     serializer_class = OrderSerializer
+    pagination_class = OrderCursorPagination
 
     @extend_schema(
         operation_id="orders_view",
         summary="Orders Fetch",
         description="""
-                This endpoint returns all orders for a particular user.
+                This endpoint returns the orders of a particular user, newest first, a page at a time.
+                Follow the next/previous links to move between pages.
             """,
-        tags=tags
+        tags=tags,
+        parameters=ORDER_PARAM_EXAMPLE,
     )
     def get(self, request):
         user = request.user
-        orders = (Order.objects.filter(user=user)
-            .prefetch_related("orderitems", "orderitems__product")
-            .order_by("-create_at"))
-        serializer = self.serializer_class(orders, many=True)
-        return Response(data=serializer.data, status=200)
+        # One index range per page: buyer and items come from the order's summary
+        orders = Order.objects.filter(user=user)
+        paginator = self.pagination_class()
+        page = paginator.paginate_queryset(orders, request, view=self)
+        serializer = self.serializer_class(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
 
 class OrderItemsView(APIView):
     permission_classes = [IsOwner]
-    serializer_class = CheckItemOrderSerializer
+    serializer_class = OrderLineSerializer
 
     @extend_schema(
         operation_id="order_items_view",
         summary="Items Order Fetch",
         description="""
-                This endpoint returns all items order for a particular user.
+                This endpoint returns the items of an order as they were at checkout.
             """,
         tags=tags,
-
+        responses=OrderLineSerializer(many=True),
     )
     def get(self, request, **kwargs):
-        order = Order.objects.get_or_none(tx_ref=kwargs["tx_ref"])
-        if not order or order.user != request.user:
+        summary = (Order.objects.filter(tx_ref=kwargs["tx_ref"], user=request.user)
+            .values_list("summary", flat=True).first())
+        if summary is None:
             return Response(data={"message": "Order does not exist!"}, status=404)
-        order_items = OrderItem.objects.filter(order=order)
-        serializer = self.serializer_class(order_items, many=True)
-        return Response(data=serializer.data, status=200)
-
+        return Response(data=summary.get("items", []), status=200)
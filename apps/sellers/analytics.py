@@ -0,0 +1,58 @@
+from django.db.models import DateField, Sum
+from django.db.models.functions import Trunc
+
+from apps.profiles.models import SellerDailySales, SellerDailyTotals
+from apps.shop.models import Product
+
+GRANULARITIES = ("day", "week", "month")
+
+
+def sales_report(seller, since, until, granularity="day", top=10):
+    """
+        A seller's paid sales between two days, read from the rollups only.
+
+        The totals and the series come from ``SellerDailyTotals`` (one row per
+        day with sales) grouped into ``granularity`` periods by the database;
+        the best selling products come from ``SellerDailySales`` over the same
+        range of its ``(seller, day, product)`` key. Neither reads an order, so
+        the cost depends on the number of days and products sold, not on the
+        number of orders. Periods without sales are left out of the series.
+
+        Args:
+            seller (Seller): The seller.
+            since (date): First day, inclusive.
+            until (date): Last day, inclusive.
+            granularity (str): One of ``GRANULARITIES``.
+            top (int): Number of best selling products, by revenue.
+
+        Returns:
+            dict: ``orders``, ``units`` and ``revenue`` over the range, ``series`` and ``top_products``.
+    """
+    days = {"seller": seller, "day__gte": since, "day__lte": until}
+    series = list(
+        SellerDailyTotals.objects.filter(**days)
+        .annotate(period=Trunc("day", granularity, output_field=DateField()))
+        .values("period")
+        .annotate(orders=Sum("orders"), units=Sum("units"), revenue=Sum("revenue"))
+        .order_by("period")
+    )
+    top_products = list(
+        SellerDailySales.objects.filter(**days)
+        .values("product_id")
+        .annotate(orders=Sum("orders"), units=Sum("units"), revenue=Sum("revenue"))
+        .order_by("-revenue", "product_id")[:top]
+    )
+    products = Product.objects.unfiltered().only("name", "slug").in_bulk([row["product_id"] for row in top_products])
+    for row in top_products:
+        product = products.get(row["product_id"])
+        row["name"], row["slug"] = (product.name, product.slug) if product else (None, None)
+    return {
+        "since": since,
+        "until": until,
+        "granularity": granularity,
+        "orders": sum(point["orders"] for point in series),
+        "units": sum(point["units"] for point in series),
+        "revenue": sum((point["revenue"] for point in series), 0),
+        "series": series,
+        "top_products": top_products,
+    }
@@ -0,0 +1,371 @@
+import csv
+import io
+import json
+import posixpath
+import zipfile
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.core.exceptions import SuspiciousFileOperation, ValidationError as DjangoValidationError
+from django.core.files.base import ContentFile
+from django.core.validators import validate_image_file_extension
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from PIL import Image
+from rest_framework.exceptions import ValidationError
+
+from apps.common.images import schedule_files
+from apps.common.slugs import assign_slugs
+from apps.sellers.serializers import ProductImportSerializer
+from apps.shop.models import Category, PriceHistory, Product, subtree_range
+
+IMPORT_FORMATS = ("csv", "ndjson")
+EXPORT_COLUMNS = (
+    "name", "slug", "desc", "price_current", "price_old", "category_slug", "in_stock", "image1", "image2", "image3",
+)
+IMAGE_FIELDS = ("image1", "image2", "image3")
+CENT = Decimal("0.01")
+
+
+def detect_format(upload, requested=None):
+    """
+        The import format: ``requested`` if given, else guessed from the file name
+        or content type. Returns None when it cannot be told.
+    """
+    if requested:
+        return requested if requested in IMPORT_FORMATS else None
+    name = (upload.name or "").lower()
+    if name.endswith(".csv") or upload.content_type in ("text/csv", "application/csv"):
+        return "csv"
+    if name.endswith((".ndjson", ".jsonl")) or upload.content_type in ("application/x-ndjson", "application/jsonl"):
+        return "ndjson"
+    return None
+
+
+def read_rows(upload, input_format):
+    """
+        Yields ``(row_number, row, error)`` from an uploaded CSV / NDJSON file.
+
+        The file is decoded and parsed line by line, so only the current row is
+        held in memory. ``row`` is None when the line itself cannot be parsed.
+    """
+    binary = getattr(upload.file, "file", upload.file)
+    binary.seek(0)
+    text = io.TextIOWrapper(binary, encoding="utf-8-sig", newline="")
+    try:
+        if input_format == "csv":
+            for number, row in enumerate(csv.DictReader(text), 1):
+                yield number, row, None
+        else:
+            number = 0
+            for line in text:
+                if not line.strip():
+                    continue
+                number += 1
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    yield number, None, "Invalid JSON."
+                    continue
+                if isinstance(row, dict):
+                    yield number, row, None
+                else:
+                    yield number, None, "Each line must be a JSON object."
+    except UnicodeDecodeError:
+        yield None, None, "The file must be UTF-8 encoded."
+    finally:
+        text.detach()
+
+
+class ProductImporter:
+    """
+        Creates a seller's products from parsed rows with ``bulk_create``.
+
+        Rows are validated with ``ProductImportSerializer`` and resolved against a
+        category map loaded once. Valid rows are buffered and written ``batch_size``
+        at a time, each batch getting its slugs from ``assign_slugs`` in two
+        queries. Invalid rows are skipped and reported; the caller wraps ``run`` in
+        a transaction.
+
+        Attributes:
+            seller (Seller): Owner of the new products.
+            archive (ZipFile | None): Images referenced by the rows.
+            batch_size (int): Rows per INSERT.
+            error_limit (int): Row errors kept for the report; the rest are only counted.
+            max_image_size (int): Largest zip member, in bytes, stored as an image.
+    """
+    error_limit = 1000
+    max_image_size = 10 * 1024 * 1024
+    max_slug_attempts = 3
+
+    def __init__(self, seller, archive=None, batch_size=1000):
+        self.seller = seller
+        self.archive = archive
+        self.batch_size = batch_size
+        self.members = set(archive.namelist()) if archive is not None else set()
+        self.categories = dict(Category.objects.values_list("slug", "id"))
+        self.image_field = Product._meta.get_field("image1")
+        self.images = {}
+        self.new_images = []
+        self.batch = []
+        self.created = 0
+        self.failed = 0
+        self.errors = []
+        self.category_ids = set()
+        # One instance validates every row: a fresh serializer per row would deep-copy its fields each time
+        self.row_serializer = ProductImportSerializer()
+
+    def run(self, rows):
+        for number, row, error in rows:
+            if error:
+                self.add_error(number, {"non_field_errors": [error]})
+                continue
+            try:
+                data = self.row_serializer.run_validation(row)
+            except ValidationError as exc:
+                self.add_error(number, exc.detail)
+                continue
+            product = self.build(number, data)
+            if product is not None:
+                self.batch.append(product)
+                if len(self.batch) >= self.batch_size:
+                    self.flush()
+        self.flush()
+        schedule_files([(self.image_field.storage, name) for name in self.new_images], self.cache_scopes)
+        return self.report()
+
+    def build(self, number, data):
+        category_id = self.categories.get(data["category_slug"])
+        if category_id is None:
+            self.add_error(number, {"category_slug": ["Category does not exist."]})
+            return None
+        images = {}
+        for field in IMAGE_FIELDS:
+            reference = data[field]
+            if reference:
+                images[field], error = self.resolve_image(reference)
+                if error:
+                    self.add_error(number, {field: [error]})
+                    return None
+        self.category_ids.add(category_id)
+        return Product(
+            seller=self.seller,
+            name=data["name"],
+            desc=data["desc"],
+            price_current=data["price_current"],
+            price_old=data.get("price_old"),
+            category_id=category_id,
+            in_stock=data["in_stock"],
+            **images,
+        )
+
+    def resolve_image(self, reference):
+        """
+            Storage name for an image reference. Zip members are checked like an
+            ``ImageField`` upload (extension, size, Pillow ``verify()``) and stored
+            once per import, however many rows use them; a name of an existing
+            stored product image is used as is.
+
+            Returns:
+                tuple: ``(name, error)``, one of them None.
+        """
+        if reference not in self.images:
+            self.images[reference] = self._resolve_image(reference)
+        return self.images[reference]
+
+    def _resolve_image(self, reference):
+        if reference.startswith("/") or ".." in reference.split("/") or posixpath.normpath(reference) != reference:
+            return None, f"Invalid image reference '{reference}'."
+        if reference in self.members:
+            return self.store_member(reference)
+        storage = self.image_field.storage
+        try:
+            if reference.startswith(self.image_field.upload_to) and storage.exists(reference):
+                return reference, None
+        except SuspiciousFileOperation:
+            return None, f"Invalid image reference '{reference}'."
+        return None, f"Image '{reference}' is not in the archive."
+
+    def store_member(self, reference):
+        filename = posixpath.basename(reference)
+        too_large = f"Image '{reference}' is larger than {self.max_image_size} bytes."
+        if self.archive.getinfo(reference).file_size > self.max_image_size:
+            return None, too_large
+        with self.archive.open(reference) as member:
+            # The header's size may lie, so the read is bounded as well
+            content = member.read(self.max_image_size + 1)
+        if len(content) > self.max_image_size:
+            return None, too_large
+        image = ContentFile(content, name=filename)
+        try:
+            validate_image_file_extension(image)
+            Image.open(io.BytesIO(content)).verify()
+        except DjangoValidationError as exc:
+            return None, f"Image '{reference}': {exc.messages[0]}"
+        except Exception:
+            # Pillow raises many kinds of errors for broken files, as ImageField notes
+            return None, f"Image '{reference}' is not a valid image."
+        name = self.image_field.storage.save(self.image_field.generate_filename(None, filename), image)
+        self.new_images.append(name)
+        return name, None
+
+    def flush(self):
+        if not self.batch:
+            return
+        for attempt in range(self.max_slug_attempts):
+            assign_slugs(self.batch)
+            try:
+                with transaction.atomic():
+                    Product.objects.bulk_create(self.batch, batch_size=self.batch_size)
+                    PriceHistory.record(self.batch)
+                break
+            except IntegrityError:
+                # A concurrent writer took one of the reserved slugs; reserve again
+                if attempt == self.max_slug_attempts - 1:
+                    raise
+        self.created += len(self.batch)
+        self.batch = []
+
+    def add_error(self, number, errors):
+        self.failed += 1
+        if len(self.errors) < self.error_limit:
+            self.errors.append({"row": number, "errors": errors})
+
+    def report(self):
+        return {
+            "created": self.created,
+            "failed": self.failed,
+            "errors": self.errors,
+            "errors_truncated": self.failed > len(self.errors),
+        }
+
+    def cache_scopes(self):
+        paths = Category.objects.filter(id__in=self.category_ids).values_list("path", flat=True)
+        return ["products", f"seller:{self.seller.slug}"] + Category.path_scopes(paths)
+
+
+class Repricer:
+    """
+        Applies many price changes to a seller's products in one pass.
+
+        Changes are given as explicit ``{"slug", "price_current"}`` pairs and / or
+        ``{"category_slug", "percent"}`` rules. A rule covers the category's whole
+        subtree; an explicit price wins over a rule for the same product, and the
+        rule of the nearest category wins over one of an ancestor. The affected
+        products are read in one query (after one for the rules' paths), the
+        new prices are written with a single ``bulk_update`` and every change is
+        appended to ``PriceHistory`` in one more INSERT. The old price moves to
+        ``price_old``, as a single product update does.
+
+        Attributes:
+            seller (Seller): Owner of the products; other sellers' slugs count as missing.
+            batch_size (int): Rows per UPDATE / INSERT statement.
+    """
+    batch_size = 1000
+
+    def __init__(self, seller):
+        self.seller = seller
+        self.changed = []
+        self.unchanged = 0
+        self.missing = []
+        self.category_paths = set()
+
+    @staticmethod
+    def apply_percent(price, percent):
+        new_price = (price * (100 + percent) / 100).quantize(CENT, rounding=ROUND_HALF_UP)
+        return max(new_price, CENT)
+
+    def run(self, prices=(), rules=()):
+        explicit = {change["slug"]: change["price_current"] for change in prices}
+        percents = {rule["category_slug"]: rule["percent"] for rule in rules}
+        paths = dict(Category.objects.filter(slug__in=percents).values_list("path", "slug")) if percents else {}
+        # Deepest first, so the first matching prefix is the nearest ruled category
+        ruled = sorted(((path, percents[slug]) for path, slug in paths.items()), key=lambda item: -len(item[0]))
+        selected = Q(slug__in=explicit)
+        for path, _ in ruled:
+            selected |= Q(**subtree_range(path, "category__path"))
+        products = (
+            Product.objects.filter(seller=self.seller)
+            .filter(selected)
+            .annotate(category_path=F("category__path"))
+            .only("id", "slug", "price_current", "price_old", "category_id")
+        )
+        found = set()
+        now = timezone.now()
+        for product in products:
+            found.add(product.slug)
+            if product.slug in explicit:
+                new_price = explicit[product.slug]
+            else:
+                percent = next(percent for path, percent in ruled if product.category_path.startswith(path))
+                new_price = self.apply_percent(product.price_current, percent)
+            if new_price == product.price_current:
+                self.unchanged += 1
+                continue
+            product.price_old = product.price_current
+            product.price_current = new_price
+            product.update_at = now
+            self.changed.append(product)
+            self.category_paths.add(product.category_path)
+        self.missing = sorted(set(explicit) - found)
+
+        with transaction.atomic():
+            Product.objects.bulk_update(
+                self.changed, ["price_current", "price_old", "update_at"], batch_size=self.batch_size
+            )
+            PriceHistory.record(self.changed, changed_at=now)
+        return self.report()
+
+    def report(self):
+        return {
+            "updated": len(self.changed),
+            "unchanged": self.unchanged,
+            "missing": self.missing,
+        }
+
+    def cache_scopes(self):
+        return (
+            ["products", f"seller:{self.seller.slug}"]
+            + Category.path_scopes(self.category_paths)
+            + [f"product:{product.slug}" for product in self.changed]
+        )
+
+
+def open_archive(upload):
+    """The uploaded images zip, or None. Raises ``zipfile.BadZipFile`` for a broken one."""
+    if upload is None:
+        return None
+    return zipfile.ZipFile(getattr(upload.file, "file", upload.file))
+
+
+class _Echo:
+    def write(self, value):
+        return value
+
+
+def export_rows(queryset, output, chunk_size=2000):
+    """
+        Yields a seller's products as CSV or NDJSON text, ``chunk_size`` rows per
+        chunk, reading them with ``iterator()`` so the catalog is never loaded
+        whole. The columns are those the import accepts, plus ``slug``.
+    """
+    columns = [column if column != "category_slug" else "category__slug" for column in EXPORT_COLUMNS]
+    rows = queryset.order_by("create_at", "id").values_list(*columns).iterator(chunk_size=chunk_size)
+    writer = csv.writer(_Echo()) if output == "csv" else None
+    chunk = []
+    if writer is not None:
+        chunk.append(writer.writerow(EXPORT_COLUMNS))
+    for row in rows:
+        if writer is not None:
+            chunk.append(writer.writerow(["" if value is None else value for value in row]))
+        else:
+            # Prices as strings, like the API, so no precision is lost
+            data = {
+                column: str(value) if isinstance(value, Decimal) else value for column, value in zip(EXPORT_COLUMNS, row)
+            }
+            chunk.append(json.dumps(data, ensure_ascii=False) + "\n")
+        if len(chunk) >= chunk_size:
+            yield "".join(chunk)
+            chunk = []
+    if chunk:
+        yield "".join(chunk)
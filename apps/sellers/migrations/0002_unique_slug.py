@@ -0,0 +1,38 @@
+# Generated by Django 5.2.1 on 2026-10-18 19:10
+
+import apps.common.slugs
+from django.db import migrations
+from django.db.models import Count
+
+
+def dedupe_slugs(apps, schema_editor):
+    # Sellers with the same business name shared a slug; give all but the first a suffix
+    Seller = apps.get_model('sellers', 'Seller')
+    shared = Seller.objects.values('slug').annotate(total=Count('id')).filter(total__gt=1, slug__isnull=False)
+    taken = set(Seller.objects.values_list('slug', flat=True))
+    for row in shared:
+        for index, seller in enumerate(Seller.objects.filter(slug=row['slug']).order_by('create_at')):
+            if not index:
+                continue
+            suffix = 2
+            while f"{row['slug']}-{suffix}" in taken:
+                suffix += 1
+            slug = f"{row['slug']}-{suffix}"
+            taken.add(slug)
+            Seller.objects.filter(pk=seller.pk).update(slug=slug)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sellers', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(dedupe_slugs, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='seller',
+            name='slug',
+            field=apps.common.slugs.ReservedAutoSlugField(always_update=True, editable=False, null=True, populate_from='business_name', unique=True),
+        ),
+    ]
@@ -1,18 +1,58 @@
-from django.db import models
-from autoslug import AutoSlugField
-
+from django.conf import settings
+from django.core.cache import cache
+from django.db import models, transaction
+from django.db.models.signals import post_delete
 from apps.accounts.models import User
+from apps.common.cache import bump_versions, get_versions
+from apps.common.managers import GetOrNoneManager, GetOrNoneQuerySet
 from apps.common.models import BaseModel
+from apps.common.slugs import ReservedAutoSlugField, ReservedSlugMixin
 
 # Create your models here.
 
-class Seller(BaseModel):
+SELLER_CACHE_PREFIX = "seller:user"
+
+
+def forget_sellers(user_ids):
+    """Makes the cached profiles of ``user_ids`` unreachable once the transaction commits."""
+    scopes = [Seller.cache_scope(user_id) for user_id in set(user_ids)]
+    if scopes:
+        transaction.on_commit(lambda: bump_versions(*scopes), robust=True)
+
+
+class SellerQuerySet(GetOrNoneQuerySet):
+    def update(self, **kwargs):
+        """Bulk updates (admin actions, ``bulk_update``...) invalidate the cached profiles too."""
+        with transaction.atomic(using=self.db):
+            forget_sellers(self.values_list("user_id", flat=True))
+            return super().update(**kwargs)
+
+
+class SellerManager(GetOrNoneManager):
+    def get_queryset(self):
+        return SellerQuerySet(self.model, using=self._db)
+
+
+class Seller(ReservedSlugMixin, BaseModel):
+    """
+        A user's seller profile.
+
+        Methods:
+            cached_for(user_id):
+                The profile of ``user_id`` (None without one), from the cache
+                for ``SELLER_CACHE_TIMEOUT`` seconds.
+
+        Cached profiles are keyed by a per-user version (see
+        ``apps.common.cache.get_versions``), bumped on commit of every save,
+        delete (cascades included) and queryset ``update``, so a revoked
+        approval is seen by the next request.
+    """
     # Link to the User model
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name="seller")
 
     # Business Information
     business_name = models.CharField(max_length=255)
-    slug = AutoSlugField(populate_from="business_name", always_update=True, null=True)
+    slug = ReservedAutoSlugField(populate_from="business_name", always_update=True, unique=True, null=True)
     inn_identification_number = models.CharField(max_length=50)
     website_url = models.URLField(null=True)
     phone_number = models.CharField(max_length=20)
@@ -32,5 +72,35 @@ class Seller(BaseModel):
     # Status filds
     is_approved = models.BooleanField(default=False)
 
+    objects = SellerManager()
+
     def __str__(self):
         return f"Seller for {self.business_name}"
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        forget_sellers([self.user_id])
+
+    @staticmethod
+    def cache_scope(user_id):
+        return f"{SELLER_CACHE_PREFIX}:{user_id}"
+
+    @classmethod
+    def cached_for(cls, user_id):
+        # The version is read before the row: a change committed in between
+        # bumps it, so what is stored below is never served
+        version = get_versions([cls.cache_scope(user_id)])[0]
+        key = f"{cls.cache_scope(user_id)}:{version}"
+        seller = cache.get(key)
+        if seller is None:
+            # False caches "no profile", which the cache cannot tell from a miss with None
+            seller = cls.objects.get_or_none(user_id=user_id) or False
+            cache.set(key, seller, getattr(settings, "SELLER_CACHE_TIMEOUT", 300))
+        return seller or None
+
+
+def seller_deleted(sender, instance, **kwargs):
+    forget_sellers([instance.user_id])
+
+
+post_delete.connect(seller_deleted, sender=Seller, dispatch_uid="seller_deleted")
@@ -0,0 +1,42 @@
+from django.utils.functional import cached_property
+
+from apps.sellers.models import Seller
+
+
+class Principal:
+    """
+        Who a request acts as: its user and their seller profile, looked up at
+        most once per request and shared by ``IsSeller`` and the seller views
+        (see ``get_principal``). The profile comes from ``Seller.cached_for``,
+        so most requests do not query it at all.
+
+        Attributes:
+            user (User): ``request.user``.
+            seller (Seller): The user's seller profile, or None.
+            approved_seller (Seller): The profile if it is approved, else None.
+    """
+    def __init__(self, user):
+        self.user = user
+
+    @cached_property
+    def seller(self):
+        if not self.user.is_authenticated:
+            return None
+        seller = Seller.cached_for(self.user.pk)
+        if seller is not None:
+            # Same row as request.user; also caches request.user.seller
+            seller.user = self.user
+        return seller
+
+    @property
+    def approved_seller(self):
+        seller = self.seller
+        return seller if seller is not None and seller.is_approved else None
+
+
+def get_principal(request):
+    """The ``Principal`` of ``request``, built on first use."""
+    principal = getattr(request, "principal", None)
+    if principal is None or principal.user is not request.user:
+        principal = request.principal = Principal(request.user)
+    return principal
@@ -1,5 +1,14 @@
+from datetime import timedelta
+from decimal import Decimal
+
+from django.utils import timezone
+from drf_spectacular.utils import extend_schema_field
 from rest_framework import serializers
 
+from apps.profiles.serializers import ShippingAddressSerializer
+from apps.sellers.analytics import GRANULARITIES
+from apps.shop.serializers import OrderLineSerializer
+
 class SellerSerializer(serializers.Serializer):
     business_name = serializers.CharField(max_length=255)
     slug = serializers.SlugField(read_only=True)
@@ -18,3 +27,127 @@ class SellerSerializer(serializers.Serializer):
     bank_routing_numbers = serializers.CharField(max_length=50)
 
     is_approved = serializers.BooleanField(read_only=True)
+
+
+class ProductImportSerializer(serializers.Serializer):
+    """
+        One row of a bulk product import (CSV column or NDJSON key per field).
+        ``image1``..``image3`` name a file in the uploaded zip, or an image already
+        stored under ``product_images/`` (as written by the export).
+    """
+    name = serializers.CharField(max_length=100)
+    desc = serializers.CharField()
+    price_current = serializers.DecimalField(max_digits=10, decimal_places=2)
+    price_old = serializers.DecimalField(max_digits=10, decimal_places=2, required=False, allow_null=True)
+    category_slug = serializers.SlugField()
+    in_stock = serializers.IntegerField(min_value=0, default=0)
+    image1 = serializers.CharField(max_length=255)
+    image2 = serializers.CharField(max_length=255, allow_blank=True, default="")
+    image3 = serializers.CharField(max_length=255, allow_blank=True, default="")
+
+    def to_internal_value(self, data):
+        # Empty CSV cells mean "not given"
+        data = {key: value for key, value in data.items() if value not in ("", None)}
+        return super().to_internal_value(data)
+
+
+class ProductImportRequestSerializer(serializers.Serializer):
+    file = serializers.FileField(help_text="CSV with a header row, or NDJSON (one product object per line).")
+    images = serializers.FileField(required=False, help_text="Zip with the images the rows refer to.")
+    input = serializers.ChoiceField(choices=["csv", "ndjson"], required=False,
+                                    help_text="Format of the file; guessed from its name when omitted.")
+    batch_size = serializers.IntegerField(min_value=1, max_value=5000, required=False,
+                                          help_text="Products per INSERT. Defaults to 1000.")
+
+
+class PriceChangeSerializer(serializers.Serializer):
+    slug = serializers.SlugField()
+    price_current = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=Decimal("0.01"))
+
+
+class PriceRuleSerializer(serializers.Serializer):
+    category_slug = serializers.SlugField()
+    percent = serializers.DecimalField(max_digits=6, decimal_places=2, min_value=Decimal("-99.99"), max_value=Decimal(1000),
+                                       help_text="Change in percent, e.g. -15 for 15% off.")
+
+
+class RepriceSerializer(serializers.Serializer):
+    prices = PriceChangeSerializer(many=True, required=False, max_length=5000)
+    rules = PriceRuleSerializer(many=True, required=False, max_length=100)
+
+    def validate(self, attrs):
+        if not attrs.get("prices") and not attrs.get("rules"):
+            raise serializers.ValidationError("Give at least one price or rule.")
+        return attrs
+
+
+class SellerOrderSerializer(serializers.Serializer):
+    """A seller's share of an order: only their lines and subtotal, with the order's statuses."""
+    tx_ref = serializers.CharField(source="order.tx_ref")
+    create_at = serializers.DateTimeField()
+    delivery_status = serializers.CharField(source="order.delivery_status")
+    payment_status = serializers.CharField(source="order.payment_status")
+    date_delivered = serializers.DateTimeField(source="order.date_delivered")
+    shipping_details = serializers.SerializerMethodField()
+    item_count = serializers.IntegerField()
+    subtotal = serializers.DecimalField(max_digits=12, decimal_places=2)
+    items = serializers.SerializerMethodField()
+
+    @extend_schema_field(ShippingAddressSerializer)
+    def get_shipping_details(self, obj):
+        return ShippingAddressSerializer(obj.order).data
+
+    @extend_schema_field(OrderLineSerializer(many=True))
+    def get_items(self, obj):
+        # Stored already rendered at checkout
+        return obj.items
+
+
+class SalesAnalyticsQuerySerializer(serializers.Serializer):
+    """``from`` / ``to`` days (the last 30 days by default) and the series granularity."""
+    max_days = 3660
+
+    to = serializers.DateField(required=False)
+    granularity = serializers.ChoiceField(choices=GRANULARITIES, default="day")
+    top = serializers.IntegerField(min_value=1, max_value=100, default=10)
+
+    def get_fields(self):
+        # "from" is a keyword, so it cannot be declared as a class attribute
+        fields = super().get_fields()
+        fields["from"] = serializers.DateField(required=False)
+        return fields
+
+    def validate(self, attrs):
+        until = attrs.pop("to", None) or timezone.localdate()
+        since = attrs.pop("from", None) or until - timedelta(days=29)
+        if since > until:
+            raise serializers.ValidationError({"from": "Must not be after 'to'."})
+        if (until - since).days >= self.max_days:
+            raise serializers.ValidationError({"from": f"The range may span at most {self.max_days} days."})
+        return {**attrs, "since": since, "until": until}
+
+
+class SalesPointSerializer(serializers.Serializer):
+    period = serializers.DateField()
+    orders = serializers.IntegerField()
+    units = serializers.IntegerField()
+    revenue = serializers.DecimalField(max_digits=14, decimal_places=2)
+
+
+class TopProductSerializer(serializers.Serializer):
+    slug = serializers.SlugField(allow_null=True)
+    name = serializers.CharField(allow_null=True)
+    orders = serializers.IntegerField()
+    units = serializers.IntegerField()
+    revenue = serializers.DecimalField(max_digits=14, decimal_places=2)
+
+
+class SalesAnalyticsSerializer(serializers.Serializer):
+    since = serializers.DateField()
+    until = serializers.DateField()
+    granularity = serializers.CharField()
+    orders = serializers.IntegerField()
+    units = serializers.IntegerField()
+    revenue = serializers.DecimalField(max_digits=14, decimal_places=2)
+    series = SalesPointSerializer(many=True)
+    top_products = TopProductSerializer(many=True)
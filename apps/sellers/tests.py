@@ -1,10 +1,27 @@
-from django.test import TestCase
+import tempfile
+import zipfile
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
-from rest_framework.test import APIRequestFactory
+from django.utils import timezone
+from PIL import Image
+from rest_framework.test import APIClient, APIRequestFactory
 from rest_framework import status
 
+from apps.accounts.models import User
+from apps.common.testing import create_seller
+from apps.sellers.catalog import ProductImporter
+from apps.sellers.models import Seller
 from apps.sellers.views import SellerProductsView
-from apps.shop.models import Product
+from apps.shop.models import Category, PriceHistory, Product
 
 
 # Create your tests here.
@@ -25,4 +42,189 @@ class SellerProductsViewTests(TestCase):
 
     # def test_post_create(self):
     #     url = reverse("sellers/products")
-    #     data = {"title": "New Book", "author": "New Author"}
\ No newline at end of file
+    #     data = {"title": "New Book", "author": "New Author"}
+
+
+class SellerProductImportImagesTests(TestCase):
+    """Images in an import are checked like an ImageField upload; bad ones fail their row, not the request."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("Seller", "One", "seller@example.com", "password", account_type="SELLER")
+        create_seller(cls.user)
+        Category.objects.create(name="Laptops", image="category_images/laptops.jpg")
+
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=media_root.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def import_rows(self, references, members):
+        jpeg = BytesIO()
+        Image.new("RGB", (8, 8), "red").save(jpeg, "JPEG")
+        archive = BytesIO()
+        with zipfile.ZipFile(archive, "w") as zip_file:
+            for name, content in members.items():
+                zip_file.writestr(name, jpeg.getvalue() if content is None else content)
+        lines = ["name,desc,price_current,category_slug,in_stock,image1"]
+        lines += [f"Laptop {i},d,100,laptops,1,{reference}" for i, reference in enumerate(references)]
+        response = self.client.post("/sellers/products/import/", {
+            "file": SimpleUploadedFile("products.csv", "\n".join(lines).encode(), "text/csv"),
+            "images": SimpleUploadedFile("images.zip", archive.getvalue(), "application/zip"),
+        }, format="multipart")
+        return response.status_code, response.data
+
+    def test_invalid_images_fail_their_rows(self):
+        status, report = self.import_rows(
+            ["a.jpg", "fake.jpg", "page.html", "product_images/../a.jpg", "/etc/passwd", "missing.jpg"],
+            {"a.jpg": None, "fake.jpg": b"not an image", "page.html": None},
+        )
+        self.assertEqual(status, 201)
+        self.assertEqual((report["created"], report["failed"]), (1, 5))
+        errors = {error["row"]: error["errors"]["image1"][0] for error in report["errors"]}
+        self.assertIn("not a valid image", errors[2])
+        self.assertIn("extension", errors[3])
+        self.assertIn("Invalid image reference", errors[4])
+        self.assertIn("Invalid image reference", errors[5])
+        self.assertIn("not in the archive", errors[6])
+        self.assertTrue(Product.objects.get().image1.name.startswith("product_images/"))
+
+    def test_oversized_images_are_refused(self):
+        with mock.patch.object(ProductImporter, "max_image_size", 100):
+            status, report = self.import_rows(["a.jpg"], {"a.jpg": None})
+        self.assertEqual((status, report["failed"]), (400, 1))
+        self.assertIn("larger than", report["errors"][0]["errors"]["image1"][0])
+
+
+class RepricingTests(TestCase):
+    """Bulk repricing: explicit prices beat rules, the nearest category rule wins, history is appended."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("Seller", "One", "seller@example.com", "password", account_type="SELLER")
+        seller = create_seller(cls.user)
+        other_user = User.objects.create_user("Seller", "Two", "other@example.com", "password", account_type="SELLER")
+        other = create_seller(other_user, "Shop Two")
+        laptops = Category.objects.create(name="Laptops", image="category_images/laptops.jpg")
+        ultrabooks = Category.objects.create(name="Ultrabooks", image="category_images/u.jpg", parent=laptops)
+        for slug, owner, category, price in [
+            ("explicit", seller, laptops, 100), ("ruled", seller, laptops, 100), ("nested", seller, ultrabooks, 200),
+            ("same", seller, laptops, 70), ("foreign", other, laptops, 100),
+        ]:
+            Product.objects.create(
+                seller=owner, name=slug, slug=slug, desc="d", price_current=Decimal(price), category=category,
+                image1="product_images/p.jpg",
+            )
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def prices(self):
+        return {slug: str(price) for slug, price in Product.objects.values_list("slug", "price_current")}
+
+    def test_rules_and_explicit_prices(self):
+        response = self.client.post("/sellers/products/prices/", {
+            "prices": [
+                {"slug": "explicit", "price_current": "90"}, {"slug": "same", "price_current": "70"},
+                {"slug": "foreign", "price_current": "1"}, {"slug": "nope", "price_current": "1"},
+            ],
+            "rules": [{"category_slug": "laptops", "percent": "10"}, {"category_slug": "ultrabooks", "percent": "-50"}],
+        }, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {"updated": 3, "unchanged": 1, "missing": ["foreign", "nope"]})
+        self.assertEqual(self.prices(), {
+            "explicit": "90.00", "ruled": "110.00", "nested": "100.00", "same": "70.00", "foreign": "100.00",
+        })
+        self.assertEqual(Product.objects.get(slug="nested").price_old, Decimal("200.00"))
+        history = PriceHistory.objects.order_by("product__slug")
+        self.assertEqual(
+            [(row.product.slug, str(row.price)) for row in history],
+            [("explicit", "90.00"), ("nested", "100.00"), ("ruled", "110.00")],
+        )
+        self.assertEqual(len({row.changed_at for row in history}), 1)
+
+    def test_history_is_appended_and_downsampled(self):
+        product = Product.objects.get(slug="ruled")
+        noon = timezone.now().replace(hour=12, minute=0, second=0, microsecond=0)
+        PriceHistory.objects.bulk_create([
+            PriceHistory(product=product, price=Decimal(price), changed_at=noon - timedelta(days=days, minutes=minutes))
+            for price, days, minutes in [(120, 200, 0), (110, 10, 5), (130, 10, 0)]
+        ])
+        self.client.post("/sellers/products/prices/", {"prices": [{"slug": "ruled", "price_current": "80"}]}, format="json")
+        self.client.post("/sellers/products/prices/", {"prices": [{"slug": "ruled", "price_current": "75"}]}, format="json")
+        self.assertEqual(PriceHistory.objects.filter(product=product).count(), 5)
+
+        response = self.client.get("/shop/products/ruled/price-history/", {"days": 30, "interval": "day"})
+        self.assertEqual(response.data["start_price"], "120.00")
+        self.assertEqual(response.data["current_price"], "75.00")
+        self.assertEqual(
+            [(point["low"], point["high"], point["changes"]) for point in response.data["points"]],
+            [("110.00", "130.00", 2), ("75.00", "80.00", 2)],
+        )
+
+
+class SellerPrincipalTests(TestCase):
+    """Seller endpoints take the seller profile from the cache, which every change invalidates."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("Seller", "One", "seller@example.com", "password", account_type="SELLER")
+        cls.seller = create_seller(cls.user)
+        category = Category.objects.create(name="Laptops", image="category_images/laptops.jpg")
+        cls.product = Product.objects.create(
+            seller=cls.seller, name="Laptop", desc="d", price_current=Decimal(100), category=category,
+            image1="product_images/p.jpg",
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        return response, [query["sql"] for query in queries if "sellers_seller" in query["sql"]]
+
+    def test_profile_is_read_once_then_cached(self):
+        url = f"/sellers/product/{self.product.slug}/"
+        response, queries = self.get(url)
+        self.assertEqual(response.status_code, 200)
+        # IsSeller, the view and the serializer share one read
+        self.assertEqual(len(queries), 1)
+        response, queries = self.get(url)
+        self.assertEqual(response.data["seller"]["slug"], "shop-one")
+        self.assertEqual(queries, [])
+
+    def test_profile_changes_are_seen_at_once(self):
+        self.assertEqual(self.get("/sellers/orders/")[0].status_code, 200)
+        # A bulk update bypasses save(), and must still revoke access at once
+        with self.captureOnCommitCallbacks(execute=True):
+            Seller.objects.filter(pk=self.seller.pk).update(is_approved=False)
+        self.assertEqual(self.get("/sellers/orders/")[0].status_code, 403)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.seller.is_approved = True
+            self.seller.save()
+        self.assertEqual(self.get("/sellers/orders/")[0].status_code, 200)
+
+        data = {
+            "business_name": "Shop Two", "inn_identification_number": "1", "phone_number": "1",
+            "business_description": "d", "business_address": "a", "city": "c", "postal_code": "1",
+            "bank_name": "b", "bank_bic_number": "1", "bank_account_number": "1", "bank_routing_numbers": "1",
+        }
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.post("/sellers/", data).status_code, 201)
+        response, _ = self.get("/sellers/products/export/")
+        self.assertIn("shop-two-products.csv", response["Content-Disposition"])
+
+    def test_deleted_profile_is_forgotten(self):
+        self.assertEqual(self.get("/sellers/orders/")[0].status_code, 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.seller.delete()
+        self.assertEqual(self.get("/sellers/orders/")[0].status_code, 403)
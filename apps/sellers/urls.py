@@ -2,12 +2,17 @@ from django.urls import path
 
 from apps.profiles.urls import urlpatterns
 from apps.sellers.views import SellersView, SellerProductsView, SellerProductView, SellerOrdersView, \
-    SellerOrderItemsView
+    SellerOrderItemsView, SellerProductsImportView, SellerProductsExportView, \
+    SellerProductsPricesView, SellerAnalyticsView
 
 urlpatterns = [
     path("", SellersView.as_view()),
     path("products/", SellerProductsView.as_view()),
+    path("products/import/", SellerProductsImportView.as_view()),
+    path("products/export/", SellerProductsExportView.as_view()),
+    path("products/prices/", SellerProductsPricesView.as_view()),
     path("product/<slug:slug>/", SellerProductView.as_view()),
     path("orders/", SellerOrdersView.as_view()),
     path("orders/<str:tx_ref>/", SellerOrderItemsView.as_view()),
+    path("analytics/", SellerAnalyticsView.as_view()),
 ]
\ No newline at end of file
@@ -1,19 +1,33 @@
+import zipfile
+
 from django.core.serializers import serialize
-from drf_spectacular.utils import extend_schema
+from django.db import transaction
+from django.http import StreamingHttpResponse
+from drf_spectacular.utils import extend_schema, inline_serializer, OpenApiParameter, OpenApiTypes
+from rest_framework import serializers
+from rest_framework.parsers import MultiPartParser
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from unicodedata import category
 
+from apps.common.cache import bump_versions
+from apps.common.paginations import OrderCursorPagination
 from apps.common.permissions import IsSeller
 from apps.common.utils import set_dict_attr
+from apps.sellers.catalog import IMPORT_FORMATS, ProductImporter, Repricer, detect_format, export_rows, open_archive, \
+    read_rows
 from apps.sellers.models import Seller
-from apps.sellers.serializers import SellerSerializer
+from apps.sellers.principal import get_principal
+from apps.sellers.analytics import sales_report
+from apps.sellers.serializers import ProductImportRequestSerializer, RepriceSerializer, SalesAnalyticsQuerySerializer, \
+    SalesAnalyticsSerializer, SellerOrderSerializer, SellerSerializer
 
-from apps.shop.models import Category, Product
-from apps.shop.serializers import ProductSerializer, CreateProductSerializer, CheckItemOrderSerializer
-from apps.profiles.models import Order, OrderItem
-from apps.shop.serializers import ProductSerializer, CreateProductSerializer, OrderSerializer, \
-        CheckItemOrderSerializer
+from apps.shop.models import Category, PriceHistory, Product
+from apps.shop.schema_examples import PRODUCT_PARAM_EXAMPLE
+from apps.shop.views import ProductListMixin
+from apps.shop.serializers import ProductSerializer, CreateProductSerializer, OrderLineSerializer
+from apps.profiles.models import SellerOrder
+from apps.profiles.views import ORDER_PARAM_EXAMPLE
 
 tags = ["Sellers"]
 
@@ -40,7 +54,7 @@ class SellersView(APIView):
         else:
             return Response(data=serializer.errors, status=400)
 
-class SellerProductsView(APIView):
+class SellerProductsView(ProductListMixin, APIView):
     permission_classes = [IsSeller]
     serializer_class = ProductSerializer
 
@@ -48,17 +62,17 @@ class SellerProductsView(APIView):
         summary="Seller Products Fetch",
         description="""
                 This endpoint returns all products from a seller.
-                Products can be filtered by name, sizes or colors.
+                Products can be filtered by price, stock or creation date.
             """,
         tags=tags,
+        parameters=PRODUCT_PARAM_EXAMPLE,
     )
     def get(self, request, *args, **kwargs):
-        seller = Seller.objects.get_or_none(user=request.user, is_approved=True)
+        seller = get_principal(request).approved_seller
         if not seller:
             return Response(data={"message": "Access is denied"}, status=403)
         products = Product.objects.select_related("category", "seller", "seller__user").filter(seller=seller)
-        serializer = self.serializer_class(products, many=True)
-        return Response(data=serializer.data, status=200)
+        return self.list_products(request, products, [f"seller:{seller.slug}"])
 
     @extend_schema(
         summary="Create a product",
@@ -71,7 +85,7 @@ class SellerProductsView(APIView):
     )
     def post(self, request, *args, **kwargs):
         serializer = CreateProductSerializer(data=request.data)
-        seller = Seller.objects.get_or_none(user=request.user, is_approved=True)
+        seller = get_principal(request).approved_seller
         if not seller:
             return Response(data={"message": "Access is denied"}, status=403)
         if serializer.is_valid():
@@ -82,21 +96,156 @@ class SellerProductsView(APIView):
                 return Response(data={"message": "Category does not exist!"}, status=404)
             data['category'] = category
             data['seller'] = seller
-            new_prod = Product.objects.create(**data)
+            with transaction.atomic():
+                new_prod = Product.objects.create(**data)
+                PriceHistory.record([new_prod])
+            bump_versions(*new_prod.cache_scopes())
             serializer = self.serializer_class(new_prod)
             return Response(serializer.data, status=201)
         else:
             return Response(serializer.errors, status=400)
 
 
+class SellerProductsImportView(APIView):
+    permission_classes = [IsSeller]
+    parser_classes = [MultiPartParser]
+    serializer_class = ProductImportRequestSerializer
+    batch_size = 1000
+
+    @extend_schema(
+        summary="Bulk import products",
+        description="""
+                This endpoint allows a seller to create many products from one CSV or NDJSON file.
+                Columns / keys: name, desc, price_current, price_old, category_slug, in_stock,
+                image1, image2, image3. Images name files in the optional zip (or images
+                already stored, as written by the export). Invalid rows are skipped and
+                listed in the report; the valid ones are created in one transaction.
+            """,
+        tags=tags,
+        request={"multipart/form-data": serializer_class},
+        responses=inline_serializer(
+            name="ProductImportReport",
+            fields={
+                "created": serializers.IntegerField(),
+                "failed": serializers.IntegerField(),
+                "errors": serializers.ListField(child=serializers.DictField()),
+                "errors_truncated": serializers.BooleanField(),
+            },
+        ),
+    )
+    def post(self, request, *args, **kwargs):
+        seller = get_principal(request).approved_seller
+        if not seller:
+            return Response(data={"message": "Access is denied"}, status=403)
+        serializer = self.serializer_class(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        input_format = detect_format(data["file"], data.get("input"))
+        if input_format is None:
+            return Response(data={"input": ["Cannot tell the file format, pass 'csv' or 'ndjson'."]}, status=400)
+        try:
+            archive = open_archive(data.get("images"))
+        except zipfile.BadZipFile:
+            return Response(data={"images": ["Not a valid zip file."]}, status=400)
+
+        importer = ProductImporter(seller, archive, data.get("batch_size", self.batch_size))
+        with transaction.atomic():
+            report = importer.run(read_rows(data["file"], input_format))
+        if report["created"]:
+            bump_versions(*importer.cache_scopes())
+        return Response(data=report, status=201 if report["created"] else 400)
+
+
+class SellerProductsExportView(APIView):
+    permission_classes = [IsSeller]
+
+    @extend_schema(
+        summary="Export products",
+        description="""
+                This endpoint streams all products of a seller as CSV (default) or NDJSON,
+                in the format the import accepts.
+            """,
+        tags=tags,
+        parameters=[
+            OpenApiParameter(
+                name="output",
+                description="csv (default) or ndjson",
+                required=False,
+                type=OpenApiTypes.STR,
+                enum=["csv", "ndjson"],
+            ),
+        ],
+        responses={(200, "text/csv"): OpenApiTypes.STR, (200, "application/x-ndjson"): OpenApiTypes.STR},
+    )
+    def get(self, request, *args, **kwargs):
+        seller = get_principal(request).approved_seller
+        if not seller:
+            return Response(data={"message": "Access is denied"}, status=403)
+        output = request.query_params.get("output", "csv")
+        if output not in IMPORT_FORMATS:
+            return Response(data={"output": ["Must be 'csv' or 'ndjson'."]}, status=400)
+        content_type = "text/csv" if output == "csv" else "application/x-ndjson"
+        response = StreamingHttpResponse(
+            export_rows(Product.objects.filter(seller=seller), output), content_type=content_type
+        )
+        response["Content-Disposition"] = f'attachment; filename="{seller.slug}-products.{output}"'
+        return response
+
+
+class SellerProductsPricesView(APIView):
+    permission_classes = [IsSeller]
+    serializer_class = RepriceSerializer
+
+    @extend_schema(
+        summary="Bulk update product prices",
+        description="""
+                This endpoint allows a seller to reprice many products at once, with explicit
+                prices per slug and / or a percentage rule per category. An explicit price wins
+                over a rule. All changes are written in one transaction and logged to the
+                price history.
+            """,
+        tags=tags,
+        request=serializer_class,
+        responses=inline_serializer(
+            name="RepriceReport",
+            fields={
+                "updated": serializers.IntegerField(),
+                "unchanged": serializers.IntegerField(),
+                "missing": serializers.ListField(child=serializers.SlugField()),
+            },
+        ),
+    )
+    def post(self, request, *args, **kwargs):
+        seller = get_principal(request).approved_seller
+        if not seller:
+            return Response(data={"message": "Access is denied"}, status=403)
+        serializer = self.serializer_class(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        repricer = Repricer(seller)
+        report = repricer.run(data.get("prices", ()), data.get("rules", ()))
+        if report["updated"]:
+            bump_versions(*repricer.cache_scopes())
+        return Response(data=report, status=200)
+
+
 class SellerProductView(APIView):
     permission_classes = [IsSeller]
     serializer_class = CreateProductSerializer
 
     def get_object(self, slug):
-        product = Product.objects.get_or_none(slug=slug)
+        product = Product.objects.select_related("category").get_or_none(slug=slug)
         return product
 
+    @staticmethod
+    def owns(request, product):
+        seller = get_principal(request).approved_seller
+        if seller is None or product.seller_id != seller.id:
+            return False
+        # The principal's seller, with its user already loaded
+        product.seller = seller
+        return True
+
     @extend_schema(
         summary="Product Fetch Slug",
         description="""
@@ -105,11 +254,10 @@ class SellerProductView(APIView):
         tags=tags,
     )
     def get(self, request, *args, **kwargs):
-        user = request.user
         product = self.get_object(kwargs["slug"])
         if not product:
             return Response(data={"message": "Product does not exist!"}, status=404)
-        if product.seller.user != user:
+        if not self.owns(request, product):
             return Response(data={"message": "User does not permission for edite!"}, status=403)
         return Response(data=ProductSerializer(product).data, status=200)
 
@@ -122,22 +270,27 @@ class SellerProductView(APIView):
         request={"multipart/form-data": serializer_class},
     )
     def put(self, request, *args, **kwargs):
-        user = request.user
         product = self.get_object( kwargs["slug"])
         if not product:
             return Response(data={"message": "Product does not exist!"}, status=404)
-        elif product.seller.user != user:
+        elif not self.owns(request, product):
             return Response(data={"message": "User does not permission for edite!"}, status=403)
 
         serializer = self.serializer_class(data=request.data)
         serializer.is_valid(raise_exception=True)
         data = serializer.validated_data
 
-        if str(product.price_current) != str(request.data["price_current"]):
+        price_changed = product.price_current != data["price_current"]
+        if price_changed:
             product.price_old = product.price_current
 
+        stale_scopes = product.cache_scopes()
         product = set_dict_attr(product, data)
-        product.save()
+        with transaction.atomic():
+            product.save()
+            if price_changed:
+                PriceHistory.record([product])
+        bump_versions(*stale_scopes, *product.cache_scopes())
         serializer = self.serializer_class(product)
         return Response(data=serializer.data, status=200)
 
@@ -149,55 +302,88 @@ class SellerProductView(APIView):
         tags=tags,
     )
     def delete(self, request, *args, **kwargs):
-        user = request.user
         product = self.get_object(kwargs["slug"])
         if not product:
             return Response(data={"message": "Product does not exist!"}, status=404)
-        elif product.seller.user != user:
+        elif not self.owns(request, product):
             return Response(data={"message": "User does not permission for edite!"}, status=403)
 
         product.delete()
+        bump_versions(*product.cache_scopes())
         return Response(data={"message": "Product deleted successfully"}, status=200)
 
     
 class SellerOrdersView(APIView):
     permission_classes = [IsSeller]
-    serializer_class = OrderSerializer
+    serializer_class = SellerOrderSerializer
+    pagination_class = OrderCursorPagination
 
     @extend_schema(
         operation_id="seller_orders_view",
         summary="Seller Orders Fetch",
         description="""
-                This endpoint returns all orders for a particular seller.
+                This endpoint returns the orders of a particular seller, newest first, a page at a time.
+                Each order only lists the seller's own items and their subtotal.
             """,
-        tags=tags
+        tags=tags,
+        parameters=ORDER_PARAM_EXAMPLE,
     )
     def get(self, request):
-        seller = request.user.seller
-        orders = (
-            Order.objects.filter(orderitems__product__seller=seller).order_by("-create_at")
-        )
-        serializer = self.serializer_class(orders, many=True)
-        return Response(data=serializer.data, status=200)
+        seller = get_principal(request).approved_seller
+        if not seller:
+            return Response(data={"message": "Access is denied"}, status=403)
+        # One range of the (seller, create_at, id) index, each row joined to its order by key
+        seller_orders = SellerOrder.objects.filter(seller=seller).select_related("order").defer("order__summary")
+        paginator = self.pagination_class()
+        page = paginator.paginate_queryset(seller_orders, request, view=self)
+        serializer = self.serializer_class(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
 
 class SellerOrderItemsView(APIView):
     permission_classes = [IsSeller]
-    serializer_class = CheckItemOrderSerializer
+    serializer_class = OrderLineSerializer
 
     @extend_schema(
         operation_id="seller_order_items_view",
         summary="Seller Items Order Fetch",
         description="""
-                This endpoint returns all items order for a particular seller.
+                This endpoint returns the items a particular seller sold in an order, as they were at checkout.
             """,
         tags=tags,
-
+        responses=OrderLineSerializer(many=True),
     )
     def get(self, request, **kwargs):
-        seller = request.user.seller
-        order = Order.objects.get_or_none(tx_ref=kwargs["tx_ref"])
-        if not order:
+        seller = get_principal(request).approved_seller
+        if not seller:
+            return Response(data={"message": "Access is denied"}, status=403)
+        items = (SellerOrder.objects.filter(seller=seller, order__tx_ref=kwargs["tx_ref"])
+            .values_list("items", flat=True).first())
+        if items is None:
             return Response(data={"message": "Order does not exist!"}, status=404)
-        order_items = OrderItem.objects.filter(order=order, product__seller=seller)
-        serializer = self.serializer_class(order_items, many=True)
+        return Response(data=items, status=200)
+
+class SellerAnalyticsView(APIView):
+    permission_classes = [IsSeller]
+    serializer_class = SalesAnalyticsSerializer
+
+    @extend_schema(
+        operation_id="seller_analytics_view",
+        summary="Seller Sales Analytics",
+        description="""
+                This endpoint returns the paid sales of a particular seller between `from` and `to`
+                (the last 30 days by default): orders, units and revenue in total and per
+                day / week / month, and the best selling products by revenue. A sale counts on the
+                day its order was placed.
+            """,
+        tags=tags,
+        parameters=[SalesAnalyticsQuerySerializer],
+    )
+    def get(self, request):
+        seller = get_principal(request).approved_seller
+        if not seller:
+            return Response(data={"message": "Access is denied"}, status=403)
+        query = SalesAnalyticsQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        report = sales_report(seller, **query.validated_data)
+        serializer = self.serializer_class(report)
         return Response(data=serializer.data, status=200)
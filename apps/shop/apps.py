@@ -1,6 +1,48 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
+
+
+def setup_search_index(using, **kwargs):
+    from django.db import connections
+    from apps.shop.search import ensure_search_index
+
+    ensure_search_index(connections[using])
+
+
+def product_image_scopes(products):
+    from apps.shop.stock import stock_scopes
+
+    return stock_scopes(products.values("pk"))
+
+
+def category_image_scopes(categories):
+    from apps.shop.models import Category, Product
+    from apps.shop.stock import stock_scopes
+
+    # Every product of a category shows its image too
+    scopes = ["categories", *Category.path_scopes(categories.values_list("path", flat=True))]
+    return scopes + stock_scopes(Product.objects.filter(category__in=categories).values("pk"))
+
+
+def avatar_scopes(users):
+    from apps.shop.models import Product
+    from apps.shop.stock import stock_scopes
+
+    # A seller's avatar is shown with each of their products
+    return stock_scopes(Product.objects.filter(seller__user__in=users).values("pk"))
 
 
 class ShopConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.shop'
+
+    def ready(self):
+        from apps.accounts.models import User
+        from apps.common.images import register_image_variants, register_variant_scopes
+
+        post_migrate.connect(setup_search_index, sender=self)
+        register_image_variants(self.get_model("Product"), "image1", "image2", "image3")
+        register_image_variants(self.get_model("Category"), "image")
+        register_variant_scopes(self.get_model("Product"), product_image_scopes)
+        register_variant_scopes(self.get_model("Category"), category_image_scopes)
+        register_variant_scopes(User, avatar_scopes)
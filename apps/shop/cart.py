@@ -0,0 +1,316 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+from apps.accounts.models import User
+from apps.common.cache import get_versions
+from apps.profiles.models import OrderItem
+from apps.shop.models import Product
+from apps.shop.serializers import OrderItemSerializer
+
+CART_PREFIX = "cart"
+# Dirty carts: a marker per user, and a numbered slot per marking that flush walks in order
+DIRTY_MARKER_KEY = f"{CART_PREFIX}:dirty:user:{{}}"
+DIRTY_SLOT_KEY = f"{CART_PREFIX}:dirty:slot:{{}}"
+DIRTY_SEQUENCE_KEY = f"{CART_PREFIX}:dirty:sequence"
+FLUSHED_KEY = f"{CART_PREFIX}:dirty:flushed"
+STALLED_KEY = f"{CART_PREFIX}:dirty:stalled"
+
+
+class CartChanged(Exception):
+    """Raised at checkout when cart lines it read were ordered or replaced by a parallel request."""
+
+
+class CartStore:
+    """
+        Where the carts live. ``CartView`` and ``CheckoutView`` only talk to a
+        store, picked by the ``CART_STORE`` setting (see ``get_cart_store``).
+
+        Checkout still works on ``OrderItem`` rows with ``order=None``: it calls
+        ``persist`` first, so the rows match the cart, and ``clear`` once the
+        order has taken them.
+
+        Methods:
+            items(user):
+                The cart as ``OrderItemSerializer`` data, newest first.
+            set_quantity(user, product, quantity):
+                Adds, updates or (with 0) removes a product; returns
+                ``(item, created)``, ``item`` being None after a removal.
+            set_quantities(user, changes):
+                Applies ``(product, quantity)`` pairs at once (the last one of a
+                product wins); returns the whole cart like ``items``.
+            persist(user_id):
+                Writes the cart to ``OrderItem`` rows.
+            clear(user_id):
+                Forgets the cart after checkout.
+            flush():
+                Persists every cart changed since the last flush; returns their number.
+            is_available():
+                Whether the store can be used with the current settings.
+    """
+    @classmethod
+    def is_available(cls):
+        return True
+
+    def items(self, user):
+        raise NotImplementedError
+
+    def set_quantity(self, user, product, quantity):
+        raise NotImplementedError
+
+    def set_quantities(self, user, changes):
+        raise NotImplementedError
+
+    def persist(self, user_id):
+        pass
+
+    def clear(self, user_id):
+        pass
+
+    def flush(self):
+        return 0
+
+
+def render_item(product, quantity):
+    return OrderItemSerializer(OrderItem(product=product, quantity=quantity)).data
+
+
+def cart_products(product_ids):
+    """The products of cart lines with what ``OrderItemSerializer`` shows, in one query."""
+    return Product.objects.select_related("seller", "seller__user").in_bulk(product_ids)
+
+
+class DatabaseCartStore(CartStore):
+    """The cart as ``OrderItem`` rows with ``order=None``, written on every change."""
+
+    def items(self, user):
+        orderitems = OrderItem.objects.filter(user=user, order=None).select_related(
+            "product", "product__seller", "product__seller__user")
+        return OrderItemSerializer(orderitems, many=True).data
+
+    def set_quantity(self, user, product, quantity):
+        if not quantity:
+            deleted, _ = OrderItem.objects.filter(user=user, order=None, product=product).delete()
+            return None, not deleted
+        orderitem, created = OrderItem.objects.update_or_create(
+            user=user, order_id=None, product=product, defaults={"quantity": quantity},
+        )
+        return OrderItemSerializer(orderitem).data, created
+
+    def set_quantities(self, user, changes):
+        quantities = {product.id: quantity for product, quantity in changes}
+        rows = OrderItem.objects.filter(user=user, order=None, product__in=list(quantities))
+        existing = {row.product_id: row for row in rows}
+        removed = [row.pk for pk, row in existing.items() if not quantities[pk]]
+        updated = []
+        for pk, row in existing.items():
+            if quantities[pk] and quantities[pk] != row.quantity:
+                row.quantity = quantities[pk]
+                updated.append(row)
+        created = [
+            OrderItem(user=user, product_id=pk, quantity=quantity)
+            for pk, quantity in quantities.items() if quantity and pk not in existing
+        ]
+        with transaction.atomic():
+            if removed:
+                OrderItem.objects.filter(pk__in=removed).delete()
+            if updated:
+                OrderItem.objects.bulk_update(updated, ["quantity"])
+            if created:
+                OrderItem.objects.bulk_create(created)
+        return self.items(user)
+
+
+class CacheCartStore(CartStore):
+    """
+        Carts kept in the Django cache, one key per user, and written to
+        ``OrderItem`` only by ``persist`` (at checkout) and ``flush`` (the
+        ``flush_carts`` command, run periodically).
+
+        A cart holds every line already rendered, with the version of the
+        ``product:<slug>`` response cache scope it was rendered at, so reading
+        it costs no query; lines whose product changed since (price, stock,
+        name...) are rendered again from one query. A cart missing from the
+        cache is loaded from its ``OrderItem`` rows, so only the changes made
+        since the last flush can be lost with the cache. Changes to one cart
+        from parallel requests are last-write-wins.
+
+        The carts have their own cache alias (``CART_CACHE_ALIAS``), which must
+        be Redis: a cache that culls entries, like the database cache, would
+        drop carts and their dirty markers along with catalog responses, and
+        would cost database writes on every change anyway. Without it,
+        ``get_cart_store`` falls back to ``DatabaseCartStore``.
+
+        A changed cart is marked dirty with ``cache.add`` on a per-user key;
+        only the request that creates the marker takes a numbered slot for
+        ``flush``, so no shared set is read and written back. Whoever deletes
+        the marker writes the rows; checkout's ``persist`` writes them whenever
+        the cart is cached, as the marker may have been lost with the cart kept.
+    """
+    timeout = None
+    backends = ("django.core.cache.backends.redis.RedisCache",)
+
+    def __init__(self):
+        self.timeout = getattr(settings, "CART_CACHE_TIMEOUT", self.timeout)
+        self.cache = caches[self.cache_alias()]
+
+    @staticmethod
+    def cache_alias():
+        return getattr(settings, "CART_CACHE_ALIAS", "carts")
+
+    @classmethod
+    def is_available(cls):
+        return settings.CACHES.get(cls.cache_alias(), {}).get("BACKEND") in cls.backends
+
+    @staticmethod
+    def key(user_id):
+        if user_id is None:
+            # Anonymous requests would all share one cart
+            raise ValueError("Carts belong to authenticated users.")
+        return f"{CART_PREFIX}:{user_id}"
+
+    def load(self, user_id):
+        cart = self.cache.get(self.key(user_id))
+        if cart is not None:
+            return cart
+        rows = OrderItem.objects.filter(user_id=user_id, order=None).order_by("create_at")
+        cart = {"lines": {}}
+        dropped = self.render(cart, cart_products([row.product_id for row in rows]), {
+            row.product_id: row.quantity for row in rows
+        })
+        self.save(user_id, cart, dropped)
+        return cart
+
+    def save(self, user_id, cart, dirty=True):
+        self.cache.set(self.key(user_id), cart, self.timeout)
+        if dirty:
+            self.mark_dirty(user_id)
+
+    @staticmethod
+    def render(cart, products, quantities):
+        """
+            (Re)renders the lines of ``quantities`` (product id -> quantity) in place.
+            Returns whether lines of deleted products were dropped.
+        """
+        product_list = [products[pk] for pk in quantities if pk in products]
+        versions = get_versions([f"product:{product.slug}" for product in product_list])
+        for product, version in zip(product_list, versions):
+            cart["lines"][product.id] = {
+                "slug": product.slug,
+                "version": version,
+                "quantity": quantities[product.id],
+                "item": render_item(product, quantities[product.id]),
+            }
+        dropped = [pk for pk in quantities if pk not in products]
+        for pk in dropped:
+            # Deleted since it was added
+            cart["lines"].pop(pk, None)
+        return bool(dropped)
+
+    def items(self, user):
+        return self.current_items(user.pk, self.load(user.pk))
+
+    def current_items(self, user_id, cart):
+        lines = cart["lines"]
+        versions = get_versions([f"product:{line['slug']}" for line in lines.values()])
+        stale = {pk: line["quantity"] for (pk, line), version in zip(lines.items(), versions) if line["version"] != version}
+        if stale:
+            dropped = self.render(cart, cart_products(list(stale)), stale)
+            self.save(user_id, cart, dropped)
+        return [line["item"] for line in reversed(cart["lines"].values())]
+
+    def set_quantity(self, user, product, quantity):
+        cart = self.load(user.pk)
+        created = product.id not in cart["lines"]
+        if quantity:
+            self.render(cart, {product.id: product}, {product.id: quantity})
+        else:
+            cart["lines"].pop(product.id, None)
+        self.save(user.pk, cart)
+        return (cart["lines"][product.id]["item"] if quantity else None), created
+
+    def set_quantities(self, user, changes):
+        cart = self.load(user.pk)
+        products = {product.id: product for product, _ in changes}
+        quantities = {product.id: quantity for product, quantity in changes}
+        for pk, quantity in quantities.items():
+            if not quantity:
+                cart["lines"].pop(pk, None)
+        self.render(cart, products, {pk: quantity for pk, quantity in quantities.items() if quantity})
+        self.save(user.pk, cart)
+        return self.current_items(user.pk, cart)
+
+    def persist(self, user_id):
+        # A flush that has not reached the cart yet skips it once the marker is gone
+        self.cache.delete(DIRTY_MARKER_KEY.format(user_id))
+        self.write(user_id)
+
+    def write(self, user_id):
+        cart = self.cache.get(self.key(user_id))
+        if cart is None:
+            return
+        try:
+            with transaction.atomic():
+                # Serializes the writes of one cart, so the rows a parallel write
+                # (flush and checkout) just inserted are replaced, not doubled
+                list(User.objects.select_for_update().filter(pk=user_id).values_list("pk"))
+                OrderItem.objects.filter(user_id=user_id, order=None).delete()
+                OrderItem.objects.bulk_create([
+                    OrderItem(user_id=user_id, product_id=pk, quantity=line["quantity"])
+                    for pk, line in cart["lines"].items()
+                ])
+        except Exception:
+            self.mark_dirty(user_id)
+            raise
+
+    def clear(self, user_id):
+        self.cache.delete(self.key(user_id))
+
+    def mark_dirty(self, user_id):
+        cache = self.cache
+        if not cache.add(DIRTY_MARKER_KEY.format(user_id), True, None):
+            return
+        cache.add(DIRTY_SEQUENCE_KEY, 0, None)
+        # incr is atomic on Redis; add settles the clash where it is not
+        while not cache.add(DIRTY_SLOT_KEY.format(cache.incr(DIRTY_SEQUENCE_KEY)), user_id, None):
+            pass
+
+    def dirty_user_ids(self):
+        """Users whose cart has changes not written to the database yet."""
+        cache = self.cache
+        start, end = cache.get(FLUSHED_KEY, 0), cache.get(DIRTY_SEQUENCE_KEY, 0)
+        slots = cache.get_many([DIRTY_SLOT_KEY.format(number) for number in range(start + 1, end + 1)])
+        markers = cache.get_many([DIRTY_MARKER_KEY.format(user_id) for user_id in slots.values()])
+        return {user_id for user_id in slots.values() if DIRTY_MARKER_KEY.format(user_id) in markers}
+
+    def flush(self):
+        """
+            Walks the slots taken since the last flush, in order. A slot that is
+            still empty (its request is between ``incr`` and ``add``) ends the walk,
+            unless it was already empty at the previous flush: then its request is
+            gone and the slot is skipped.
+        """
+        cache = self.cache
+        start, end = cache.get(FLUSHED_KEY, 0), cache.get(DIRTY_SEQUENCE_KEY, 0)
+        keys = [DIRTY_SLOT_KEY.format(number) for number in range(start + 1, end + 1)]
+        slots = cache.get_many(keys)
+        stalled = cache.get(STALLED_KEY)
+        flushed, written = start, 0
+        for number, key in enumerate(keys, start + 1):
+            if key not in slots and number != stalled:
+                cache.set(STALLED_KEY, number, None)
+                break
+            if key in slots and cache.delete(DIRTY_MARKER_KEY.format(slots[key])):
+                self.write(slots[key])
+                written += 1
+            flushed = number
+        cache.set(FLUSHED_KEY, flushed, None)
+        cache.delete_many(keys[:flushed - start])
+        return written
+
+
+def get_cart_store():
+    """The ``CART_STORE``, or ``DatabaseCartStore`` when it cannot be used with the current settings."""
+    store_class = import_string(getattr(settings, "CART_STORE", "apps.shop.cart.CacheCartStore"))
+    return store_class() if store_class.is_available() else DatabaseCartStore()
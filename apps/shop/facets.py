@@ -0,0 +1,104 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Q
+
+from apps.common.cache import CACHE_PREFIX, get_versions
+
+FACETS = ("category", "price", "in_stock")
+
+# Upper bounds of the price buckets; the last bucket is open-ended
+PRICE_BUCKETS = (100, 500, 1000, 5000, 10000)
+
+
+def parse_facets(value):
+    """
+        Turns ``"category,price"`` into ``["category", "price"]``, dropping unknown names.
+    """
+    names = [name.strip() for name in (value or "").split(",")]
+    return [name for name in FACETS if name in names]
+
+
+def price_ranges():
+    lower = 0
+    for upper in PRICE_BUCKETS:
+        yield lower, upper
+        lower = upper
+    yield lower, None
+
+
+def compute_facets(queryset, names):
+    """
+        Counts the products of ``queryset`` per category, per price bucket and
+        by stock in one query.
+
+        The rows are grouped by category and every price bucket and the stock
+        split are conditional ``COUNT``s of that group, so the price and stock
+        facets are the column sums of the category rows.
+
+        Args:
+            queryset (QuerySet): Filtered products.
+            names (list): Facets to return, a subset of ``FACETS``.
+
+        Returns:
+            dict: ``{"category": [...], "price": [...], "in_stock": {...}}`` for the requested names.
+    """
+    ranges = list(price_ranges())
+    aggregates = {"count": Count("id"), "in_stock": Count("id", filter=Q(in_stock__gt=0))}
+    for i, (lower, upper) in enumerate(ranges):
+        bucket = Q(price_current__gte=lower)
+        if upper is not None:
+            bucket &= Q(price_current__lt=upper)
+        aggregates[f"price_{i}"] = Count("id", filter=bucket)
+    rows = list(
+        queryset.order_by()
+        .values("category__slug", "category__name")
+        .annotate(**aggregates)
+        .order_by("-count", "category__name")
+    )
+
+    facets = {}
+    if "category" in names:
+        facets["category"] = [
+            {"slug": row["category__slug"], "name": row["category__name"], "count": row["count"]} for row in rows
+        ]
+    if "price" in names:
+        facets["price"] = [
+            {
+                "min": lower,
+                "max": upper,
+                "count": sum(row[f"price_{i}"] for row in rows),
+            }
+            for i, (lower, upper) in enumerate(ranges)
+        ]
+    if "in_stock" in names:
+        in_stock = sum(row["in_stock"] for row in rows)
+        facets["in_stock"] = {
+            "in_stock": in_stock,
+            "out_of_stock": sum(row["count"] for row in rows) - in_stock,
+        }
+    return facets
+
+
+def cached_facets(filterset, names, scopes):
+    """
+        ``compute_facets`` for the filtered queryset of ``filterset``, cached per
+        filter signature.
+
+        The key holds only the filter values (not the page, cursor or ordering), so
+        every page of the same listing shares one entry, and the version counters
+        of ``scopes`` so product writes make stale entries unreachable.
+    """
+    signature = sorted(
+        (name, filterset.form.cleaned_data[name])
+        for name in filterset.filters
+        if filterset.form.cleaned_data.get(name) not in (None, "")
+    )
+    raw = "|".join([repr(signature), ",".join(names)] + scopes + [str(v) for v in get_versions(scopes)])
+    key = f"{CACHE_PREFIX}:facets:{hashlib.md5(raw.encode()).hexdigest()}"
+    facets = cache.get(key)
+    if facets is None:
+        facets = compute_facets(filterset.qs, names)
+        cache.set(key, facets, getattr(settings, "CATALOG_CACHE_TIMEOUT", 300))
+    return facets
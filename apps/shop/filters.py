@@ -8,8 +8,9 @@ class ProductFilter(django_filters.FilterSet):
     min_price = django_filters.NumberFilter(field_name='price_current', lookup_expr='gte')
     in_stock = django_filters.NumberFilter(lookup_expr='gte')
     create_at = django_filters.DateFilter(lookup_expr='gte')
+    min_rating = django_filters.NumberFilter(field_name='rating_avg', lookup_expr='gte')
 
     class Meta:
         model = Product
-        fields = ['max_price', 'min_price', 'in_stock', 'create_at']
+        fields = ['max_price', 'min_price', 'in_stock', 'create_at', 'min_rating']
 
@@ -0,0 +1,64 @@
+from datetime import timedelta
+
+from django.db.models import Count, Max, Min
+from django.db.models.functions import Trunc
+from django.utils import timezone
+
+from apps.shop.models import PriceHistory
+
+# Bucket sizes a series can be downsampled to, finest first
+INTERVALS = (
+    ("hour", timedelta(hours=1)),
+    ("day", timedelta(days=1)),
+    ("week", timedelta(weeks=1)),
+    ("month", timedelta(days=30)),
+)
+
+
+def pick_interval(days, points):
+    """The finest interval that splits ``days`` into at most ``points`` buckets."""
+    span = timedelta(days=days)
+    for name, size in INTERVALS:
+        if span / size <= points:
+            return name
+    return INTERVALS[-1][0]
+
+
+def price_series(product, days=90, points=120, interval=None):
+    """
+        A product's price history over the last ``days``, downsampled for charts.
+
+        Only the window is read, as a range of the ``(product, changed_at)``
+        index, and the rows are grouped into ``interval`` buckets by the
+        database, so the response size depends on ``points`` rather than on
+        how often the price changed. Each bucket gives the lowest and highest
+        price in effect and the number of changes; ``start_price`` is the price
+        the window opens with, read with one more index seek.
+
+        Args:
+            product (Product): The product.
+            days (int): Length of the window, ending now.
+            points (int): Upper bound of buckets when ``interval`` is not given.
+            interval (str | None): One of ``INTERVALS``, picked from ``points`` by default.
+
+        Returns:
+            dict: ``interval``, ``since``, ``start_price``, ``current_price`` and ``points``.
+    """
+    interval = interval or pick_interval(days, points)
+    since = timezone.now() - timedelta(days=days)
+    history = PriceHistory.objects.filter(product=product)
+    start = history.filter(changed_at__lt=since).order_by("-changed_at").values_list("price", flat=True).first()
+    buckets = (
+        history.filter(changed_at__gte=since)
+        .annotate(bucket=Trunc("changed_at", interval))
+        .values("bucket")
+        .annotate(low=Min("price"), high=Max("price"), changes=Count("id"))
+        .order_by("bucket")
+    )
+    return {
+        "interval": interval,
+        "since": since,
+        "start_price": start,
+        "current_price": product.price_current,
+        "points": list(buckets),
+    }
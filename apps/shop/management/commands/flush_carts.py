@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from apps.shop.cart import get_cart_store
+
+
+class Command(BaseCommand):
+    help = "Write the carts changed since the last flush from the cart store to the database."
+
+    def handle(self, *args, **options):
+        flushed = get_cart_store().flush()
+        self.stdout.write(self.style.SUCCESS(f"{flushed} carts flushed."))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from apps.shop.models import Product
+
+
+class Command(BaseCommand):
+    help = "Recompute the denormalized rating aggregates of every product from its reviews."
+
+    def handle(self, *args, **options):
+        updated = Product.rebuild_ratings()
+        self.stdout.write(self.style.SUCCESS(f"Rating aggregates rebuilt for {updated} products."))
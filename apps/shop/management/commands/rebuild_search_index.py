@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from apps.shop.search import rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text product search index from the product table."
+
+    def handle(self, *args, **options):
+        if connection.vendor != "sqlite":
+            self.stdout.write("Full-text index is only used on SQLite, nothing to do.")
+            return
+        with transaction.atomic():
+            rebuild_search_index()
+        self.stdout.write(self.style.SUCCESS("Product search index rebuilt."))
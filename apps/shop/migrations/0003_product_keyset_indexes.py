@@ -0,0 +1,22 @@
+# Generated by Django 5.2.1 on 2026-10-18 18:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sellers', '0001_initial'),
+        ('shop', '0002_alter_product_options_review'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['create_at', 'id'], name='product_create_at_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['price_current', 'id'], name='product_price_id_idx'),
+        ),
+    ]
@@ -0,0 +1,66 @@
+from django.db import migrations
+
+# The SQL is frozen here as it was when this migration was written; the
+# current definitions live in apps.shop.search (see 0012_search_index_product_key).
+CREATE_SQL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS shop_product_fts USING fts5(
+        product_id UNINDEXED, name, description, tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS shop_product_fts_ai AFTER INSERT ON shop_product WHEN new.is_deleted = 0 BEGIN
+        INSERT INTO shop_product_fts(rowid, product_id, name, description)
+        VALUES (new.rowid, new.id, new.name, new."desc");
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS shop_product_fts_au AFTER UPDATE OF name, "desc", is_deleted ON shop_product BEGIN
+        DELETE FROM shop_product_fts WHERE rowid = old.rowid;
+        INSERT INTO shop_product_fts(rowid, product_id, name, description)
+        SELECT new.rowid, new.id, new.name, new."desc" WHERE new.is_deleted = 0;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS shop_product_fts_ad AFTER DELETE ON shop_product BEGIN
+        DELETE FROM shop_product_fts WHERE rowid = old.rowid;
+    END
+    """,
+    "DELETE FROM shop_product_fts",
+    """
+    INSERT INTO shop_product_fts(rowid, product_id, name, description)
+    SELECT rowid, id, name, "desc" FROM shop_product WHERE is_deleted = 0
+    """,
+]
+
+DROP_SQL = [
+    "DROP TRIGGER IF EXISTS shop_product_fts_ai",
+    "DROP TRIGGER IF EXISTS shop_product_fts_au",
+    "DROP TRIGGER IF EXISTS shop_product_fts_ad",
+    "DROP TABLE IF EXISTS shop_product_fts",
+]
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    for sql in CREATE_SQL:
+        schema_editor.execute(sql)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    for sql in DROP_SQL:
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0003_product_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
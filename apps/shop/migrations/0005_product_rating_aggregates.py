@@ -0,0 +1,77 @@
+# Generated by Django 5.2.1 on 2026-10-18 18:42
+
+from django.db import migrations, models
+from django.db.models import Case, Count, F, FloatField, OuterRef, Subquery, Value, When
+from django.db.models.functions import Cast, Coalesce
+
+
+def fill_rating_aggregates(apps, schema_editor):
+    Product = apps.get_model('shop', 'Product')
+    Review = apps.get_model('shop', 'Review')
+    stars = (1, 2, 3, 4, 5)
+    reviews = Review.objects.filter(product=OuterRef('pk'), is_deleted=False).order_by().values('product')
+
+    def count_reviews(**filters):
+        return Coalesce(Subquery(reviews.filter(**filters).annotate(total=Count('pk')).values('total')), 0)
+
+    Product.objects.update(
+        rating_count=count_reviews(rating__in=stars),
+        **{f'rating_{star}': count_reviews(rating=star) for star in stars},
+    )
+    stars_sum = sum(F(f'rating_{star}') * star for star in stars)
+    Product.objects.update(rating_avg=Case(
+        When(rating_count=0, then=Value(0.0)),
+        default=Cast(stars_sum, FloatField()) / F('rating_count'),
+        output_field=FloatField(),
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sellers', '0001_initial'),
+        ('shop', '0004_product_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='rating_1',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_2',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_3',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_4',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_5',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_avg',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['rating_avg', 'id'], name='product_rating_id_idx'),
+        ),
+        migrations.RunPython(fill_rating_aggregates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.1 on 2026-10-18 19:01
+
+import apps.common.slugs
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0006_query_plan_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='product',
+            name='slug',
+            field=apps.common.slugs.ReservedAutoSlugField(editable=False, populate_from='name', unique=True),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.1 on 2026-10-18 19:03
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def seed_price_history(apps, schema_editor):
+    # Every product starts its series with the price it has now
+    Product = apps.get_model('shop', 'Product')
+    PriceHistory = apps.get_model('shop', 'PriceHistory')
+    rows = Product.objects.values_list('id', 'price_current', 'update_at').iterator(chunk_size=2000)
+    batch = []
+    for product_id, price, changed_at in rows:
+        batch.append(PriceHistory(product_id=product_id, price=price, changed_at=changed_at))
+        if len(batch) >= 2000:
+            PriceHistory.objects.bulk_create(batch)
+            batch = []
+    PriceHistory.objects.bulk_create(batch)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0007_product_reserved_slug'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PriceHistory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('changed_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('product', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='price_history', to='shop.product')),
+            ],
+            options={
+                'verbose_name_plural': 'Price history',
+                'indexes': [models.Index(fields=['product', 'changed_at'], name='pricehistory_product_idx')],
+            },
+        ),
+        migrations.RunPython(seed_price_history, migrations.RunPython.noop),
+    ]
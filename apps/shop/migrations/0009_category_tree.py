@@ -0,0 +1,45 @@
+# Generated by Django 5.2.1 on 2026-10-18 19:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def fill_paths(apps, schema_editor):
+    # Every existing category becomes a root
+    Category = apps.get_model('shop', 'Category')
+    categories = list(Category.objects.only('id'))
+    for category in categories:
+        category.path = category.id.hex + '/'
+    Category.objects.bulk_update(categories, ['path'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0008_price_history'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='parent',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='children', to='shop.category'),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='path',
+            field=models.CharField(default='', editable=False, max_length=330),
+            preserve_default=False,
+        ),
+        migrations.RunPython(fill_paths, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='category',
+            name='path',
+            field=models.CharField(editable=False, max_length=330, unique=True),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.1 on 2026-10-18 19:10
+
+import apps.common.slugs
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0009_category_tree'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='category',
+            name='slug',
+            field=apps.common.slugs.ReservedAutoSlugField(always_update=True, editable=False, populate_from='name', unique=True),
+        ),
+    ]
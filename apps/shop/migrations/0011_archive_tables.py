@@ -0,0 +1,54 @@
+# Generated by Django 5.2.1 on 2026-10-18 19:46
+
+import apps.common.models
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sellers', '0002_unique_slug'),
+        ('shop', '0010_category_reserved_slug'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductArchive',
+            fields=[
+                ('id', models.UUIDField(editable=False, primary_key=True, serialize=False)),
+                ('deleted_at', models.DateTimeField(null=True)),
+                ('archived_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('data', models.JSONField(encoder=apps.common.models.ArchiveEncoder)),
+            ],
+            options={
+                'db_table': 'shop_product_archive',
+                'ordering': ['-archived_at'],
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='ReviewArchive',
+            fields=[
+                ('id', models.UUIDField(editable=False, primary_key=True, serialize=False)),
+                ('deleted_at', models.DateTimeField(null=True)),
+                ('archived_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('data', models.JSONField(encoder=apps.common.models.ArchiveEncoder)),
+            ],
+            options={
+                'db_table': 'shop_review_archive',
+                'ordering': ['-archived_at'],
+                'abstract': False,
+            },
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_deleted', True)), fields=['deleted_at'], name='product_deleted_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(condition=models.Q(('is_deleted', True)), fields=['deleted_at'], name='review_deleted_at_idx'),
+        ),
+    ]
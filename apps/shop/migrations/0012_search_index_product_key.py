@@ -0,0 +1,96 @@
+from django.db import migrations
+
+# Re-keys the search index on the product id instead of shop_product.rowid,
+# which VACUUM may renumber. The SQL is frozen here; the current definitions
+# live in apps.shop.search.
+DROP_SQL = [
+    "DROP TRIGGER IF EXISTS shop_product_fts_ai",
+    "DROP TRIGGER IF EXISTS shop_product_fts_au",
+    "DROP TRIGGER IF EXISTS shop_product_fts_ad",
+    "DROP TABLE IF EXISTS shop_product_fts",
+]
+
+CREATE_SQL = [
+    """
+    CREATE VIRTUAL TABLE shop_product_fts USING fts5(
+        product_id, name, description, tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER shop_product_fts_ai AFTER INSERT ON shop_product WHEN new.is_deleted = 0 BEGIN
+        INSERT INTO shop_product_fts(product_id, name, description) VALUES (new.id, new.name, new."desc");
+    END
+    """,
+    """
+    CREATE TRIGGER shop_product_fts_au AFTER UPDATE OF name, "desc", is_deleted ON shop_product BEGIN
+        DELETE FROM shop_product_fts WHERE shop_product_fts MATCH 'product_id:"' || old.id || '"';
+        INSERT INTO shop_product_fts(product_id, name, description)
+        SELECT new.id, new.name, new."desc" WHERE new.is_deleted = 0;
+    END
+    """,
+    """
+    CREATE TRIGGER shop_product_fts_ad AFTER DELETE ON shop_product BEGIN
+        DELETE FROM shop_product_fts WHERE shop_product_fts MATCH 'product_id:"' || old.id || '"';
+    END
+    """,
+    """
+    INSERT INTO shop_product_fts(product_id, name, description)
+    SELECT id, name, "desc" FROM shop_product WHERE is_deleted = 0
+    """,
+]
+
+# The rowid-keyed index of 0004_product_search_index
+ROWID_CREATE_SQL = [
+    """
+    CREATE VIRTUAL TABLE shop_product_fts USING fts5(
+        product_id UNINDEXED, name, description, tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER shop_product_fts_ai AFTER INSERT ON shop_product WHEN new.is_deleted = 0 BEGIN
+        INSERT INTO shop_product_fts(rowid, product_id, name, description)
+        VALUES (new.rowid, new.id, new.name, new."desc");
+    END
+    """,
+    """
+    CREATE TRIGGER shop_product_fts_au AFTER UPDATE OF name, "desc", is_deleted ON shop_product BEGIN
+        DELETE FROM shop_product_fts WHERE rowid = old.rowid;
+        INSERT INTO shop_product_fts(rowid, product_id, name, description)
+        SELECT new.rowid, new.id, new.name, new."desc" WHERE new.is_deleted = 0;
+    END
+    """,
+    """
+    CREATE TRIGGER shop_product_fts_ad AFTER DELETE ON shop_product BEGIN
+        DELETE FROM shop_product_fts WHERE rowid = old.rowid;
+    END
+    """,
+    """
+    INSERT INTO shop_product_fts(rowid, product_id, name, description)
+    SELECT rowid, id, name, "desc" FROM shop_product WHERE is_deleted = 0
+    """,
+]
+
+
+def key_on_product_id(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    for sql in DROP_SQL + CREATE_SQL:
+        schema_editor.execute(sql)
+
+
+def key_on_rowid(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    for sql in DROP_SQL + ROWID_CREATE_SQL:
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0011_archive_tables'),
+    ]
+
+    operations = [
+        migrations.RunPython(key_on_product_id, key_on_rowid),
+    ]
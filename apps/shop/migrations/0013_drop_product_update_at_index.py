@@ -0,0 +1,17 @@
+# Generated by Django 5.2.1 on 2026-10-18 20:08
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0012_search_index_product_key'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='product',
+            name='product_update_at_idx',
+        ),
+    ]
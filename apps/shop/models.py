@@ -1,8 +1,14 @@
-from django.db import models
-from autoslug import AutoSlugField
+from collections import Counter
+
+from django.db import models, transaction
+from django.db.models import Case, Count, F, FloatField, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Cast, Coalesce, Concat, Substr
+from django.utils import timezone
 
 # from apps.common.managers import IsDeletedQuerySet
-from apps.common.models import BaseModel, IsDeletedModel
+from apps.common.managers import IsDeletedManager, IsDeletedQuerySet
+from apps.common.models import ArchivedRow, BaseModel, IsDeletedModel
+from apps.common.slugs import ReservedAutoSlugField, ReservedSlugMixin
 from apps.sellers.models import Seller
 from apps.accounts.models import User
 
@@ -17,23 +23,53 @@ RATING_CHOICES = (
     (5, 5)
 )
 
-class Category(BaseModel):
+STARS = tuple(value for value, _ in RATING_CHOICES)
+
+# Condition of the partial indexes over soft-deleted models
+LIVE = Q(is_deleted=False)
+# ... and of the ``deleted_at`` indexes the archive_deleted command scans
+DEAD = Q(is_deleted=True)
+
+# Category paths: one 32 character hex id plus separator per level
+PATH_SEP = "/"
+CATEGORY_MAX_DEPTH = 10
+PATH_MAX_LENGTH = 33 * CATEGORY_MAX_DEPTH
+
+class Category(ReservedSlugMixin, BaseModel):
     """
-        Represents a product category.
+        Represents a product category, possibly nested under a parent category.
+
+        The tree is stored as a materialized path: ``path`` holds the hex ids of
+        the ancestors and of the category itself, each followed by ``/``. The
+        categories of a subtree therefore share a prefix and are one range of
+        the unique ``path`` index (see ``subtree_range``), however deep the
+        tree is.
 
         Attributes:
             name (str): The category name, unique for each instance.
             slug (str): The slug generated from the name, used in URLs.
             image (ImageField): An image representing the category.
+            parent (ForeignKey): The enclosing category, None for a root.
+            path (str): Materialized path, kept up to date by ``save``.
+            depth (int): Number of ancestors, 0 for a root.
 
         Methods:
             __str__():
                 Returns the string representation of the category name.
+            subtree():
+                Returns the category and all its descendants.
+            cache_scopes():
+                Returns the response cache scopes of the category and its ancestors.
+            path_scopes(paths):
+                Returns the cache scopes of every category on ``paths``, in one query.
     """
 
     name = models.CharField(max_length=100, unique=True)
-    slug = AutoSlugField(populate_from="name", unique=True, always_update=True)
+    slug = ReservedAutoSlugField(populate_from="name", unique=True, always_update=True)
     image = models.ImageField(upload_to='category_images/')
+    parent = models.ForeignKey("self", on_delete=models.CASCADE, related_name="children", null=True, blank=True)
+    path = models.CharField(max_length=PATH_MAX_LENGTH, unique=True, editable=False)
+    depth = models.PositiveSmallIntegerField(default=0, editable=False)
 
     def __str__(self):
         return self.name
@@ -41,8 +77,45 @@ class Category(BaseModel):
     class Meta:
         verbose_name_plural = "Categories"
 
+    def save(self, *args, **kwargs):
+        old_path = self.path
+        if old_path and self.parent_id and self.parent.path.startswith(old_path):
+            raise ValueError("A category cannot be moved under itself or its descendants.")
+        self.path = (self.parent.path if self.parent_id else "") + self.id.hex + PATH_SEP
+        self.depth = self.parent.depth + 1 if self.parent_id else 0
+        if len(self.path) > PATH_MAX_LENGTH:
+            raise ValueError(f"Categories can be nested at most {CATEGORY_MAX_DEPTH} levels deep.")
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if old_path and old_path != self.path:
+                # Moved: re-root the descendants' paths with one UPDATE
+                Category.objects.filter(**subtree_range(old_path)).exclude(pk=self.pk).update(
+                    path=Concat(Value(self.path), Substr("path", len(old_path) + 1)),
+                    depth=F("depth") + self.depth - old_path.count(PATH_SEP) + 1,
+                )
+
+    def subtree(self):
+        return Category.objects.filter(**subtree_range(self.path))
+
+    def cache_scopes(self):
+        return Category.path_scopes([self.path])
+
+    @classmethod
+    def path_scopes(cls, paths):
+        ids = {part for path in paths for part in path.split(PATH_SEP) if part}
+        return [f"category:{slug}" for slug in cls.objects.filter(id__in=ids).values_list("slug", flat=True)]
 
-class Product(IsDeletedModel):
+
+def subtree_range(path, field="path"):
+    """
+        Lookups selecting the categories under ``path`` (itself included) as a
+        range of the path index: every path in the subtree starts with ``path``,
+        and ``0`` is the character right after the ``/`` separator.
+    """
+    return {f"{field}__gte": path, f"{field}__lt": path[:-1] + chr(ord(PATH_SEP) + 1)}
+
+
+class Product(ReservedSlugMixin, IsDeletedModel):
     """
         Represents a product listed for sale.
 
@@ -58,10 +131,21 @@ class Product(IsDeletedModel):
             image1 (ImageField): The first image of the product.
             image2 (ImageField): The second image of the product.
             image3 (ImageField): The third image of the product.
+            rating_avg (float): Average rating of the live reviews, 0 if there are none.
+            rating_count (int): Number of live reviews with a 1-5 star rating.
+            rating_1 .. rating_5 (int): Star histogram, reviews per rating value.
+
+        Methods:
+            cache_scopes():
+                Returns the response cache scopes that include this product.
+            update_rating(product_id, removed=None, added=None):
+                Applies one review change to the rating aggregates.
+            rebuild_ratings(queryset=None):
+                Recomputes the rating aggregates from the reviews in bulk.
         """
     seller = models.ForeignKey(Seller, on_delete=models.SET_NULL, related_name="products", null=True)
     name = models.CharField(max_length=100)
-    slug = AutoSlugField(populate_from="name", unique=True, db_index=True)
+    slug = ReservedAutoSlugField(populate_from="name", unique=True, db_index=True)
     desc = models.TextField()
     price_old = models.DecimalField(max_digits=10, decimal_places=2, null=True)
     price_current = models.DecimalField(max_digits=10, decimal_places=2)
@@ -73,13 +157,223 @@ class Product(IsDeletedModel):
     image2 = models.ImageField(upload_to='product_images/', blank=True)
     image3 = models.ImageField(upload_to='product_images/', blank=True)
 
+    # Denormalized review aggregates, kept up to date by Review.save()/hard_delete()
+    rating_avg = models.FloatField(default=0)
+    rating_count = models.PositiveIntegerField(default=0)
+    rating_1 = models.PositiveIntegerField(default=0)
+    rating_2 = models.PositiveIntegerField(default=0)
+    rating_3 = models.PositiveIntegerField(default=0)
+    rating_4 = models.PositiveIntegerField(default=0)
+    rating_5 = models.PositiveIntegerField(default=0)
+
     def __str__(self):
         return str(self.name)
 
+    def cache_scopes(self):
+        """Response cache scopes (see apps.common.cache) whose payload includes this product."""
+        scopes = ["products", f"product:{self.slug}", *self.category.cache_scopes()]
+        if self.seller_id:
+            scopes.append(f"seller:{self.seller.slug}")
+        return scopes
+
+    @property
+    def rating_histogram(self):
+        return {star: getattr(self, f"rating_{star}") for star in STARS}
+
+    @classmethod
+    def update_rating(cls, product_id, removed=None, added=None):
+        """
+            Apply one review change to the aggregates with a single UPDATE.
+
+            Args:
+                product_id: The reviewed product.
+                removed (int | None): Star value no longer counted (edited or deleted review).
+                added (int | None): Star value now counted (new or edited review).
+        """
+        deltas = Counter()
+        if removed is not None:
+            deltas[removed] -= 1
+        if added is not None:
+            deltas[added] += 1
+        count_delta = sum(deltas.values())
+        sum_delta = sum(star * delta for star, delta in deltas.items())
+        stars_sum = sum(F(f"rating_{star}") * star for star in STARS)
+        changes = {f"rating_{star}": F(f"rating_{star}") + delta for star, delta in deltas.items() if delta}
+        # Right-hand sides see the row before the update, so the average is
+        # computed from the old counts plus this change.
+        changes["rating_avg"] = Case(
+            When(rating_count=-count_delta, then=Value(0.0)),
+            default=Cast(stars_sum + sum_delta, FloatField()) / (F("rating_count") + count_delta),
+            output_field=FloatField(),
+        )
+        changes["rating_count"] = F("rating_count") + count_delta
+        changes["update_at"] = timezone.now()
+        cls.objects.unfiltered().filter(pk=product_id).update(**changes)
+
+    @classmethod
+    def rebuild_ratings(cls, queryset=None):
+        """
+            Recompute the aggregates of ``queryset`` (all products by default) from
+            the live reviews with two UPDATE statements.
+
+            Returns:
+                int: The number of products updated.
+        """
+        if queryset is None:
+            queryset = cls.objects.unfiltered()
+        reviews = Review.objects.filter(product=OuterRef("pk")).order_by().values("product")
+
+        def count_reviews(**filters):
+            counted = reviews.filter(**filters).annotate(total=Count("pk")).values("total")
+            return Coalesce(Subquery(counted), 0)
+
+        with transaction.atomic():
+            updated = queryset.update(
+                rating_count=count_reviews(rating__in=STARS),
+                update_at=timezone.now(),
+                **{f"rating_{star}": count_reviews(rating=star) for star in STARS},
+            )
+            stars_sum = sum(F(f"rating_{star}") * star for star in STARS)
+            queryset.update(rating_avg=Case(
+                When(rating_count=0, then=Value(0.0)),
+                default=Cast(stars_sum, FloatField()) / F("rating_count"),
+                output_field=FloatField(),
+            ))
+        return updated
+
+    class Meta(IsDeletedModel.Meta):
+        indexes = [
+            # IsDeletedManager adds ``is_deleted = False`` to every query. SQLite
+            # renders it as ``NOT is_deleted``, which cannot seek a composite key,
+            # so the hot indexes are partial and only hold live rows.
+            # Keyset pagination / sorting keys, see ProductCursorPagination
+            models.Index(fields=["create_at", "id"], condition=LIVE, name="product_create_at_id_idx"),
+            models.Index(fields=["price_current", "id"], condition=LIVE, name="product_price_id_idx"),
+            models.Index(fields=["rating_avg", "id"], condition=LIVE, name="product_rating_id_idx"),
+            # Category / seller listings
+            models.Index(fields=["category", "create_at"], condition=LIVE, name="product_category_idx"),
+            models.Index(fields=["seller", "create_at"], condition=LIVE, name="product_seller_idx"),
+            models.Index(fields=["deleted_at"], condition=DEAD, name="product_deleted_at_idx"),
+        ]
+
+
+class PriceHistory(models.Model):
+    """
+        Append-only log of product prices, one row per price a product was given.
+
+        Rows are only ever inserted (see ``record``), never updated, so the table
+        stays narrow and the ``(product, changed_at)`` index serves a product's
+        series as one range read.
+
+        Attributes:
+            product (ForeignKey): The product whose price changed.
+            price (Decimal): The price from ``changed_at`` on.
+            changed_at (datetime): When the price took effect.
+
+        Methods:
+            record(products, changed_at=None):
+                Appends the current price of each product in one INSERT.
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="price_history", db_index=False)
+    price = models.DecimalField(max_digits=10, decimal_places=2)
+    changed_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        verbose_name_plural = "Price history"
+        indexes = [
+            models.Index(fields=["product", "changed_at"], name="pricehistory_product_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} {self.price} @ {self.changed_at:%Y-%m-%d %H:%M}"
+
+    @classmethod
+    def record(cls, products, changed_at=None):
+        changed_at = changed_at or timezone.now()
+        return cls.objects.bulk_create(
+            [cls(product_id=product.id, price=product.price_current, changed_at=changed_at) for product in products]
+        )
+
+
+class ReviewQuerySet(IsDeletedQuerySet):
+    def delete(self, hard_delete=False):
+        """Deletes in bulk and recomputes the rating aggregates of the products concerned."""
+        with transaction.atomic():
+            product_ids = list(self.order_by().values_list("product_id", flat=True).distinct())
+            result = super().delete(hard_delete)
+            Product.rebuild_ratings(Product.objects.unfiltered().filter(pk__in=product_ids))
+        return result
+
+
+class ReviewManager(IsDeletedManager):
+    queryset_class = ReviewQuerySet
+
 
 class Review(IsDeletedModel):
+    """
+        A user's review of a product.
+
+        Saving, soft-deleting or hard-deleting a review updates the rating
+        aggregates on its product in the same transaction; so does deleting a
+        queryset of reviews, with one ``rebuild_ratings`` for all their products.
+    """
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="review_products")
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="review_products")
     rating = models.PositiveIntegerField(default=0, choices=RATING_CHOICES)
     text = models.TextField()
 
+    objects = ReviewManager()
+
+    class Meta(IsDeletedModel.Meta):
+        indexes = [
+            models.Index(fields=["product", "user"], condition=LIVE, name="review_product_user_idx"),
+            models.Index(fields=["deleted_at"], condition=DEAD, name="review_deleted_at_idx"),
+        ]
+
+    # Star value this review contributed to the product when it was loaded/last saved
+    _counted_rating = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._counted_rating = instance.counted_rating
+        return instance
+
+    @property
+    def counted_rating(self):
+        """The star value this review adds to its product's aggregates, or None."""
+        if self.is_deleted or self.rating not in STARS:
+            return None
+        return self.rating
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            current = self.counted_rating
+            if current != self._counted_rating:
+                Product.update_rating(self.product_id, removed=self._counted_rating, added=current)
+            self._counted_rating = current
+
+    def hard_delete(self, *args, **kwargs):
+        with transaction.atomic():
+            super().hard_delete(*args, **kwargs)
+            if self._counted_rating is not None:
+                Product.update_rating(self.product_id, removed=self._counted_rating)
+            self._counted_rating = None
+
+
+class ProductArchive(ArchivedRow):
+    """Soft-deleted products moved out of ``shop_product``, with their price history and reviews."""
+    source_model = Product
+    owned = ("price_history", "review_products")
+
+    class Meta(ArchivedRow.Meta):
+        db_table = "shop_product_archive"
+
+
+class ReviewArchive(ArchivedRow):
+    """Soft-deleted reviews moved out of ``shop_review``."""
+    source_model = Review
+
+    class Meta(ArchivedRow.Meta):
+        db_table = "shop_review_archive"
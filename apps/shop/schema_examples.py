@@ -27,6 +27,12 @@ PRODUCT_PARAM_EXAMPLE = [
         required=False,
         type=OpenApiTypes.DATE,
     ),
+    OpenApiParameter(
+        name="min_rating",
+        description="Filter products by MIN average rating",
+        required=False,
+        type=OpenApiTypes.NUMBER,
+    ),
     OpenApiParameter(
             name="page",
             description="Retrieve a particular page. Defaults to 1",
@@ -39,4 +45,49 @@ PRODUCT_PARAM_EXAMPLE = [
             required=False,
             type=OpenApiTypes.INT,
         ),
-]
\ No newline at end of file
+    OpenApiParameter(
+            name="ordering",
+            description="Sort products: newest (default), price, -price or rating (best rated first)",
+            required=False,
+            type=OpenApiTypes.STR,
+            enum=["newest", "price", "-price", "rating"],
+        ),
+    OpenApiParameter(
+            name="pagination",
+            description="Set to 'cursor' for keyset pagination (no page numbers, constant cost per page)",
+            required=False,
+            type=OpenApiTypes.STR,
+            enum=["cursor"],
+        ),
+    OpenApiParameter(
+            name="cursor",
+            description="Opaque cursor taken from the next/previous link of a cursor-paginated response",
+            required=False,
+            type=OpenApiTypes.STR,
+        ),
+    OpenApiParameter(
+            name="stream",
+            description="Set to 'ndjson' to stream every matching product as newline-delimited JSON instead of a page",
+            required=False,
+            type=OpenApiTypes.STR,
+            enum=["ndjson"],
+        ),
+]
+
+PRODUCT_SEARCH_PARAM_EXAMPLE = [
+    OpenApiParameter(
+        name="q",
+        description="Words to look for in the product name and description",
+        required=True,
+        type=OpenApiTypes.STR,
+    ),
+] + [param for param in PRODUCT_PARAM_EXAMPLE if param.name in ("max_price", "min_price", "in_stock", "create_at", "min_rating", "page", "page_size")]
+
+PRODUCT_FACETS_PARAM_EXAMPLE = [
+    OpenApiParameter(
+        name="facets",
+        description="Comma separated facets to count for the current filters: category, price, in_stock",
+        required=False,
+        type=OpenApiTypes.STR,
+    ),
+]
@@ -0,0 +1,131 @@
+import re
+
+from django.db import connection, transaction
+from django.db.models import Q, Value, FloatField, CharField
+
+# SQLite FTS5 index over Product.name / Product.desc, maintained by triggers on
+# shop_product. Entries are keyed by the product's id, which the triggers find
+# through the index itself (a ``product_id:"<id>"`` MATCH), never by the
+# implicit rowid of shop_product, which VACUUM and table rebuilds renumber.
+# Migrations that rebuild shop_product drop its triggers, so
+# ensure_search_index() runs after every migrate and re-creates and re-fills
+# the index when that happened. Migrations keep their own copy of this SQL.
+FTS_TABLE = "shop_product_fts"
+FTS_TRIGGERS = (f"{FTS_TABLE}_ai", f"{FTS_TABLE}_au", f"{FTS_TABLE}_ad")
+
+# Entries of the product ``old.id``; ids are stored as 32 hex digits, one token
+FTS_ENTRY = f"""{FTS_TABLE} MATCH 'product_id:"' || old.id || '"'"""
+
+FTS_CREATE_SQL = [
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        product_id, name, description, tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON shop_product WHEN new.is_deleted = 0 BEGIN
+        INSERT INTO {FTS_TABLE}(product_id, name, description) VALUES (new.id, new.name, new."desc");
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF name, "desc", is_deleted ON shop_product BEGIN
+        DELETE FROM {FTS_TABLE} WHERE {FTS_ENTRY};
+        INSERT INTO {FTS_TABLE}(product_id, name, description)
+        SELECT new.id, new.name, new."desc" WHERE new.is_deleted = 0;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON shop_product BEGIN
+        DELETE FROM {FTS_TABLE} WHERE {FTS_ENTRY};
+    END
+    """,
+]
+
+FTS_REBUILD_SQL = [
+    f"DELETE FROM {FTS_TABLE}",
+    f"""
+    INSERT INTO {FTS_TABLE}(product_id, name, description)
+    SELECT id, name, "desc" FROM shop_product WHERE is_deleted = 0
+    """,
+]
+
+# Columns user queries are matched against; product_id is only the key
+FTS_SEARCH_COLUMNS = "{name description}"
+
+# bm25() weights per FTS column: product_id (unindexed), name, description
+BM25_WEIGHTS = (0.0, 10.0, 1.0)
+MAX_TERMS = 10
+
+
+def build_match_query(q):
+    """
+        Turn free user input into a safe FTS5 MATCH expression.
+
+        Every word is quoted so FTS5 operators in the input are treated as text,
+        and the last word is a prefix match so results show up while typing.
+        Only the name and description columns are searched.
+
+        Returns:
+            str | None: The MATCH expression, or None if ``q`` has no words.
+    """
+    terms = re.findall(r"\w+", q or "")[:MAX_TERMS]
+    if not terms:
+        return None
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] += "*"
+    return f"{FTS_SEARCH_COLUMNS} : ({' '.join(quoted)})"
+
+
+def search_products(queryset, q):
+    """
+        Restrict a Product queryset to rows matching ``q``, best match first.
+
+        Each row gets a ``rank`` (BM25, lower is better) and a ``snippet`` with
+        the matched words wrapped in ``<mark>`` tags.
+    """
+    match = build_match_query(q)
+    if match is None:
+        return queryset.none()
+    if connection.vendor != "sqlite":
+        return queryset.filter(Q(name__icontains=q) | Q(desc__icontains=q)).annotate(
+            rank=Value(0.0, output_field=FloatField()),
+            snippet=Value("", output_field=CharField()),
+        )
+    weights = ", ".join(str(weight) for weight in BM25_WEIGHTS)
+    return queryset.extra(
+        tables=[FTS_TABLE],
+        where=[f"{FTS_TABLE} MATCH %s", f"{FTS_TABLE}.product_id = shop_product.id"],
+        params=[match],
+        select={
+            "rank": f"bm25({FTS_TABLE}, {weights})",
+            "snippet": f"snippet({FTS_TABLE}, -1, '<mark>', '</mark>', '…', 16)",
+        },
+    ).order_by("rank")
+
+
+def rebuild_search_index(using=connection):
+    """Re-index every live product, e.g. after the triggers were missing for a while."""
+    with using.cursor() as cursor:
+        for sql in FTS_REBUILD_SQL:
+            cursor.execute(sql)
+
+
+def ensure_search_index(using=connection):
+    """
+        Create the FTS table and its triggers if any are missing, re-filling the
+        index in that case. Does nothing when everything is already in place.
+    """
+    if using.vendor != "sqlite" or "shop_product" not in using.introspection.table_names():
+        return
+    with using.cursor() as cursor:
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'shop_product'"
+        )
+        existing = {name for (name,) in cursor.fetchall()}
+    if existing.issuperset(FTS_TRIGGERS):
+        return
+    with transaction.atomic(using=using.alias):
+        with using.cursor() as cursor:
+            for sql in FTS_CREATE_SQL:
+                cursor.execute(sql)
+        rebuild_search_index(using)
@@ -1,21 +1,137 @@
+from decimal import Context, Decimal
+
+from django.db.models.manager import BaseManager
 from rest_framework import serializers
+from rest_framework.fields import SkipField
+from rest_framework.validators import UniqueValidator
 from drf_spectacular.utils import extend_schema_field
-from apps.shop.models import Category
+from apps.accounts.models import User
+from apps.common.images import VARIANTS, generated_variants, variant_urls
+from apps.common.utils import storage_url_function
+from apps.shop.models import Category, Product, STARS
 from apps.profiles.serializers import ShippingAddressSerializer
 
 
-class CategorySerializer(serializers.Serializer):
-    name = serializers.CharField()
+@extend_schema_field({
+    "type": "object",
+    "nullable": True,
+    "properties": {variant: {"type": "string"} for variant in VARIANTS},
+})
+class ImageVariantsField(serializers.Field):
+    """
+        Read-only URLs of the thumbnail / WebP variants of an image field,
+        see ``apps.common.images``.
+    """
+    def __init__(self, **kwargs):
+        kwargs["read_only"] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        present = self.context.get(VARIANTS_CONTEXT_KEY, {}).get(value.name)
+        return variant_urls(value.storage, value.name, present)
+
+    def get_attribute(self, instance):
+        value = super().get_attribute(instance)
+        # Render a missing file as None rather than skipping the field
+        return value if value else None
+
+
+# Context entry holding {image name: variants present}, filled by prefetch_variants
+VARIANTS_CONTEXT_KEY = "image_variants_present"
+
+
+def _iterable(data):
+    return data.all() if isinstance(data, BaseManager) else data
+
+
+def _attributes(field, instances):
+    for instance in instances:
+        try:
+            value = field.get_attribute(instance)
+        except SkipField:
+            continue
+        if value is not None:
+            yield value
+
+
+def _variant_files(serializer, instances):
+    """Yields every file an ``ImageVariantsField`` under ``serializer`` renders for ``instances``."""
+    for field in serializer.fields.values():
+        if field.write_only:
+            continue
+        if isinstance(field, ImageVariantsField):
+            yield from _attributes(field, instances)
+        elif isinstance(field, serializers.BaseSerializer):
+            nested = list(_attributes(field, instances))
+            if isinstance(field, serializers.ListSerializer):
+                nested = [item for value in nested for item in _iterable(value)]
+                field = field.child
+            if nested:
+                yield from _variant_files(field, nested)
+
+
+def prefetch_variants(serializer, instances):
+    """
+        Looks up the variants of every image ``serializer`` renders for ``instances``
+        with one cache read per storage (see ``generated_variants``) and keeps them
+        in the serializer context for ``ImageVariantsField``.
+    """
+    names = {}
+    for file in _variant_files(serializer, instances):
+        names.setdefault(file.storage, []).append(file.name)
+    present = serializer.context.setdefault(VARIANTS_CONTEXT_KEY, {})
+    for storage, storage_names in names.items():
+        present.update(generated_variants(storage, [name for name in storage_names if name not in present]))
+
+
+class VariantsListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        items = list(_iterable(data))
+        if self.parent is None:
+            prefetch_variants(self.child, items)
+        return super().to_representation(items)
+
+
+class VariantsSerializer(serializers.Serializer):
+    """
+        Base of serializers rendering ``ImageVariantsField``s, directly or nested.
+
+        When it is the top-level serializer (or its list), the variants of every
+        image in the output are looked up at once before rendering, instead of
+        one cache read per image field and row.
+    """
+    class Meta:
+        list_serializer_class = VariantsListSerializer
+
+    def to_representation(self, instance):
+        if self.parent is None:
+            prefetch_variants(self, [instance])
+        return super().to_representation(instance)
+
+
+class CategorySerializer(VariantsSerializer):
+    # Checked before the image is written to storage, see CategoriesView.post
+    name = serializers.CharField(validators=[UniqueValidator(queryset=Category.objects.all())])
     slug = serializers.CharField(read_only=True)
     image = serializers.ImageField()
+    image_variants = ImageVariantsField(source="image")
+    parent_slug = serializers.SlugField(write_only=True, required=False, help_text="Slug of the parent category.")
+
+class CategoryTreeSerializer(CategorySerializer):
+    """A category with its subcategories nested under ``children``, see ``build_category_tree``."""
+    def get_fields(self):
+        fields = super().get_fields()
+        fields["children"] = CategoryTreeSerializer(many=True, read_only=True, source="tree_children")
+        return fields
 
-class SellerShopSerializer(serializers.Serializer):
+class SellerShopSerializer(VariantsSerializer):
     name = serializers.CharField(source="business_name")
     slug = serializers.SlugField()
     avatar = serializers.CharField(source="user.avatar")
+    avatar_variants = ImageVariantsField(source="user.avatar")
 
 
-class ProductSerializer(serializers.Serializer):
+class ProductSerializer(VariantsSerializer):
     id = serializers.UUIDField(read_only=True)
     seller = SellerShopSerializer()
     name = serializers.CharField()
@@ -28,6 +144,115 @@ class ProductSerializer(serializers.Serializer):
     image1 = serializers.ImageField()
     image2 = serializers.ImageField(required=False)
     image3 = serializers.ImageField(required=False)
+    image1_variants = ImageVariantsField(source="image1")
+    image2_variants = ImageVariantsField(source="image2")
+    image3_variants = ImageVariantsField(source="image3")
+    rating_avg = serializers.FloatField(read_only=True)
+    rating_count = serializers.IntegerField(read_only=True)
+    rating_histogram = serializers.DictField(child=serializers.IntegerField(), read_only=True)
+
+
+class ProductProjection:
+    """
+        Read-only fast path producing exactly the JSON of ``ProductSerializer`` for lists.
+
+        Rows come from ``ProductProjection.project(queryset)``, a named ``values_list()``
+        query over the columns below (seller and category included through joins), so no
+        model instances or DRF fields are built and each output field is converted by a
+        plain function chosen once at import time. Like the list views, it renders image
+        URLs without a request, i.e. relative to MEDIA_URL, and looks up which image
+        variants exist for all rows at once (see ``generated_variants``).
+
+        Usage mirrors a serializer: ``ProductProjection(rows, many=True).data``.
+    """
+    columns = (
+        "id", "create_at", "seller__business_name", "seller__slug", "seller__user__avatar",
+        "name", "slug", "desc", "price_old", "price_current",
+        "category__name", "category__slug", "category__image", "in_stock",
+        "image1", "image2", "image3", "rating_avg", "rating_count",
+    ) + tuple(f"rating_{star}" for star in STARS)
+
+    _money_context = Context(prec=10)
+    _cents = Decimal("0.01")
+    _category_image_url = staticmethod(storage_url_function(Category._meta.get_field("image").storage))
+    _product_image_url = staticmethod(storage_url_function(Product._meta.get_field("image1").storage))
+    _category_storage = Category._meta.get_field("image").storage
+    _product_storage = Product._meta.get_field("image1").storage
+    _avatar_storage = User._meta.get_field("avatar").storage
+
+    def __init__(self, instance, many=False):
+        self.instance = instance
+        self.many = many
+
+    @classmethod
+    def project(cls, queryset):
+        return queryset.values_list(*cls.columns, named=True)
+
+    @property
+    def data(self):
+        if self.many:
+            rows = list(self.instance)
+            present = self.variants_present(rows)
+            to_representation = self.to_representation
+            return [to_representation(row, present) for row in rows]
+        return self.to_representation(self.instance, self.variants_present([self.instance]))
+
+    def variants_present(self, rows):
+        """``generated_variants`` of every image of ``rows``, one cache read per storage."""
+        present = {}
+        for storage, columns in (
+            (self._avatar_storage, ("seller__user__avatar",)),
+            (self._category_storage, ("category__image",)),
+            (self._product_storage, ("image1", "image2", "image3")),
+        ):
+            present.update(generated_variants(storage, [getattr(row, column) for row in rows for column in columns]))
+        return present
+
+    def to_representation(self, row, present):
+        money, cents, context = "{:f}".format, self._cents, self._money_context
+        image_url = self._product_image_url
+        product_storage = self._product_storage
+        category_image = row.category__image
+        avatar = row.seller__user__avatar
+        price_old = row.price_old
+        return {
+            "id": str(row.id),
+            # business_name is required, so it is only None when the product has no seller
+            "seller": None if row.seller__business_name is None else {
+                "name": row.seller__business_name,
+                "slug": row.seller__slug,
+                "avatar": avatar or "",
+                "avatar_variants": variant_urls(self._avatar_storage, avatar, present.get(avatar)),
+            },
+            "name": row.name,
+            "slug": row.slug,
+            "desc": row.desc,
+            "price_old": None if price_old is None else money(price_old.quantize(cents, context=context)),
+            "price_current": money(row.price_current.quantize(cents, context=context)),
+            "category": {
+                "name": row.category__name,
+                "slug": row.category__slug,
+                "image": self._category_image_url(category_image) if category_image else None,
+                "image_variants": variant_urls(self._category_storage, category_image, present.get(category_image)),
+            },
+            "in_stock": row.in_stock,
+            "image1": image_url(row.image1) if row.image1 else None,
+            "image2": image_url(row.image2) if row.image2 else None,
+            "image3": image_url(row.image3) if row.image3 else None,
+            "image1_variants": variant_urls(product_storage, row.image1, present.get(row.image1)),
+            "image2_variants": variant_urls(product_storage, row.image2, present.get(row.image2)),
+            "image3_variants": variant_urls(product_storage, row.image3, present.get(row.image3)),
+            "rating_avg": float(row.rating_avg),
+            "rating_count": row.rating_count,
+            "rating_histogram": {
+                "1": row.rating_1, "2": row.rating_2, "3": row.rating_3, "4": row.rating_4, "5": row.rating_5,
+            },
+        }
+
+
+class ProductSearchSerializer(ProductSerializer):
+    rank = serializers.FloatField(read_only=True)
+    snippet = serializers.CharField(read_only=True)
 
 
 class CreateProductSerializer(serializers.Serializer):
@@ -41,13 +266,35 @@ class CreateProductSerializer(serializers.Serializer):
     image3 = serializers.ImageField(required=False)
 
 
-class OrderItemProductSerializer(serializers.Serializer):
+class PriceHistoryQuerySerializer(serializers.Serializer):
+    days = serializers.IntegerField(min_value=1, max_value=3650, default=90)
+    points = serializers.IntegerField(min_value=10, max_value=1000, default=120)
+    interval = serializers.ChoiceField(choices=["hour", "day", "week", "month"], required=False)
+
+
+class PricePointSerializer(serializers.Serializer):
+    bucket = serializers.DateTimeField()
+    low = serializers.DecimalField(max_digits=10, decimal_places=2)
+    high = serializers.DecimalField(max_digits=10, decimal_places=2)
+    changes = serializers.IntegerField()
+
+
+class PriceSeriesSerializer(serializers.Serializer):
+    product = serializers.SlugField(source="product.slug")
+    interval = serializers.CharField()
+    since = serializers.DateTimeField()
+    start_price = serializers.DecimalField(max_digits=10, decimal_places=2, allow_null=True)
+    current_price = serializers.DecimalField(max_digits=10, decimal_places=2)
+    points = PricePointSerializer(many=True)
+
+
+class OrderItemProductSerializer(VariantsSerializer):
     seller = SellerShopSerializer()
     name = serializers.CharField()
     slug = serializers.SlugField()
     price = serializers.DecimalField(max_digits=10, decimal_places=2, source="price_current")
 
-class OrderItemSerializer(serializers.Serializer):
+class OrderItemSerializer(VariantsSerializer):
     product = OrderItemProductSerializer()
     quantity = serializers.IntegerField()
     total = serializers.DecimalField(max_digits=10, decimal_places=2, source="get_total")
@@ -57,35 +304,51 @@ class ToggleCartItemSerializer(serializers.Serializer):
     quantity = serializers.IntegerField(min_value=0)
 
 
+class CartBatchSerializer(serializers.Serializer):
+    items = ToggleCartItemSerializer(many=True, allow_empty=False, max_length=100)
+
+
 class CheckoutSerializer(serializers.Serializer):
     shipping_id = serializers.UUIDField()
 
+class OrderLineSellerSerializer(serializers.Serializer):
+    name = serializers.CharField(source="business_name")
+    slug = serializers.SlugField()
+
+
+class OrderLineProductSerializer(serializers.Serializer):
+    seller = OrderLineSellerSerializer(allow_null=True)
+    name = serializers.CharField()
+    slug = serializers.SlugField()
+    image = serializers.ImageField(source="image1")
+
+
+class OrderLineSerializer(serializers.Serializer):
+    """An ordered item as stored in ``Order.summary["items"]`` at checkout."""
+    product = OrderLineProductSerializer()
+    quantity = serializers.IntegerField()
+    unit_price = serializers.DecimalField(max_digits=10, decimal_places=2)
+    total = serializers.DecimalField(max_digits=12, decimal_places=2, source="line_total")
+
+
 class OrderSerializer(serializers.Serializer):
     tx_ref = serializers.CharField()
-    first_name = serializers.CharField(source="user.first_name")
-    last_name = serializers.CharField(source="user.last_name")
-    email = serializers.EmailField(source="user.email")
+    # Read from the order's summary, not the user row
+    first_name = serializers.CharField(source="summary.buyer.first_name")
+    last_name = serializers.CharField(source="summary.buyer.last_name")
+    email = serializers.EmailField(source="summary.buyer.email")
     delivery_status = serializers.CharField()
     payment_status = serializers.CharField()
     date_delivered = serializers.DateTimeField()
     shipping_details = serializers.SerializerMethodField()
-    subtotal = serializers.DecimalField(
-        max_digits=100, decimal_places=2, source="get_cart_subtotal"
-    )
-    total = serializers.DecimalField(
-        max_digits=100, decimal_places=2, source="get_cart_total"
-    )
+    subtotal = serializers.DecimalField(max_digits=12, decimal_places=2)
+    total = serializers.DecimalField(max_digits=12, decimal_places=2)
 
     @extend_schema_field(ShippingAddressSerializer)
     def get_shipping_details(self, obj):
         return ShippingAddressSerializer(obj).data
 
 
-class CheckItemOrderSerializer(serializers.Serializer):
-    product = ProductSerializer()
-    quantity = serializers.IntegerField()
-    total = serializers.FloatField(source="get_total")
-
 class ReviewSerializer(serializers.Serializer):
     id = serializers.UUIDField(read_only=True)
     user_id = serializers.UUIDField(read_only=True)
@@ -0,0 +1,113 @@
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils import timezone
+
+from apps.common.cache import bump_versions
+from apps.shop.models import Category, Product
+
+
+class OutOfStock(Exception):
+    """
+        Raised by ``reserve_stock`` when some lines cannot be served.
+
+        Attributes:
+            product_ids (list): Products that have fewer units left than requested.
+    """
+    def __init__(self, product_ids):
+        self.product_ids = product_ids
+        super().__init__(f"Not enough stock for {len(product_ids)} product(s)")
+
+
+def merge_lines(lines):
+    """Sums ``(product_id, quantity)`` pairs per product, in product order."""
+    totals = Counter()
+    for product_id, quantity in lines:
+        totals[product_id] += quantity
+    return sorted((product_id, quantity) for product_id, quantity in totals.items() if quantity > 0)
+
+
+def per_product(lines):
+    """``CASE id WHEN ... THEN quantity END`` for the merged ``lines``."""
+    return Case(
+        *[When(pk=product_id, then=Value(quantity)) for product_id, quantity in lines],
+        output_field=IntegerField(),
+    )
+
+
+def reserve_stock(lines):
+    """
+        Takes ``quantity`` units of every product in ``lines`` off ``in_stock``,
+        all or nothing.
+
+        All lines are decremented by one conditional UPDATE
+        (``SET in_stock = in_stock - q WHERE id IN (...) AND in_stock >= q``,
+        ``q`` being a CASE over the product ids), so the database checks and
+        takes the units in the same statement: no row is read first or locked
+        with SELECT ... FOR UPDATE, and concurrent checkouts of a hot product
+        only wait for each other's UPDATE. When fewer rows than lines were
+        updated, the statement is rolled back and one more query finds the
+        short products for ``OutOfStock``. The cached listings of the products
+        are invalidated on commit.
+
+        Args:
+            lines (iterable): ``(product_id, quantity)`` pairs.
+
+        Raises:
+            OutOfStock: When a product has fewer units left than requested.
+    """
+    lines = merge_lines(lines)
+    if not lines:
+        return
+    product_ids = [product_id for product_id, _ in lines]
+    wanted = per_product(lines)
+    with transaction.atomic():
+        updated = Product.objects.filter(pk__in=product_ids, in_stock__gte=wanted).update(
+            in_stock=F("in_stock") - wanted, update_at=timezone.now()
+        )
+        if updated == len(lines):
+            bump_stock_scopes(product_ids)
+        else:
+            transaction.set_rollback(True)
+    if updated != len(lines):
+        left = dict(Product.objects.filter(pk__in=product_ids).values_list("pk", "in_stock"))
+        # Stock may have come back since the UPDATE; then every line is reported
+        short = [product_id for product_id, quantity in lines if left.get(product_id, 0) < quantity]
+        raise OutOfStock(short or product_ids)
+
+
+def release_stock(lines):
+    """Puts the units of ``lines`` back, e.g. for a cancelled order, with one UPDATE."""
+    lines = merge_lines(lines)
+    if not lines:
+        return
+    product_ids = [product_id for product_id, _ in lines]
+    with transaction.atomic():
+        Product.objects.unfiltered().filter(pk__in=product_ids).update(
+            in_stock=F("in_stock") + per_product(lines), update_at=timezone.now()
+        )
+        bump_stock_scopes(product_ids)
+
+
+def stock_scopes(product_ids):
+    """Response cache scopes showing the stock of ``product_ids``, in two queries."""
+    rows = Product.objects.unfiltered().filter(pk__in=product_ids).values_list("slug", "category__path", "seller__slug")
+    scopes = ["products"]
+    paths = set()
+    for slug, path, seller_slug in rows:
+        scopes.append(f"product:{slug}")
+        paths.add(path)
+        if seller_slug:
+            scopes.append(f"seller:{seller_slug}")
+    return scopes + Category.path_scopes(paths)
+
+
+def bump_stock_scopes(product_ids):
+    """
+        Invalidates the cached responses showing the stock of ``product_ids`` once
+        the transaction commits. The scopes are looked up then too, so the
+        reservation does not hold its write locks for those reads.
+    """
+    if product_ids:
+        transaction.on_commit(lambda: bump_versions(*stock_scopes(product_ids)), robust=True)
@@ -1,3 +1,916 @@
-from django.test import TestCase
+import base64
+import itertools
+import json
+import random
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
+
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.core.files.storage import default_storage
+from django.db import OperationalError, close_old_connections, connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from apps.accounts.models import User
+from apps.common.cache import bump_versions, get_versions
+from apps.common.images import VARIANTS, generate_variants, generated_variants, variant_name
+from apps.common.storage import ContentAddressedStorage
+from apps.profiles.models import Order, OrderItem, ShippingAddress
+from apps.common.testing import PROCESS_CACHE, create_seller
+from apps.shop.models import STARS, Category, Product, Review
+from apps.shop.cart import (
+    DIRTY_MARKER_KEY, DIRTY_SEQUENCE_KEY, CacheCartStore, DatabaseCartStore, cart_products, get_cart_store,
+)
+from apps.shop.facets import compute_facets
+from apps.shop.serializers import ProductProjection, ProductSerializer
+from apps.shop.stock import OutOfStock, release_stock, reserve_stock
+from apps.shop.views import ProductsView
 
 # Create your tests here.
+
+
+def clear_caches():
+    """Empties the default cache, and the cart cache when carts are cached."""
+    cache.clear()
+    if CacheCartStore.is_available():
+        CacheCartStore().cache.clear()
+
+
+class ProductProjectionContractTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user("Seller", "One", "seller@example.com", "password", account_type="SELLER")
+        seller = create_seller(user)
+        no_avatar = User.objects.create_user("Seller", "Two", "seller2@example.com", "password", avatar=None)
+        seller_without_avatar = create_seller(no_avatar, "Shop Two", is_approved=False)
+        category = Category.objects.create(name="Laptops", image="category_images/laptops.jpg")
+        Product.objects.create(
+            seller=seller, name="MacBook Air", desc="Light laptop", price_old=Decimal("1299.5"),
+            price_current=Decimal("999.99"), category=category, in_stock=3,
+            image1="product_images/air 1.jpg", image2="product_images/air2.jpg",
+        )
+        Product.objects.create(
+            seller=seller_without_avatar, name="ThinkPad", desc="Ünïcode “quotes”", price_current=Decimal("10"),
+            category=category, image1="product_images/x.jpg",
+        )
+        Product.objects.create(
+            seller=None, name="Orphan", desc="", price_current=Decimal("0.10"), category=category,
+            image1="product_images/o.jpg",
+        )
+        product = Product.objects.get(name="MacBook Air")
+        Review.objects.create(user=user, product=product, rating=5, text="great")
+        Review.objects.create(user=no_avatar, product=product, rating=2, text="meh")
+
+    def test_projection_output_is_byte_identical_to_product_serializer(self):
+        products = Product.objects.select_related("category", "seller", "seller__user").order_by("name")
+        expected = JSONRenderer().render(ProductSerializer(products, many=True).data)
+        actual = JSONRenderer().render(ProductProjection(ProductProjection.project(products), many=True).data)
+        self.assertEqual(actual, expected)
+
+    def test_projection_single_row(self):
+        product = Product.objects.select_related("category", "seller", "seller__user").get(name="MacBook Air")
+        row = ProductProjection.project(Product.objects.filter(pk=product.pk)).get()
+        self.assertEqual(
+            JSONRenderer().render(ProductProjection(row).data),
+            JSONRenderer().render(ProductSerializer(product).data),
+        )
+
+
+class RatingAggregateTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name="Phones")
+        cls.users = [
+            User.objects.create_user("Reviewer", str(i), f"reviewer{i}@example.com", "password") for i in range(3)
+        ]
+
+    def setUp(self):
+        self.product = Product.objects.create(
+            name="Pixel", desc="d", price_current=Decimal("10"), category=self.category, image1="p.jpg"
+        )
+
+    def review(self, user, rating):
+        return Review.objects.create(user=user, product=self.product, rating=rating, text="t")
+
+    def assertRating(self, avg, count, histogram):
+        product = Product.objects.unfiltered().get(pk=self.product.pk)
+        self.assertAlmostEqual(product.rating_avg, avg)
+        self.assertEqual(product.rating_count, count)
+        self.assertEqual(product.rating_histogram, {star: histogram.get(star, 0) for star in STARS})
+
+    def test_create_counts_each_review(self):
+        self.review(self.users[0], 5)
+        self.review(self.users[1], 2)
+        self.assertRating(3.5, 2, {5: 1, 2: 1})
+
+    def test_edit_moves_the_review_between_stars(self):
+        review = self.review(self.users[0], 5)
+        self.review(self.users[1], 4)
+        review.rating = 1
+        review.save()
+        self.assertRating(2.5, 2, {4: 1, 1: 1})
+        review.text = "edited"
+        review.save()
+        self.assertRating(2.5, 2, {4: 1, 1: 1})
+
+    def test_soft_delete_and_hard_delete_remove_the_review(self):
+        soft = self.review(self.users[0], 5)
+        hard = self.review(self.users[1], 3)
+        self.review(self.users[2], 1)
+        soft.delete()
+        self.assertRating(2.0, 2, {3: 1, 1: 1})
+        hard.hard_delete()
+        self.assertRating(1.0, 1, {1: 1})
+        # Hard-deleting an already soft-deleted review must not count it twice
+        Review.objects.unfiltered().get(pk=soft.pk).hard_delete()
+        self.assertRating(1.0, 1, {1: 1})
+
+    def test_queryset_delete_rebuilds_the_aggregates(self):
+        self.review(self.users[0], 5)
+        self.review(self.users[1], 3)
+        Review.objects.filter(rating=5).delete()
+        self.assertRating(3.0, 1, {3: 1})
+        Review.objects.all().delete(hard_delete=True)
+        self.assertRating(0.0, 0, {})
+
+    def test_rebuild_ratings_command_repairs_drift(self):
+        self.review(self.users[0], 4)
+        self.review(self.users[1], 2)
+        Product.objects.unfiltered().filter(pk=self.product.pk).update(
+            rating_avg=1.0, rating_count=7, rating_4=0, rating_1=7
+        )
+        call_command("rebuild_ratings", stdout=StringIO())
+        self.assertRating(3.0, 2, {4: 1, 2: 1})
+
+
+class ImageVariantsTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=media_root.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        buffer = BytesIO()
+        Image.new("RGB", (1200, 800), "red").save(buffer, "JPEG")
+        self.name = default_storage.save("product_images/big.jpg", ContentFile(buffer.getvalue()))
+        category = Category.objects.create(name="Phones", image="category_images/missing.jpg")
+        Product.objects.create(name="Phone", desc="d", price_current=Decimal("1"), category=category, image1=self.name)
+
+    def test_generate_variants_downscales_into_variants_dir(self):
+        written = generate_variants(default_storage, self.name)
+        self.assertEqual(written, [variant_name(self.name, variant) for variant in VARIANTS])
+        with default_storage.open(variant_name(self.name, "thumb_webp")) as file:
+            image = Image.open(file)
+            self.assertEqual((image.format, image.size), ("WEBP", (320, 213)))
+        self.assertEqual(generate_variants(default_storage, self.name), [])
+
+    def test_variant_urls_fall_back_to_the_original(self):
+        product = Product.objects.select_related("category").get()
+        self.assertEqual(ProductSerializer(product).data["image1_variants"]["thumb"], "/media/" + self.name)
+        generate_variants(default_storage, self.name)
+        data = ProductSerializer(product).data
+        self.assertEqual(data["image1_variants"]["thumb"], "/media/" + variant_name(self.name, "thumb"))
+        self.assertIsNone(data["image2_variants"])
+        self.assertEqual(data["category"]["image_variants"]["webp"], "/media/category_images/missing.jpg")
+        row = ProductProjection.project(Product.objects.all()).get()
+        self.assertEqual(JSONRenderer().render(ProductProjection(row).data), JSONRenderer().render(data))
+
+    def test_lists_read_recorded_variants_instead_of_probing_storage(self):
+        generate_variants(default_storage, self.name)
+        rows = ProductProjection.project(Product.objects.all())
+        with mock.patch.object(ContentAddressedStorage, "exists", autospec=True, return_value=False) as exists:
+            data = ProductProjection(rows, many=True).data
+            # Only the category image, never seen before, is probed; then it is recorded too
+            self.assertEqual({call.args[1] for call in exists.call_args_list}, {
+                variant_name("category_images/missing.jpg", variant) for variant in VARIANTS
+            })
+            exists.reset_mock()
+            self.assertEqual(ProductProjection(rows, many=True).data, data)
+            exists.assert_not_called()
+        self.assertEqual(data[0]["image1_variants"]["webp"], "/media/" + variant_name(self.name, "webp"))
+
+    def test_serializers_look_variants_up_once_per_storage(self):
+        category = Category.objects.get()
+        for i in range(5):
+            Product.objects.create(name=f"Phone {i}", desc="d", price_current=Decimal("1"), category=category,
+                                   image1=f"product_images/{i}.jpg", image2=f"product_images/{i}b.jpg")
+        products = Product.objects.select_related("category", "seller__user").order_by("name")
+        lookup = mock.Mock(wraps=generated_variants)
+        with mock.patch("apps.common.images.generated_variants", lookup), \
+                mock.patch("apps.shop.serializers.generated_variants", lookup):
+            data = ProductSerializer(products, many=True).data
+            # At most one per storage (product, category, avatar), whatever the number of rows
+            self.assertLessEqual(lookup.call_count, 3)
+            lookup.reset_mock()
+            ProductSerializer(products[0]).data
+            self.assertLessEqual(lookup.call_count, 3)
+        self.assertEqual(data[1]["image2_variants"]["thumb"], "/media/product_images/0b.jpg")
+
+    def test_written_variants_bump_the_scopes_showing_the_image(self):
+        product = Product.objects.select_related("category").get()
+        scopes = ["products", f"product:{product.slug}", f"category:{product.category.slug}"]
+        before = get_versions(scopes)
+        inline = mock.Mock(submit=lambda fn, *args: fn(*args))
+        with mock.patch("apps.common.images.get_executor", return_value=inline):
+            with self.captureOnCommitCallbacks(execute=True):
+                product.save()
+        self.assertTrue(default_storage.exists(variant_name(self.name, "thumb")))
+        self.assertTrue(all(new > old for new, old in zip(get_versions(scopes), before)))
+
+
+class StockReservationStressTests(TransactionTestCase):
+    """Hundreds of threads race for the last units of a product; none may be sold twice."""
+    threads = 200
+    units = 25
+
+    def setUp(self):
+        category = Category.objects.create(name="Laptops", image="category_images/laptops.jpg")
+        self.product = Product.objects.create(
+            name="MacBook Air", desc="d", price_current=Decimal("999"), category=category,
+            in_stock=self.units, image1="product_images/air.jpg",
+        )
+        self.other = Product.objects.create(
+            name="ThinkPad", desc="d", price_current=Decimal("10"), category=category,
+            in_stock=self.threads, image1="product_images/x.jpg",
+        )
+
+    def race(self, lines):
+        start = threading.Barrier(self.threads)
+
+        def buy(_):
+            start.wait()
+            try:
+                for attempt in itertools.count():
+                    try:
+                        reserve_stock(lines)
+                        return True
+                    except OutOfStock:
+                        return False
+                    except OperationalError as exc:
+                        # The shared-cache in-memory SQLite test database reports a
+                        # lock conflict at once instead of waiting like a file does
+                        if "locked" not in str(exc):
+                            raise
+                        time.sleep(random.uniform(0, min(0.05, 0.001 * 2 ** attempt)))
+            finally:
+                close_old_connections()
+
+        with ThreadPoolExecutor(max_workers=self.threads) as executor:
+            return list(executor.map(buy, range(self.threads)))
+
+    def test_last_units_are_sold_once(self):
+        results = self.race([(self.product.id, 1)])
+        self.product.refresh_from_db()
+        self.assertEqual(results.count(True), self.units)
+        self.assertEqual(self.product.in_stock, 0)
+
+    def test_partial_failure_rolls_back(self):
+        # Every buyer wants one of each; the short product must not leave the other one decremented
+        results = self.race([(self.other.id, 1), (self.product.id, 1)])
+        self.product.refresh_from_db()
+        self.other.refresh_from_db()
+        self.assertEqual(results.count(True), self.units)
+        self.assertEqual(self.other.in_stock, self.threads - self.units)
+        self.assertEqual(self.product.in_stock, 0)
+
+    def test_release_puts_units_back(self):
+        reserve_stock([(self.product.id, 5), (self.product.id, 5)])
+        release_stock([(self.product.id, 10)])
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.in_stock, self.units)
+        with self.assertRaises(OutOfStock) as raised:
+            reserve_stock([(self.product.id, self.units + 1), (self.other.id, 1)])
+        self.assertEqual(raised.exception.product_ids, [self.product.id])
+        self.other.refresh_from_db()
+        self.assertEqual(self.other.in_stock, self.threads)
+
+
+class CheckoutTests(TestCase):
+    """Checkout costs the same queries for any cart size and freezes the prices it charged."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("Buyer", "One", "buyer@example.com", "password")
+        category = Category.objects.create(name="Laptops", image="category_images/laptops.jpg")
+        cls.products = [
+            Product.objects.create(
+                name=f"Laptop {i}", desc="d", price_current=Decimal(100 + i), category=category, in_stock=10,
+                image1="product_images/p.jpg",
+            )
+            for i in range(5)
+        ]
+        cls.shipping = ShippingAddress.objects.create(
+            user=cls.user, full_name="Buyer One", email="buyer@example.com", phone="1", address="a",
+            city="c", country="n", zipcode="1",
+        )
+
+    def setUp(self):
+        clear_caches()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def checkout(self, products, quantity=2):
+        for product in products:
+            OrderItem.objects.create(user=self.user, product=product, quantity=quantity)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post("/shop/checkout/", {"shipping_id": str(self.shipping.id)})
+        self.assertEqual(response.status_code, 200)
+        return response.data["item"], len(queries)
+
+    def test_query_count_does_not_grow_with_the_cart(self):
+        _, one = self.checkout(self.products[:1])
+        _, five = self.checkout(self.products)
+        self.assertEqual(one, five)
+
+    def test_totals_are_snapshots(self):
+        data, _ = self.checkout(self.products[:2])
+        self.assertEqual(data["subtotal"], "402.00")
+        self.assertEqual(data["total"], "402.00")
+        order = Order.objects.get(tx_ref=data["tx_ref"])
+        self.assertEqual(
+            sorted(order.orderitems.values_list("unit_price", "line_total")),
+            [(Decimal("100"), Decimal("200")), (Decimal("101"), Decimal("202"))],
+        )
+        Product.objects.update(price_current=Decimal("1"))
+        order.refresh_from_db()
+        self.assertEqual(order.total, Decimal("402"))
+        self.assertEqual(sum(item.get_total for item in order.orderitems.all()), Decimal("402"))
+        self.assertEqual(Product.objects.get(pk=self.products[0].pk).in_stock, 8)
+
+    def test_out_of_stock_leaves_the_cart(self):
+        OrderItem.objects.create(user=self.user, product=self.products[0], quantity=11)
+        response = self.client.post("/shop/checkout/", {"shipping_id": str(self.shipping.id)})
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(Order.objects.exists())
+        self.assertTrue(OrderItem.objects.filter(user=self.user, order=None).exists())
+
+    def test_lines_claimed_meanwhile_are_not_ordered_twice(self):
+        OrderItem.objects.create(user=self.user, product=self.products[0], quantity=2)
+        other = Order.objects.create(user=self.user, full_name="Buyer One", email="buyer@example.com")
+        create = Order.objects.create
+
+        def parallel_checkout_first(**kwargs):
+            # Another request takes the lines after this one read them
+            OrderItem.objects.filter(user=self.user, order=None).update(order=other)
+            return create(**kwargs)
+
+        with mock.patch.object(Order.objects, "create", side_effect=parallel_checkout_first):
+            response = self.client.post("/shop/checkout/", {"shipping_id": str(self.shipping.id)})
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(list(Order.objects.all()), [other])
+        self.assertEqual(Product.objects.get(pk=self.products[0].pk).in_stock, 10)
+
+    def test_reserves_the_quantities_claimed(self):
+        OrderItem.objects.create(user=self.user, product=self.products[0], quantity=2)
+        create = Order.objects.create
+
+        def parallel_cart_update_first(**kwargs):
+            OrderItem.objects.filter(user=self.user, order=None).update(quantity=3)
+            return create(**kwargs)
+
+        with mock.patch.object(Order.objects, "create", side_effect=parallel_cart_update_first):
+            response = self.client.post("/shop/checkout/", {"shipping_id": str(self.shipping.id)})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Order.objects.get().orderitems.get().quantity, 3)
+        self.assertEqual(Product.objects.get(pk=self.products[0].pk).in_stock, 7)
+
+
+class CartTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("Buyer", "One", "buyer@example.com", "password")
+        category = Category.objects.create(name="Laptops", image="category_images/laptops.jpg")
+        cls.products = [
+            Product.objects.create(
+                name=f"Laptop {i}", desc="d", price_current=Decimal(100 + i), category=category, in_stock=10,
+                image1="product_images/p.jpg",
+            )
+            for i in range(3)
+        ]
+        cls.shipping = ShippingAddress.objects.create(
+            user=cls.user, full_name="Buyer One", email="buyer@example.com", phone="1", address="a",
+            city="c", country="n", zipcode="1",
+        )
+
+    def setUp(self):
+        clear_caches()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def toggle(self, product, quantity):
+        return self.client.post("/shop/cart/", {"slug": product.slug, "quantity": quantity})
+
+    def cart(self):
+        return [(item["product"]["slug"], item["quantity"], item["total"]) for item in self.client.get("/shop/cart/").data]
+
+    def rows(self):
+        return sorted(OrderItem.objects.filter(user=self.user, order=None).values_list("product__slug", "quantity"))
+
+    def checkout(self):
+        return self.client.post("/shop/checkout/", {"shipping_id": str(self.shipping.id)})
+
+
+class CartStoreTests(CartTestCase):
+    """Carts through the configured store; they are only cached with a Redis ``carts`` cache."""
+
+    def test_carts_are_kept_in_the_database_without_redis(self):
+        database = {"BACKEND": "django.core.cache.backends.db.DatabaseCache", "LOCATION": "django_cache"}
+        with override_settings(CACHES={"default": database}):
+            self.assertIsInstance(get_cart_store(), DatabaseCartStore)
+        # A culling cache would lose carts with the catalog responses
+        with override_settings(CACHES={"default": database, "carts": database}):
+            self.assertIsInstance(get_cart_store(), DatabaseCartStore)
+
+    def test_checkout_orders_the_cart(self):
+        self.toggle(self.products[0], 2)
+        self.toggle(self.products[1], 1)
+        self.toggle(self.products[1], 0)
+        self.assertEqual(self.cart(), [("laptop-0", 2, "200.00")])
+        self.assertEqual(self.checkout().data["item"]["total"], "200.00")
+        self.assertEqual(self.cart(), [])
+        self.assertEqual(self.rows(), [])
+
+    def test_anonymous_requests_are_rejected(self):
+        anonymous = APIClient()
+        self.assertEqual(anonymous.get("/shop/cart/").status_code, 401)
+        self.assertEqual(anonymous.post("/shop/cart/", {"slug": self.products[0].slug, "quantity": 1}).status_code, 401)
+        self.assertEqual(anonymous.post("/shop/checkout/", {"shipping_id": str(self.shipping.id)}).status_code, 401)
+        with self.assertRaises(ValueError):
+            CacheCartStore.key(None)
+
+    @override_settings(CART_STORE="apps.shop.cart.DatabaseCartStore")
+    def test_database_store_has_the_same_responses(self):
+        self.assertEqual(self.toggle(self.products[0], 2).data["item"]["total"], "200.00")
+        self.assertEqual(self.toggle(self.products[0], 0).data["item"], None)
+        self.toggle(self.products[1], 1)
+        self.assertEqual(self.rows(), [("laptop-1", 1)])
+        self.assertEqual(self.cart(), [("laptop-1", 1, "101.00")])
+        self.assertEqual(DatabaseCartStore().flush(), 0)
+
+
+@skipUnless(CacheCartStore.is_available(), "Carts are only cached in Redis, set REDIS_URL")
+class CacheCartStoreTests(CartTestCase):
+    """The cache-backed cart is read without queries and reaches the database at flush or checkout."""
+
+    def setUp(self):
+        super().setUp()
+        self.store = CacheCartStore()
+
+    def test_cart_is_read_from_the_cache(self):
+        for product in self.products:
+            self.assertEqual(self.toggle(product, 2).status_code, 201)
+        self.assertEqual(self.toggle(self.products[0], 3).status_code, 200)
+        self.assertEqual(self.toggle(self.products[2], 0).data["item"], None)
+        with CaptureQueriesContext(connection) as queries:
+            cart = self.cart()
+        self.assertEqual(len(queries), 0)
+        self.assertEqual(cart, [("laptop-1", 2, "202.00"), ("laptop-0", 3, "300.00")])
+        self.assertEqual(self.rows(), [])
+
+    def test_changed_products_are_rendered_again(self):
+        self.toggle(self.products[0], 2)
+        Product.objects.filter(pk=self.products[0].pk).update(price_current=Decimal("5"))
+        bump_versions(f"product:{self.products[0].slug}")
+        self.assertEqual(self.cart(), [("laptop-0", 2, "10.00")])
+
+    def test_flush_and_checkout_write_the_cart(self):
+        self.toggle(self.products[0], 2)
+        self.toggle(self.products[1], 1)
+        call_command("flush_carts", stdout=StringIO())
+        self.assertEqual(self.rows(), [("laptop-0", 2), ("laptop-1", 1)])
+        self.toggle(self.products[1], 0)
+        # A cart evicted from the cache comes back from its flushed rows
+        self.store.cache.clear()
+        self.assertEqual(sorted(self.cart()), [("laptop-0", 2, "200.00"), ("laptop-1", 1, "101.00")])
+        self.toggle(self.products[1], 0)
+        self.assertEqual(self.checkout().data["item"]["total"], "200.00")
+        self.assertEqual(self.cart(), [])
+        self.assertEqual(self.rows(), [])
+
+    def test_checkout_writes_the_cart_whose_marker_was_lost(self):
+        self.toggle(self.products[0], 2)
+        call_command("flush_carts", stdout=StringIO())
+        self.toggle(self.products[0], 3)
+        self.store.cache.delete(DIRTY_MARKER_KEY.format(self.user.pk))
+        self.assertEqual(self.checkout().data["item"]["total"], "300.00")
+        self.assertEqual(Order.objects.get().orderitems.get().quantity, 3)
+
+    def test_carts_marked_in_parallel_are_all_flushed(self):
+        store = self.store
+        users = [self.user] + [
+            User.objects.create_user("Buyer", str(i), f"buyer{i}@example.com", "password") for i in range(7)
+        ]
+        products = cart_products([product.pk for product in self.products])
+        first, second = products[self.products[0].pk], products[self.products[1].pk]
+        for user in users:
+            store.set_quantity(user, first, 1)
+        self.assertEqual(store.flush(), len(users))
+
+        def change(user):
+            # The carts are cached, so this only talks to the cache
+            for quantity in range(2, 6):
+                store.set_quantity(user, second, quantity)
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            list(pool.map(change, users * 2))
+        self.assertEqual(store.dirty_user_ids(), {user.pk for user in users})
+        self.assertEqual(store.flush(), len(users))
+        self.assertEqual(store.flush(), 0)
+        self.assertEqual(
+            OrderItem.objects.filter(order=None, product=second, quantity=5).count(), len(users)
+        )
+        self.assertEqual(OrderItem.objects.filter(order=None, product=first).count(), len(users))
+
+    def test_flush_waits_for_a_slot_being_taken(self):
+        store = self.store
+        other = User.objects.create_user("Buyer", "Two", "buyer2@example.com", "password")
+        store.set_quantity(self.user, self.products[0], 1)
+        # A request between incr and add, or one that died there
+        store.cache.incr(DIRTY_SEQUENCE_KEY)
+        store.set_quantity(other, self.products[0], 2)
+        self.assertEqual(store.flush(), 1)
+        self.assertEqual(store.dirty_user_ids(), {other.pk})
+        self.assertEqual(store.flush(), 1)
+        self.assertEqual(sorted(OrderItem.objects.filter(order=None).values_list("quantity", flat=True)), [1, 2])
+
+
+class CartBatchTests(TestCase):
+    """Syncing a cart of any size costs a handful of queries with either cart store."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("Buyer", "One", "buyer@example.com", "password")
+        category = Category.objects.create(name="Laptops", image="category_images/laptops.jpg")
+        cls.products = Product.objects.bulk_create([
+            Product(
+                name=f"Laptop {i}", slug=f"laptop-{i}", desc="d", price_current=Decimal(100 + i),
+                category=category, in_stock=5, image1="product_images/p.jpg",
+            )
+            for i in range(30)
+        ])
+
+    def setUp(self):
+        clear_caches()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def sync(self, changes):
+        items = [{"slug": slug, "quantity": quantity} for slug, quantity in changes]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post("/shop/cart/batch/", {"items": items}, format="json")
+        return response, len(queries)
+
+    def check_sync(self, max_queries):
+        response, count = self.sync([(product.slug, 2) for product in self.products])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data["items"]), 30)
+        self.assertLessEqual(count, max_queries)
+        # Updates, removals and a repeated slug (the last change wins) in one go
+        response, count = self.sync([("laptop-0", 0), ("laptop-1", 4), ("laptop-2", 0), ("laptop-2", 1)])
+        self.assertLessEqual(count, max_queries)
+        items = {item["product"]["slug"]: item["quantity"] for item in response.data["items"]}
+        self.assertEqual(len(items), 29)
+        self.assertNotIn("laptop-0", items)
+        self.assertEqual((items["laptop-1"], items["laptop-2"]), (4, 1))
+
+    @skipUnless(CacheCartStore.is_available(), "Carts are only cached in Redis, set REDIS_URL")
+    def test_cache_store(self):
+        self.check_sync(max_queries=2)
+
+    @override_settings(CART_STORE="apps.shop.cart.DatabaseCartStore", CACHES=PROCESS_CACHE)
+    def test_database_store(self):
+        # Lookups, writes and the result, plus the savepoint around the writes
+        self.check_sync(max_queries=7)
+        self.assertEqual(OrderItem.objects.filter(user=self.user, order=None).count(), 29)
+
+    def test_anonymous_sync_is_rejected(self):
+        response = APIClient().post("/shop/cart/batch/", {"items": [{"slug": "laptop-0", "quantity": 1}]}, format="json")
+        self.assertEqual(response.status_code, 401)
+
+    def test_invalid_changes_leave_the_cart(self):
+        self.sync([("laptop-0", 1)])
+        response, _ = self.sync([("laptop-1", 1), ("no-such-laptop", 1)])
+        self.assertEqual((response.status_code, response.data["products"]), (404, ["no-such-laptop"]))
+        response, _ = self.sync([("laptop-1", 1), ("laptop-2", 6)])
+        self.assertEqual((response.status_code, response.data["in_stock"]), (400, {"laptop-2": 5}))
+        self.assertEqual([item["product"]["slug"] for item in self.client.get("/shop/cart/").data], ["laptop-0"])
+
+
+class ProductCursorPaginationTests(TestCase):
+    """Keyset pages cover every product once, even when the sort key ties, in both directions."""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name="Laptops", image="category_images/laptops.jpg")
+        Product.objects.bulk_create([
+            Product(
+                name=f"Laptop {i}", slug=f"laptop-{i}", desc="d", price_current=Decimal(100 + i % 3),
+                category=category, image1="product_images/p.jpg",
+            )
+            for i in range(10)
+        ])
+        # Every product shares its creation time and most share a price
+        Product.objects.update(create_at=timezone.now())
+
+    def setUp(self):
+        cache.clear()
+
+    def walk(self, url, link="next"):
+        pages = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            pages.append([product["slug"] for product in response.data["results"]])
+            url = response.data[link]
+        return pages, response
+
+    def expected(self, *ordering):
+        return list(Product.objects.order_by(*ordering).values_list("slug", flat=True))
+
+    def test_pages_cover_ties_once(self):
+        for ordering, key in [("price", ("price_current", "id")), ("-price", ("-price_current", "-id")),
+                              ("newest", ("-create_at", "-id"))]:
+            with self.subTest(ordering=ordering):
+                pages, _ = self.walk(f"/shop/products/?pagination=cursor&ordering={ordering}&page_size=3")
+                self.assertEqual([len(page) for page in pages], [3, 3, 3, 1])
+                self.assertEqual([slug for page in pages for slug in page], self.expected(*key))
+
+    def test_previous_links_return_the_same_pages(self):
+        forward, last = self.walk("/shop/products/?pagination=cursor&ordering=price&page_size=3")
+        backward, first = self.walk(last.data["previous"], link="previous")
+        self.assertEqual(backward, forward[-2::-1])
+        self.assertIsNone(first.data["previous"])
+        self.assertIsNotNone(first.data["next"])
+
+    def test_invalid_cursors_are_not_found(self):
+        garbage = base64.urlsafe_b64encode(json.dumps({"v": ["not a price", "not a uuid"]}).encode()).decode()
+        for cursor in ("not-base64!", base64.urlsafe_b64encode(b"{}").decode(), garbage):
+            with self.subTest(cursor=cursor):
+                response = self.client.get("/shop/products/", {"ordering": "price", "cursor": cursor})
+                self.assertEqual(response.status_code, 404)
+
+
+class ProductStreamTests(TestCase):
+    """``?stream=ndjson`` writes every matching product, one line each, in chunks."""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name="Laptops", image="category_images/laptops.jpg")
+        Product.objects.bulk_create([
+            Product(
+                name=f"Laptop {i}", slug=f"laptop-{i}", desc="d", price_current=Decimal(100 + i),
+                category=category, image1="product_images/p.jpg",
+            )
+            for i in range(7)
+        ])
+
+    def setUp(self):
+        cache.clear()
+
+    def test_streams_all_filtered_rows_in_chunks(self):
+        with mock.patch.object(ProductsView, "stream_chunk_size", 2):
+            response = self.client.get("/shop/products/", {"stream": "ndjson", "ordering": "price", "min_price": 102})
+            chunks = [chunk.decode() for chunk in response.streaming_content]
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        self.assertEqual([chunk.count("\n") for chunk in chunks], [2, 2, 1])
+        lines = [json.loads(line) for line in "".join(chunks).splitlines()]
+        products = Product.objects.select_related("category", "seller", "seller__user").filter(
+            price_current__gte=102).order_by("price_current", "id")
+        self.assertEqual(lines, json.loads(JSONRenderer().render(ProductSerializer(products, many=True).data)))
+
+
+class ProductListValidatorsTests(TestCase):
+    """The ETag of a product list comes from cache versions, not from an aggregate over the matching rows."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("Seller", "One", "seller@example.com", "password", account_type="SELLER")
+        seller = create_seller(cls.user)
+        category = Category.objects.create(name="Laptops", image="category_images/laptops.jpg")
+        Product.objects.bulk_create([
+            Product(
+                seller=seller, name=f"Laptop {i}", slug=f"laptop-{i}", desc="d", price_current=Decimal(100 + i),
+                category=category, image1="product_images/p.jpg",
+            )
+            for i in range(3)
+        ])
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_seller_list_revalidates_without_reading_products(self):
+        # The seller's own list is not response-cached, so every request reaches list_products
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/sellers/products/", {"ordering": "price"})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse([query["sql"] for query in queries if "MAX(" in query["sql"]])
+        etag = response["ETag"]
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/sellers/products/", {"ordering": "price"}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse([query["sql"] for query in queries if "shop_product" in query["sql"]])
+
+        response = self.client.get("/sellers/products/", {"ordering": "-price"}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(self.client.delete("/sellers/product/laptop-0/").status_code, 200)
+        response = self.client.get("/sellers/products/", {"ordering": "price"}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(response.data["count"], 2)
+
+
+class ProductFacetsTests(TestCase):
+    """``?facets=`` counts the filtered products per category, price bucket and stock state."""
+
+    @classmethod
+    def setUpTestData(cls):
+        laptops = Category.objects.create(name="Laptops", image="category_images/laptops.jpg")
+        phones = Category.objects.create(name="Phones", image="category_images/phones.jpg")
+        rows = [(laptops, 50, 0), (laptops, 700, 3), (laptops, 1200, 1), (phones, 300, 2), (phones, 20000, 0)]
+        Product.objects.bulk_create([
+            Product(
+                name=f"Product {i}", slug=f"product-{i}", desc="d", price_current=Decimal(price),
+                category=category, in_stock=in_stock, image1="product_images/p.jpg",
+            )
+            for i, (category, price, in_stock) in enumerate(rows)
+        ])
+
+    def setUp(self):
+        cache.clear()
+
+    def test_counts_follow_the_filters(self):
+        response = self.client.get("/shop/products/", {"facets": "category,price,in_stock,bogus", "min_price": 100})
+        facets = response.data["facets"]
+        self.assertEqual(set(facets), {"category", "price", "in_stock"})
+        self.assertEqual(
+            [(row["slug"], row["count"]) for row in facets["category"]], [("laptops", 2), ("phones", 2)]
+        )
+        self.assertEqual(
+            [(row["min"], row["max"], row["count"]) for row in facets["price"]],
+            [(0, 100, 0), (100, 500, 1), (500, 1000, 1), (1000, 5000, 1), (5000, 10000, 0), (10000, None, 1)],
+        )
+        self.assertEqual(facets["in_stock"], {"in_stock": 3, "out_of_stock": 1})
+        self.assertNotIn("facets", self.client.get("/shop/products/", {"min_price": 100}).data)
+
+    def test_computed_in_one_query(self):
+        with self.assertNumQueries(1):
+            compute_facets(Product.objects.all(), ["category", "price", "in_stock"])
+
+    def test_pages_share_the_entry_until_a_write(self):
+        params = {"facets": "category", "page_size": 2}
+        first = self.client.get("/shop/products/", params).data["facets"]
+        with CaptureQueriesContext(connection) as queries:
+            second = self.client.get("/shop/products/", {**params, "page": 2}).data["facets"]
+        self.assertEqual(second, first)
+        self.assertFalse([query["sql"] for query in queries if "GROUP BY" in query["sql"]])
+
+        Product.objects.filter(slug="product-0").update(category=Category.objects.get(slug="phones"))
+        bump_versions("products")
+        facets = self.client.get("/shop/products/", params).data["facets"]
+        self.assertEqual([(row["slug"], row["count"]) for row in facets["category"]], [("phones", 3), ("laptops", 2)])
+
+
+class CategoryTreeTests(TestCase):
+    """Subtrees are one range of the materialized path, through moves as well."""
+
+    @classmethod
+    def setUpTestData(cls):
+        def category(name, parent=None):
+            return Category.objects.create(name=name, image=f"category_images/{name}.jpg", parent=parent)
+
+        cls.computers = category("Computers")
+        cls.laptops = category("Laptops", cls.computers)
+        cls.ultrabooks = category("Ultrabooks", cls.laptops)
+        cls.gaming = category("Gaming", cls.laptops)
+        cls.phones = category("Phones")
+        for home in (cls.computers, cls.ultrabooks, cls.phones):
+            Product.objects.create(
+                name=f"In {home.name}", desc="d", price_current=Decimal(1), category=home,
+                image1="product_images/p.jpg",
+            )
+
+    def setUp(self):
+        cache.clear()
+
+    def names(self, queryset):
+        return sorted(queryset.values_list("name", flat=True))
+
+    def test_subtree_is_one_query(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.names(self.computers.subtree()), ["Computers", "Gaming", "Laptops", "Ultrabooks"])
+        self.assertEqual(self.names(self.laptops.subtree()), ["Gaming", "Laptops", "Ultrabooks"])
+        self.assertEqual(self.names(self.phones.subtree()), ["Phones"])
+        self.assertEqual(
+            sorted(self.ultrabooks.cache_scopes()), ["category:computers", "category:laptops", "category:ultrabooks"]
+        )
+
+    def test_category_products_cover_the_subtree(self):
+        response = self.client.get(f"/shop/categories/{self.computers.slug}/", {"page_size": 10})
+        self.assertEqual(sorted(row["name"] for row in response.data["results"]), ["In Computers", "In Ultrabooks"])
+        response = self.client.get(f"/shop/categories/{self.laptops.slug}/", {"page_size": 10})
+        self.assertEqual([row["name"] for row in response.data["results"]], ["In Ultrabooks"])
+
+    def test_moving_reroots_the_descendants(self):
+        self.laptops.parent = self.phones
+        self.laptops.save()
+        ultrabooks = Category.objects.get(pk=self.ultrabooks.pk)
+        self.assertEqual(ultrabooks.path, self.phones.path + self.laptops.id.hex + "/" + ultrabooks.id.hex + "/")
+        self.assertEqual(ultrabooks.depth, 2)
+        self.assertEqual(self.names(self.computers.subtree()), ["Computers"])
+        self.assertEqual(self.names(self.phones.subtree()), ["Gaming", "Laptops", "Phones", "Ultrabooks"])
+
+        computers = Category.objects.get(pk=self.computers.pk)
+        computers.parent = ultrabooks
+        computers.save()
+        self.assertEqual(Category.objects.get(pk=self.computers.pk).depth, 3)
+
+        phones = Category.objects.get(pk=self.phones.pk)
+        phones.parent = ultrabooks
+        with self.assertRaises(ValueError):
+            phones.save()
+
+    def test_tree_listing_nests_children(self):
+        tree = self.client.get("/shop/categories/").data
+        self.assertEqual([root["name"] for root in tree], ["Computers", "Phones"])
+        laptops = tree[0]["children"][0]
+        self.assertEqual([child["name"] for child in laptops["children"]], ["Gaming", "Ultrabooks"])
+
+
+class ProductSearchTests(TestCase):
+    """The full-text index follows product writes and only searches names and descriptions."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name="Laptops", image="category_images/laptops.jpg")
+        cls.air = cls.product("MacBook Air", "Light aluminium laptop")
+        cls.pro = cls.product("MacBook Pro", "Café edition, with a big screen")
+        cls.desk = cls.product("Standing desk", "Fits any macbook")
+
+    @classmethod
+    def product(cls, name, desc):
+        return Product.objects.create(
+            name=name, desc=desc, price_current=Decimal("100"), category=cls.category, image1="product_images/p.jpg",
+        )
+
+    def search(self, q):
+        response = self.client.get("/shop/products/search/", {"q": q, "page_size": 10})
+        self.assertEqual(response.status_code, 200)
+        return [product["slug"] for product in response.data["results"]]
+
+    def test_matches_words_prefixes_and_accents(self):
+        self.assertEqual(set(self.search("macbook")), {self.air.slug, self.pro.slug, self.desk.slug})
+        # A name match ranks above a description match
+        self.assertEqual(self.search("macbook")[-1], self.desk.slug)
+        self.assertEqual(self.search("alumin"), [self.air.slug])
+        self.assertEqual(self.search("cafe"), [self.pro.slug])
+        # Quotes and FTS5 operators in the input are plain words
+        self.assertEqual(self.search('pro" OR "air'), [])
+        self.assertEqual(self.search("macbook pro"), [self.pro.slug])
+        self.assertEqual(self.search("?!"), [])
+
+    def test_ids_are_not_searchable(self):
+        self.assertEqual(self.search(self.air.id.hex), [])
+
+    def test_index_follows_updates_and_deletes(self):
+        self.air.name = "Zenbook"
+        self.air.save()
+        self.assertEqual(self.search("zenbook"), [self.air.slug])
+        self.assertNotIn(self.air.slug, self.search("macbook"))
+        self.pro.delete()
+        self.assertEqual(self.search("cafe"), [])
+        self.pro.is_deleted = False
+        self.pro.save()
+        self.assertEqual(self.search("cafe"), [self.pro.slug])
+        self.pro.hard_delete()
+        self.assertEqual(self.search("cafe"), [])
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT count(*) FROM shop_product_fts")
+            self.assertEqual(cursor.fetchone()[0], 2)
+
+    def test_index_survives_renumbered_rowids(self):
+        if connection.vendor != "sqlite":
+            self.skipTest("The index is SQLite FTS5")
+        # What VACUUM may do to a table without an INTEGER PRIMARY KEY
+        with connection.cursor() as cursor:
+            cursor.execute("UPDATE shop_product SET rowid = rowid + 100")
+        self.air.name, self.air.desc = "Zenbook", "Thin"
+        self.air.save()
+        self.assertEqual(self.search("zenbook"), [self.air.slug])
+        self.assertEqual(self.search("alumin"), [])
+        self.assertEqual(set(self.search("macbook")), {self.pro.slug, self.desk.slug})
+
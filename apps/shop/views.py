@@ -2,7 +2,10 @@ from itertools import product
 from venv import create
 
 from django.core.serializers import serialize
+from django.db import IntegrityError, transaction
+from django.db.models import DecimalField, ExpressionWrapper, F, OuterRef, Subquery
 from drf_spectacular.utils import extend_schema, OpenApiParameter, OpenApiTypes
+from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.utils.mediatypes import order_by_precedence
 from rest_framework.views import APIView
@@ -10,72 +13,187 @@ from rest_framework import status
 from unicodedata import category
 
 from apps.common.permissions import IsAdminOrReadOnly, IsAuthenticatedOrReadOnly, IsOwner
-from apps.common.utils import set_dict_attr
-from apps.shop.serializers import CategorySerializer, ProductSerializer, ReviewSerializer
+from apps.common.cache import bump_versions, cache_response, get_versions
+from apps.common.conditional import (
+    not_modified_response, object_validators, queryset_validators, set_validators, version_validators,
+)
+from apps.common.utils import set_dict_attr, stream_ndjson
+from apps.shop.serializers import CategorySerializer, CategoryTreeSerializer, ProductSerializer, ProductProjection, ProductSearchSerializer, \
+    ReviewSerializer, PriceHistoryQuerySerializer, PriceSeriesSerializer
 from rest_framework.pagination import PageNumberPagination
 
-from apps.shop.models import Category, Product, Review
+from apps.shop.models import Category, Product, Review, subtree_range
 from apps.sellers.models import Seller
-from apps.profiles.models import Order, OrderItem, ShippingAddress
-from apps.shop.serializers import OrderItemSerializer, ToggleCartItemSerializer, \
-                                    CheckoutSerializer, OrderSerializer
+from apps.profiles.models import Order, OrderItem, SellerOrder, ShippingAddress
+from apps.shop.serializers import CartBatchSerializer, OrderItemSerializer, ToggleCartItemSerializer, \
+                                    CheckoutSerializer, OrderLineSerializer, OrderSerializer
+from apps.shop.cart import CartChanged, get_cart_store
 from apps.shop.filters import ProductFilter
-from apps.shop.schema_examples import PRODUCT_PARAM_EXAMPLE
-from apps.common.paginations import CustomPagination
+from apps.shop.facets import cached_facets, parse_facets
+from apps.shop.history import price_series
+from apps.shop.schema_examples import PRODUCT_FACETS_PARAM_EXAMPLE, PRODUCT_PARAM_EXAMPLE, \
+    PRODUCT_SEARCH_PARAM_EXAMPLE
+from apps.shop.search import search_products
+from apps.shop.stock import OutOfStock, reserve_stock
+from apps.common.paginations import CustomPagination, ProductCursorPagination
 
 tags=["Shop"]
 
+LINE_TOTAL_FIELD = DecimalField(max_digits=12, decimal_places=2)
+
+class ProductListMixin:
+    """
+        Filtering, pagination and NDJSON streaming shared by the product list endpoints.
+
+        ``ProductFilter`` is applied to the given queryset, which is then either paginated
+        (page numbers by default, keyset with ``?pagination=cursor``) or, with
+        ``?stream=ndjson``, streamed row by row without being held in memory.
+        Rows are read through ``projection_class`` (a ``.values()`` fast path with
+        the same output as ``ProductSerializer``) when one is set.
+        Views that set ``facet_scopes`` also answer ``?facets=category,price,in_stock``
+        with a ``facets`` key holding the counts for the current filters.
+        The ETag comes from the version counters of the view's cache ``scopes``,
+        which every write to a listed product bumps.
+    """
+    serializer_class = ProductSerializer
+    projection_class = ProductProjection
+    pagination_class = CustomPagination
+    cursor_pagination_class = ProductCursorPagination
+    stream_chunk_size = 500
+    facet_scopes = None
+
+    def get_paginator(self, request):
+        # ?pagination=cursor (or any ?cursor=) switches to keyset pages without COUNT/OFFSET
+        if request.query_params.get("pagination") == "cursor" or "cursor" in request.query_params:
+            return self.cursor_pagination_class()
+        return self.pagination_class()
+
+    def list_products(self, request, products, scopes):
+        filterset = ProductFilter(request.query_params, queryset=products)
+        if not filterset.is_valid():
+            return Response(filterset.errors, status=400)
+        queryset = filterset.qs
+        etag, last_modified = version_validators(request, get_versions([*scopes, *(self.facet_scopes or ())]))
+        not_modified = not_modified_response(request, etag, last_modified)
+        if not_modified:
+            return not_modified
+        ordering = self.cursor_pagination_class.orderings.get(request.query_params.get("ordering"))
+        if ordering:
+            queryset = queryset.order_by(*ordering)
+        serializer_class = self.serializer_class
+        if self.projection_class is not None:
+            queryset = self.projection_class.project(queryset)
+            serializer_class = self.projection_class
+        if request.query_params.get("stream") == "ndjson":
+            response = stream_ndjson(queryset, serializer_class, self.stream_chunk_size)
+        else:
+            paginator = self.get_paginator(request)
+            paginated_queryset = paginator.paginate_queryset(queryset, request, view=self)
+            serializer = serializer_class(paginated_queryset, many=True)
+            response = paginator.get_paginated_response(serializer.data)
+            facets = parse_facets(request.query_params.get("facets"))
+            if facets and self.facet_scopes:
+                response.data["facets"] = cached_facets(filterset, facets, list(self.facet_scopes))
+        return set_validators(response, etag, last_modified)
+
+
+def build_category_tree(categories):
+    """
+        Nests ``categories`` (ordered by path, so parents come first) under
+        their parents' ``tree_children``, sorted by name. Returns the roots.
+    """
+    nodes = {}
+    roots = []
+    for category in categories:
+        category.tree_children = []
+        nodes[category.id] = category
+        siblings = nodes[category.parent_id].tree_children if category.parent_id else roots
+        siblings.append(category)
+    for category in nodes.values():
+        category.tree_children.sort(key=lambda child: child.name)
+    roots.sort(key=lambda root: root.name)
+    return roots
+
+
 class CategoriesView(APIView):
     permission_classes = [IsAdminOrReadOnly]
     serializer_class = CategorySerializer
     @extend_schema(
         summary="Categories Fetch",
         description="""
-                This endpoint returns all categories.
+                This endpoint returns the category tree: the root categories, each with its
+                subcategories nested under `children`.
             """,
-        tags=tags
+        tags=tags,
+        responses=CategoryTreeSerializer(many=True),
     )
+    @cache_response("categories")
     def get(self, request, *args, **kwargs):
         categories = Category.objects.all()
-        serializer = self.serializer_class(categories, many=True)
-        return Response(data=serializer.data, status=200)
+        etag, last_modified = queryset_validators(request, categories)
+        not_modified = not_modified_response(request, etag, last_modified)
+        if not_modified:
+            return not_modified
+        # The whole tree in one query: ordering by path lists every parent before its children
+        tree = build_category_tree(categories.order_by("path"))
+        serializer = CategoryTreeSerializer(tree, many=True)
+        return set_validators(Response(data=serializer.data, status=200), etag, last_modified)
 
 
     @extend_schema(
         summary="Category Creating",
         description="""
-                This endpoint creates categories.
+                This endpoint creates categories. Pass `parent_slug` to create a subcategory.
             """,
         tags=tags
     )
     def post(self, request, *args, **kwargs):
         serializer = self.serializer_class(data=request.data)
         if serializer.is_valid():
-            new_cat = Category.objects.create(**serializer.validated_data)
+            data = serializer.validated_data
+            parent_slug = data.pop("parent_slug", None)
+            if parent_slug:
+                data["parent"] = Category.objects.get_or_none(slug=parent_slug)
+                if not data["parent"]:
+                    return Response(data={"message": "Parent category does not exist!"}, status=404)
+            try:
+                with transaction.atomic():
+                    new_cat = Category.objects.create(**data)
+            except IntegrityError:
+                # Lost a race with another request creating the same name; the stored
+                # image is unreferenced and will be removed by collect_media_garbage
+                return Response({"name": ["category with this name already exists."]}, status=400)
+            except ValueError as exc:
+                return Response({"parent_slug": [str(exc)]}, status=400)
+            bump_versions("categories")
             serializer = self.serializer_class(new_cat)
             return Response(serializer.data, status=201)
         else:
             return Response(serializer.errors, status=400)
         
 
-class ProductsByCategoryView(APIView):
+class ProductsByCategoryView(ProductListMixin, APIView):
     serializer_class = ProductSerializer
 
     @extend_schema(
         operation_id="category_products",
         summary="Category Products Fetch",
         description="""
-                This endpoint returns all products in a particular category.
+                This endpoint returns all products in a particular category and its subcategories.
             """,
-        tags=tags
+        tags=tags,
+        parameters=PRODUCT_PARAM_EXAMPLE,
     )
+    @cache_response("category:{slug}")
     def get(self, request, *args, **kwargs):
         category = Category.objects.get_or_none(slug=kwargs["slug"])
         if not category:
             return Response(data={"message": "Category does not exist!"}, status=404)
-        products = Product.objects.select_related("category", "seller", "seller__user").filter(category=category)
-        serializer = self.serializer_class(products, many=True)
-        return Response(data=serializer.data, status=200)
+        # The whole subtree as one range of the category path index
+        products = Product.objects.select_related("category", "seller", "seller__user").filter(
+            **subtree_range(category.path, "category__path")
+        )
+        return self.list_products(request, products, [f"category:{category.slug}"])
 
 class ProductsView_version_1(APIView):
     serializer_class = ProductSerializer
@@ -135,31 +253,55 @@ class ProductsView_version_2(APIView):
         serializer = self.serializer_class(products, many=True)
         return Response(data=serializer.data, status=200)
 
-class ProductsView(APIView):
+class ProductsView(ProductListMixin, APIView):
     serializer_class = ProductSerializer
-    pagination_class = CustomPagination
+    facet_scopes = ("products", "categories")
+
     @extend_schema(
         operation_id="all_products",
         summary="Product Fetch",
         description="""
                 This endpoint returns all products.
+                With ?facets=category,price,in_stock the page also carries the number of
+                matching products per category, price bucket and stock state.
             """,
         tags=tags,
-        parameters=PRODUCT_PARAM_EXAMPLE,
+        parameters=PRODUCT_PARAM_EXAMPLE + PRODUCT_FACETS_PARAM_EXAMPLE,
+    )
+    @cache_response("products")
+    def get(self, request, *args, **kwargs):
+        products = Product.objects.select_related("category", "seller", "seller__user").all()
+        return self.list_products(request, products, ["products"])
+
+class ProductSearchView(APIView):
+    serializer_class = ProductSearchSerializer
+    pagination_class = CustomPagination
+
+    @extend_schema(
+        operation_id="product_search",
+        summary="Product Search",
+        description="""
+                This endpoint returns products whose name or description match the query,
+                best match first, with the matched words highlighted in the snippet.
+            """,
+        tags=tags,
+        parameters=PRODUCT_SEARCH_PARAM_EXAMPLE,
     )
     def get(self, request, *args, **kwargs):
+        q = request.query_params.get("q", "").strip()
+        if not q:
+            return Response(data={"message": "The search query 'q' is required"}, status=400)
         products = Product.objects.select_related("category", "seller", "seller__user").all()
         filterset = ProductFilter(request.query_params, queryset=products)
-        if filterset.is_valid():
-            queryset = filterset.qs
-            paginator = self.pagination_class()
-            paginated_queryset = paginator.paginate_queryset(queryset, request)
-            serializer = self.serializer_class(paginated_queryset, many=True)
-            return paginator.get_paginated_response(serializer.data)
-        else:
+        if not filterset.is_valid():
             return Response(filterset.errors, status=400)
+        queryset = search_products(filterset.qs, q)
+        paginator = self.pagination_class()
+        paginated_queryset = paginator.paginate_queryset(queryset, request, view=self)
+        serializer = self.serializer_class(paginated_queryset, many=True)
+        return paginator.get_paginated_response(serializer.data)
 
-class ProductsBySellerView(APIView):
+class ProductsBySellerView(ProductListMixin, APIView):
     serializer_class = ProductSerializer
 
     @extend_schema(
@@ -167,15 +309,16 @@ class ProductsBySellerView(APIView):
         description="""
                 This endpoint returns all products in a particular seller.
             """,
-        tags=tags
+        tags=tags,
+        parameters=PRODUCT_PARAM_EXAMPLE,
     )
+    @cache_response("seller:{slug}")
     def get(self, request, *args, **kwargs):
         seller = Seller.objects.get_or_none(slug=kwargs["slug"])
         if not seller:
             return Response(data={"message": "Seller does not exist!"}, status=404)
         products = Product.objects.select_related("category", "seller", "seller__user").filter(seller=seller)
-        serializer = self.serializer_class(products, many=True)
-        return Response(data=serializer.data, status=200)
+        return self.list_products(request, products, [f"seller:{seller.slug}"])
 
 class ProductView(APIView):
     serializer_class = ProductSerializer
@@ -192,14 +335,45 @@ class ProductView(APIView):
             """,
         tags=tags
     )
+    @cache_response("product:{slug}")
     def get(self, request, *args, **kwargs):
         product = self.get_object(kwargs["slug"])
         if not product:
             return Response(data={"message": "Product does not exist!"}, status=404)
+        etag, last_modified = object_validators(request, product)
+        not_modified = not_modified_response(request, etag, last_modified)
+        if not_modified:
+            return not_modified
         serializer = self.serializer_class(product)
+        return set_validators(Response(data=serializer.data, status=200), etag, last_modified)
+
+class ProductPriceHistoryView(APIView):
+    serializer_class = PriceSeriesSerializer
+
+    @extend_schema(
+        summary="Product Price History",
+        description="""
+                This endpoint returns the price history of a product, downsampled for charts:
+                the lowest and highest price per hour / day / week / month bucket over the
+                last `days`. The bucket size is chosen to give at most `points` buckets
+                unless `interval` is passed.
+            """,
+        tags=tags,
+        parameters=[PriceHistoryQuerySerializer],
+    )
+    @cache_response("product:{slug}")
+    def get(self, request, *args, **kwargs):
+        product = Product.objects.get_or_none(slug=kwargs["slug"])
+        if not product:
+            return Response(data={"message": "Product does not exist!"}, status=404)
+        query = PriceHistoryQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        series = price_series(product, **query.validated_data)
+        serializer = self.serializer_class({"product": product, **series})
         return Response(data=serializer.data, status=200)
 
 class CartView(APIView):
+    permission_classes = [IsAuthenticated]
     serializer_class = OrderItemSerializer
 
     @extend_schema(
@@ -210,16 +384,13 @@ class CartView(APIView):
         tags=tags,
     )
     def get(self, request, *args, **kwargs):
-        user = request.user
-        orderitems = OrderItem.objects.filter(user=user, order=None).select_related(
-            "product", "product__seller", "product__seller__user")
-        serializer = self.serializer_class(orderitems, many=True)
-        return Response(data=serializer.data, status=200)
+        items = get_cart_store().items(request.user)
+        return Response(data=items, status=200)
 
     @extend_schema(
         summary="Toggle Item in cart",
         description="""
-            This endpoint allows a user or guest to add/update/remove an item in cart.
+            This endpoint allows a user to add/update/remove an item in cart.
             If quantity is 0, the item is removed from cart
         """,
         tags = tags,
@@ -235,33 +406,72 @@ class CartView(APIView):
         product = Product.objects.select_related("seller", "seller__user").get_or_none(slug=data["slug"])
         if not product:
             return Response({"message": "No Product with that slug"}, status=404)
-        orderitem, created = OrderItem.objects.update_or_create(
-            user = user,
-            order_id=None,
-            product = product,
-            defaults = {"quantity": quantity},
-        )
+        # Only a hint for the buyer: the units are taken at checkout, see reserve_stock
+        if quantity > product.in_stock:
+            return Response({"message": f"Only {product.in_stock} left in stock", "in_stock": product.in_stock},
+                            status=400)
+        item, created = get_cart_store().set_quantity(user, product, quantity)
         resp_message_substring = "Update In"
         status_code = 200
         if created:
             status_code = 201
             resp_message_substring = "Added To"
-        if orderitem.quantity == 0:
+        if quantity == 0:
             resp_message_substring = "Removed From"
-            orderitem.delete()
-            data = None
-        if resp_message_substring != "Removed From":
-            serializer = self.serializer_class(orderitem)
-            data = serializer.data
-        return Response(data={"message": f"Item {resp_message_substring} Cart", "item": data}, status=status_code)
+        return Response(data={"message": f"Item {resp_message_substring} Cart", "item": item}, status=status_code)
+
+class CartBatchView(APIView):
+    permission_classes = [IsAuthenticated]
+    serializer_class = CartBatchSerializer
+
+    @extend_schema(
+        summary="Update many items in cart",
+        description="""
+            This endpoint applies a list of {slug, quantity} changes to the user's cart at once,
+            e.g. to sync a cart built offline. A quantity of 0 removes the item; when a slug is
+            listed twice, the last change wins. Nothing is changed if a slug is unknown (404) or
+            asks for more than is in stock (400). The response is the whole cart.
+        """,
+        tags=tags,
+        request=CartBatchSerializer,
+    )
+    def post(self, request, *args, **kwargs):
+        serializer = self.serializer_class(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        changes = serializer.validated_data["items"]
+        # Every product in one query
+        products = {
+            product.slug: product
+            for product in Product.objects.select_related("seller", "seller__user").filter(
+                slug__in={change["slug"] for change in changes}
+            )
+        }
+        missing = sorted({change["slug"] for change in changes} - set(products))
+        if missing:
+            return Response({"message": "No Product with that slug", "products": missing}, status=404)
+        short = sorted({change["slug"] for change in changes if change["quantity"] > products[change["slug"]].in_stock})
+        if short:
+            return Response({
+                "message": "Not enough stock",
+                "in_stock": {slug: products[slug].in_stock for slug in short},
+            }, status=400)
+        items = get_cart_store().set_quantities(
+            request.user, [(products[change["slug"]], change["quantity"]) for change in changes]
+        )
+        return Response(data={"message": "Cart Updated", "items": items}, status=200)
 
 class CheckoutView(APIView):
+    permission_classes = [IsAuthenticated]
     serializer_class = CheckoutSerializer
 
     @extend_schema(
         summary="Checkout",
         description="""
                    This endpoint allows a user to create an order through which payment can then be made through.
+                   The stock of every cart item is reserved with the order; if any product has fewer
+                   units left than the cart asks for, nothing is reserved and the response is a 409
+                   naming those products. A cart ordered or changed by a parallel request
+                   meanwhile also gets a 409, with nothing reserved.
                    """,
         tags=tags,
         request=CheckoutSerializer,
@@ -269,18 +479,17 @@ class CheckoutView(APIView):
     def post(self, request, *args, **kwargs):
         # Proceed to checkout
         user = request.user
-        orderitems = OrderItem.objects.filter(user=user, order=None)
-        if not orderitems.exists():
+        cart = get_cart_store()
+        cart.persist(user.pk)
+        cart_lines = list(OrderItem.objects.filter(user=user, order=None).values_list("id", "product_id", "quantity"))
+        if not cart_lines:
             return Response({"message": "No Items in Cart"}, status=404)
 
         serializer = self.serializer_class(data=request.data)
         serializer.is_valid(raise_exception=True)
-        data = serializer.validated_data
-        shipping_id = data.get("shipping_id")
-        if shipping_id:
-            shipping = ShippingAddress.objects.get_or_none(id=shipping_id)
-            if not shipping:
-                return Response({"message": "No shipping address with that ID"}, status=404)
+        shipping = ShippingAddress.objects.get_or_none(id=serializer.validated_data["shipping_id"], user=user)
+        if not shipping:
+            return Response({"message": "No shipping address with that ID"}, status=404)
 
         fields_to_update = [
             "full_name",
@@ -296,9 +505,40 @@ class CheckoutView(APIView):
             value = getattr(shipping, field)
             data[field] = value
 
-        order = Order.objects.create(user=user, **data)
-        orderitems.update(order=order)
-
+        # A fixed number of statements however big the cart is: one UPDATE claims the
+        # lines and snapshots their prices, they are read back once, and one UPDATE
+        # reserves the stock of exactly what was claimed.
+        try:
+            with transaction.atomic():
+                order = Order.objects.create(user=user, **data)
+                price = Subquery(Product.objects.unfiltered().filter(pk=OuterRef("product_id")).values("price_current"))
+                # Only the lines read above, not items added to the cart meanwhile. The
+                # UPDATE re-checks order=None, so a parallel checkout cannot claim them too
+                claimed = OrderItem.objects.filter(id__in=[item_id for item_id, _, _ in cart_lines], order=None).update(
+                    order=order,
+                    unit_price=price,
+                    line_total=ExpressionWrapper(price * F("quantity"), output_field=LINE_TOTAL_FIELD),
+                )
+                if claimed != len(cart_lines):
+                    raise CartChanged()
+                # Read back once for the stock, the totals and the lines the order history shows (Order.summary)
+                items = list(OrderItem.objects.filter(order=order).select_related("product__seller"))
+                # The quantities as claimed, in the same transaction, not as read before it
+                reserve_stock((item.product_id, item.quantity) for item in items)
+                order.subtotal = order.total = sum(item.line_total for item in items)
+                summary_lines = OrderLineSerializer(items, many=True).data
+                order.summary = {**order.summary, "items": summary_lines}
+                Order.objects.filter(pk=order.pk).update(
+                    subtotal=order.subtotal, total=order.total, summary=order.summary
+                )
+                SellerOrder.record(order, items, summary_lines)
+        except OutOfStock as exc:
+            slugs = Product.objects.unfiltered().filter(id__in=exc.product_ids).values_list("slug", flat=True)
+            return Response({"message": "Not enough stock", "products": sorted(slugs)}, status=409)
+        except CartChanged:
+            return Response({"message": "The cart changed during checkout, please try again"}, status=409)
+
+        cart.clear(user.pk)
         serializer = OrderSerializer(order)
         return Response(data={"message": "Checkout Successful", "item": serializer.data}, status=200)
 
@@ -322,10 +562,14 @@ class ReviewsProductView(APIView):
     def get(self, request, *args, **kwargs):
         product = self.get_object(kwargs["slug"])
         reviews = Review.objects.filter(product=product)
-        if not reviews:
+        etag, last_modified = queryset_validators(request, reviews)
+        if last_modified is None:
             return Response(data={"message": "Reviews does not exist for this product!"}, status=404)
+        not_modified = not_modified_response(request, etag, last_modified)
+        if not_modified:
+            return not_modified
         serializer = self.serializer_class(reviews, many=True)
-        return Response(data=serializer.data, status=200)
+        return set_validators(Response(data=serializer.data, status=200), etag, last_modified)
 
     @extend_schema(
         summary="Review Items for one product",
@@ -346,6 +590,7 @@ class ReviewsProductView(APIView):
             if serializer.is_valid():
                 data = serializer.validated_data
                 new_review = Review.objects.create(user=user, product=product, **data)
+                bump_versions(*product.cache_scopes())
                 serializer = self.serializer_class(new_review)
                 return Response(serializer.data, status=201)
             else:
@@ -395,6 +640,7 @@ class ReviewUserProductView(APIView):
         data = serializer.validated_data
         review = set_dict_attr(review, data)
         review.save()
+        bump_versions(*product.cache_scopes())
         serializer = self.serializer_class(review)
         return Response(data=serializer.data, status=200)
 
@@ -412,4 +658,5 @@ class ReviewUserProductView(APIView):
         if not review:
             return Response(data={"message": "Review does not exist!"}, status=404)
         review.delete()
+        bump_versions(*product.cache_scopes())
         return Response(data={"message": "Review deleted successfully"}, status=200)
\ No newline at end of file
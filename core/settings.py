@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 from datetime import timedelta
 
@@ -142,6 +143,17 @@ AUTH_USER_MODEL = "accounts.User"
 MEDIA_ROOT = BASE_DIR / 'media'
 MEDIA_URL = '/media/'
 
+# Uploads are named by the SHA-256 of their content, so identical files are stored once
+# (see apps.common.storage); unreferenced files are removed by `manage.py collect_media_garbage`
+STORAGES = {
+    "default": {
+        "BACKEND": "apps.common.storage.ContentAddressedStorage",
+    },
+    "staticfiles": {
+        "BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage",
+    },
+}
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework_simplejwt.authentication.JWTAuthentication',
@@ -174,6 +186,49 @@ SPECTACULAR_SETTINGS = {
         },
 }
 
+# One cache shared by every worker process: response cache versions and throttles
+# must be the same for all of them (see apps.common.cache). Redis when REDIS_URL
+# is set, else the database (its table is created by migrate). The common.E001
+# check refuses per-process backends such as LocMemCache. Carts are only cached
+# with Redis, in their own alias (see CART_STORE).
+REDIS_URL = os.environ.get("REDIS_URL")
+if REDIS_URL:
+    CACHES = {
+        "default": {"BACKEND": "django.core.cache.backends.redis.RedisCache", "LOCATION": REDIS_URL},
+        # Carts are not recomputable like catalog responses: CART_REDIS_URL can point
+        # them at a Redis database that never evicts (maxmemory-policy noeviction)
+        "carts": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": os.environ.get("CART_REDIS_URL", REDIS_URL),
+            "KEY_PREFIX": "carts",
+        },
+    }
+else:
+    CACHES = {
+        "default": {"BACKEND": "django.core.cache.backends.db.DatabaseCache", "LOCATION": "django_cache"},
+    }
+
+# Seconds a catalog response stays in the cache (see apps.common.cache)
+CATALOG_CACHE_TIMEOUT = 300
+
+# Seconds a process keeps its response cache hit/miss counts before adding them
+# to the shared totals
+CACHE_STATS_FLUSH_INTERVAL = 60
+
+# Where carts are kept (see apps.shop.cart): in the CART_CACHE_ALIAS cache, written
+# to the database at checkout and by the flush_carts command, or
+# "apps.shop.cart.DatabaseCartStore". Without a Redis "carts" cache (no REDIS_URL)
+# carts are kept in the database.
+CART_STORE = "apps.shop.cart.CacheCartStore"
+CART_CACHE_ALIAS = "carts"
+CART_CACHE_TIMEOUT = 60 * 60 * 24 * 30
+
+# Seconds a seller profile stays in the cache for permission checks (see apps.sellers.principal)
+SELLER_CACHE_TIMEOUT = 300
+
+# Threads generating thumbnails / WebP variants of uploads (see apps.common.images)
+IMAGE_VARIANT_WORKERS = 2
+
 SIMPLE_JWT = {
     'ROTATE_REFRESH_TOKENS': True,
     'BLACKLIST_AFTER_ROTATION': True,
@@ -18,6 +18,8 @@ from django.contrib import admin
 from django.urls import path, include
 from drf_spectacular.views import SpectacularAPIView, SpectacularSwaggerView
 
+from apps.common.views import CacheStatsView
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path("api/schema/", SpectacularAPIView.as_view(), name="schema"),
@@ -26,5 +28,6 @@ urlpatterns = [
     path("profiles/", include("apps.profiles.urls")),
     path("sellers/", include("apps.sellers.urls")),
     path("shop/", include("apps.shop.urls")),
+    path("cache/stats/", CacheStatsView.as_view()),
 
 ]